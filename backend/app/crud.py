@@ -89,6 +89,25 @@ def create_attendance(db: Session, attendance: schemas.AttendanceCreate):
     db.refresh(db_attendance)
     return db_attendance
 
+def create_attendance_bulk(db: Session, attendances: list[schemas.AttendanceCreate]):
+    """
+    Records many attendance rows in a single transaction.
+    """
+    db_attendances = [
+        models.Attendance(
+            student_id=attendance.student_id,
+            status=attendance.status,
+            verification_confidence=str(attendance.verification_confidence),
+            subject=attendance.subject,
+            session_id=attendance.session_id
+        )
+        for attendance in attendances
+    ]
+    db.add_all(db_attendances)
+    db.commit()
+    for db_attendance in db_attendances:
+        db.refresh(db_attendance)
+    return db_attendances
 
 def get_attendance_records(db: Session, skip: int = 0, limit: int = 100, subjects: list[str] = None, session_id: int = None):
     query = db.query(models.Attendance).options(joinedload(models.Attendance.student))
@@ -166,6 +185,16 @@ def get_active_live_sessions(db: Session, department: str = None, year: str = No
         query = query.filter(models.LiveSession.division == division)
     return query.all()
 
+def get_session_roster(db: Session, live_session: models.LiveSession):
+    # Students expected in a live session: same department and year, and division if the session has one
+    query = db.query(models.Student).filter(
+        models.Student.department == live_session.department,
+        models.Student.year == live_session.year
+    )
+    if live_session.division:
+        query = query.filter(models.Student.division == live_session.division)
+    return query.all()
+
 def end_live_session(db: Session, session_id: int):
     db_session = db.query(models.LiveSession).filter(models.LiveSession.id == session_id).first()
     if db_session:
@@ -39,6 +39,11 @@ async def mark_attendance(
     try:
         # Pass student.id to enforce 1:1 verification against their registered face
         verification_result = await ml_client.verify_attendance(file, student_id=str(student.id))
+    except HTTPException as e:
+        if e.status_code == 503:
+            # ML service busy or unreachable: keep the 503 (and Retry-After) so clients back off
+            raise
+        raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Verification failed: {str(e)}")
     
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List
 
 from .. import crud, schemas, models
 from ..database import get_db
 from ..dependencies import get_current_active_user
+from ..services.ml_client import ml_client
 
 router = APIRouter(
     prefix="/sessions",
@@ -48,3 +49,121 @@ def end_session(
     if current_user.role not in ["faculty", "teacher", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     return crud.end_live_session(db, session_id=session_id)
+
+@router.post("/{session_id}/roll-call", response_model=schemas.RollCallResult)
+async def roll_call(
+    session_id: int,
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Marks attendance for a live session from one or a few classroom photos.
+    Every face is matched one-to-one against the session's roster by the ML service,
+    and all matches are recorded in one transaction.
+    """
+    if current_user.role not in ["faculty", "teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    live_session = db.query(models.LiveSession).filter(
+        models.LiveSession.id == session_id,
+        models.LiveSession.is_active == True
+    ).first()
+    if not live_session:
+        raise HTTPException(status_code=400, detail="This session is no longer active.")
+
+    roster = crud.get_session_roster(db, live_session)
+    if not roster:
+        raise HTTPException(status_code=404, detail="No students found for this session's class")
+
+    try:
+        result = await ml_client.identify_group(files, candidate_ids=[str(student.id) for student in roster])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Roll call failed: {str(e)}")
+
+    already_marked = {
+        row[0] for row in db.query(models.Attendance.student_id).filter(
+            models.Attendance.session_id == session_id
+        ).all()
+    }
+
+    attendances = []
+    skipped = []
+    for match in result.get("matches", []):
+        student_id = int(match["student_id"])
+        if student_id in already_marked:
+            skipped.append(student_id)
+            continue
+        already_marked.add(student_id)
+        attendances.append(schemas.AttendanceCreate(
+            student_id=student_id,
+            status="PRESENT",
+            verification_confidence=match.get("confidence", 0.0),
+            subject=live_session.subject,
+            session_id=session_id
+        ))
+
+    marked = crud.create_attendance_bulk(db, attendances=attendances) if attendances else []
+
+    return {
+        "session_id": session_id,
+        "faces_detected": result.get("faces_detected", 0),
+        "roster_size": len(roster),
+        "marked": marked,
+        "already_marked": skipped,
+        "unmatched_faces": len(result.get("unmatched_faces", []))
+    }
+
+@router.post("/{session_id}/identify", response_model=schemas.Attendance)
+async def identify_in_session(
+    session_id: int,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Marks attendance for whoever is in the photo (e.g. at a classroom kiosk).
+    The face is only searched among the session's roster rather than every registered student.
+    """
+    if current_user.role not in ["faculty", "teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    live_session = db.query(models.LiveSession).filter(
+        models.LiveSession.id == session_id,
+        models.LiveSession.is_active == True
+    ).first()
+    if not live_session:
+        raise HTTPException(status_code=400, detail="This session is no longer active.")
+
+    roster = crud.get_session_roster(db, live_session)
+    if not roster:
+        raise HTTPException(status_code=404, detail="No students found for this session's class")
+
+    try:
+        result = await ml_client.verify_attendance(file, candidate_ids=[str(student.id) for student in roster])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Identification failed: {str(e)}")
+
+    if not result.get("matched", False):
+        raise HTTPException(status_code=401, detail="Face not recognized among this session's students.")
+
+    student_id = int(result["student_id"])
+    already_marked = db.query(models.Attendance).filter(
+        models.Attendance.session_id == session_id,
+        models.Attendance.student_id == student_id
+    ).first()
+    if already_marked:
+        raise HTTPException(status_code=409, detail="Attendance already marked for this session.")
+
+    attendance_data = schemas.AttendanceCreate(
+        student_id=student_id,
+        status="PRESENT",
+        verification_confidence=result.get("confidence", 0.0),
+        subject=live_session.subject,
+        session_id=session_id
+    )
+    return crud.create_attendance(db, attendance=attendance_data)
@@ -179,6 +179,15 @@ class LiveSession(LiveSessionBase):
 
     class Config:
         from_attributes = True
+
+class RollCallResult(BaseModel):
+    session_id: int
+    faces_detected: int
+    roster_size: int
+    marked: List[Attendance]
+    already_marked: List[int]
+    unmatched_faces: int
+
 class ResultBase(BaseModel):
     student_id: int
     subject_id: int
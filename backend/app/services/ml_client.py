@@ -1,11 +1,21 @@
 import httpx
 from fastapi import UploadFile, HTTPException
 import logging
+from typing import List, Optional
 
 ML_SERVICE_URL = "http://127.0.0.1:8001"
 
 logger = logging.getLogger(__name__)
 
+def _raise_for_ml_error(exc: httpx.HTTPStatusError):
+    """
+    Re-raises an error response from the ML service with its status code.
+    """
+    logger.error(f"Error response {exc.response.status_code} while requesting {exc.request.url!r}.")
+    # Pass the ML service's back-off hint on when it sheds load
+    retry_after = exc.response.headers.get("Retry-After")
+    raise HTTPException(status_code=exc.response.status_code, detail=f"ML Service error: {exc.response.text}", headers={"Retry-After": retry_after} if retry_after else None)
+
 class MLClient:
     def __init__(self, base_url=ML_SERVICE_URL):
         self.base_url = base_url
@@ -34,14 +44,14 @@ class MLClient:
                 logger.error(f"An error occurred while requesting {exc.request.url!r}: {exc}")
                 raise HTTPException(status_code=503, detail=f"ML Service unavailable: {str(exc)}")
             except httpx.HTTPStatusError as exc:
-                logger.error(f"Error response {exc.response.status_code} while requesting {exc.request.url!r}.")
-                raise HTTPException(status_code=exc.response.status_code, detail=f"ML Service error: {exc.response.text}")
+                _raise_for_ml_error(exc)
 
-    async def verify_attendance(self, image_file: UploadFile, student_id: str = None):
+    async def verify_attendance(self, image_file: UploadFile, student_id: str = None, candidate_ids: Optional[List[str]] = None):
         """
         Sends the image to the ML service to verify identity.
         Expected ML endpoint: POST /verify
-        Form data: file, student_id (optional)
+        Form data: file, student_id (optional), candidate_ids (repeated, optional)
+        Without student_id, candidate_ids limits identification to those students.
         """
         url = f"{self.base_url}/verify"
         
@@ -52,6 +62,68 @@ class MLClient:
         data = {}
         if student_id:
             data["student_id"] = student_id
+        if candidate_ids:
+            data["candidate_ids"] = candidate_ids
+
+        async with httpx.AsyncClient(trust_env=False) as client:
+            try:
+                response = await client.post(url, files=files, data=data, timeout=60.0)
+                response.raise_for_status()
+                return response.json()
+            except httpx.RequestError as exc:
+                logger.error(f"An error occurred while requesting {exc.request.url!r}: {exc}")
+                raise HTTPException(status_code=503, detail=f"ML Service unavailable: {str(exc)}")
+            except httpx.HTTPStatusError as exc:
+                _raise_for_ml_error(exc)
+
+    async def verify_attendance_batch(self, image_files: List[UploadFile], student_ids: Optional[List[str]] = None, candidate_ids: Optional[List[str]] = None):
+        """
+        Sends many images to the ML service in one request.
+        Expected ML endpoint: POST /verify/batch
+        Form data: files (repeated), student_ids (repeated, optional, one per file),
+        candidate_ids (repeated, optional)
+        Returns a list of per-image results in upload order.
+        """
+        url = f"{self.base_url}/verify/batch"
+
+        files = []
+        for image_file in image_files:
+            file_content = await image_file.read()
+            await image_file.seek(0)
+            files.append(("files", (image_file.filename, file_content, image_file.content_type)))
+        data = {}
+        if student_ids:
+            data["student_ids"] = student_ids
+        if candidate_ids:
+            data["candidate_ids"] = candidate_ids
+
+        async with httpx.AsyncClient(trust_env=False) as client:
+            try:
+                response = await client.post(url, files=files, data=data, timeout=60.0)
+                response.raise_for_status()
+                return response.json()
+            except httpx.RequestError as exc:
+                logger.error(f"An error occurred while requesting {exc.request.url!r}: {exc}")
+                raise HTTPException(status_code=503, detail=f"ML Service unavailable: {str(exc)}")
+            except httpx.HTTPStatusError as exc:
+                _raise_for_ml_error(exc)
+
+    async def identify_group(self, image_files: List[UploadFile], candidate_ids: Optional[List[str]] = None):
+        """
+        Sends classroom photos to the ML service for group roll call.
+        Expected ML endpoint: POST /identify/group
+        Form data: files (repeated), candidate_ids (repeated, optional)
+        """
+        url = f"{self.base_url}/identify/group"
+
+        files = []
+        for image_file in image_files:
+            file_content = await image_file.read()
+            await image_file.seek(0)
+            files.append(("files", (image_file.filename, file_content, image_file.content_type)))
+        data = {}
+        if candidate_ids:
+            data["candidate_ids"] = candidate_ids
 
         async with httpx.AsyncClient(trust_env=False) as client:
             try:
@@ -62,7 +134,6 @@ class MLClient:
                 logger.error(f"An error occurred while requesting {exc.request.url!r}: {exc}")
                 raise HTTPException(status_code=503, detail=f"ML Service unavailable: {str(exc)}")
             except httpx.HTTPStatusError as exc:
-                logger.error(f"Error response {exc.response.status_code} while requesting {exc.request.url!r}.")
-                raise HTTPException(status_code=exc.response.status_code, detail=f"ML Service error: {exc.response.text}")
+                _raise_for_ml_error(exc)
 
 ml_client = MLClient()
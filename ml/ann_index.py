@@ -0,0 +1,122 @@
+import numpy as np
+from typing import Callable, Optional
+
+
+class _RowList:
+    """
+    Growable int64 array. Appends write the value before bumping the size, so a
+    concurrent reader always sees a consistent prefix.
+    """
+
+    def __init__(self, rows: Optional[np.ndarray] = None):
+        rows = np.zeros(0, dtype=np.int64) if rows is None else rows.astype(np.int64)
+        self._rows = np.zeros(max(16, rows.size * 2), dtype=np.int64)
+        self._rows[:rows.size] = rows
+        self._size = rows.size
+
+    def append(self, row: int):
+        if self._size == self._rows.size:
+            grown = np.zeros(self._rows.size * 2, dtype=np.int64)
+            grown[:self._size] = self._rows[:self._size]
+            self._rows = grown
+        self._rows[self._size] = row
+        self._size += 1
+
+    def view(self) -> np.ndarray:
+        size = self._size
+        return self._rows[:size]
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over the unit rows of an
+    EmbeddingGallery.
+
+    Rows are clustered around n_lists centroids (spherical k-means). A query only
+    scores the rows filed under its n_probe closest centroids, so a search over
+    N rows costs roughly n_lists + N * n_probe / n_lists dot products instead of N.
+    Raising n_probe trades latency for recall. New rows are filed under their
+    nearest centroid without retraining.
+    """
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, train_iters: int = 10, max_train_size: int = 50000, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iters = train_iters
+        self.max_train_size = max_train_size
+        self.seed = seed
+        self.centroids = None
+        self._lists = []
+        self.trained_size = 0
+
+    @staticmethod
+    def default_lists(size: int) -> int:
+        return int(min(4096, max(1, round(4 * np.sqrt(size)))))
+
+    @staticmethod
+    def _normalized(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def train(self, rows: np.ndarray, fetch: Callable[[np.ndarray], np.ndarray], chunk: int = 8192):
+        """
+        Fits centroids on (a sample of) the given gallery rows and files every one
+        of them. fetch(rows) returns those rows as float32 vectors; it is called
+        chunk by chunk, so a memory-mapped gallery is never copied whole.
+        """
+        rng = np.random.default_rng(self.seed)
+        count = rows.size
+        n_lists = min(self.n_lists or self.default_lists(count), count)
+
+        sample_rows = rows
+        if count > self.max_train_size:
+            sample_rows = np.sort(rng.choice(rows, self.max_train_size, replace=False))
+        sample = self._normalized(fetch(sample_rows))
+
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)].copy()
+        for _ in range(self.train_iters):
+            self.centroids = centroids
+            labels = self._assign(sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Re-seed empty clusters with random points so every list is used
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+                norms[empty] = 1.0
+            centroids = sums / norms
+        self.centroids = centroids.astype(np.float32)
+
+        labels = np.concatenate([
+            self._assign(fetch(rows[start:start + chunk])) for start in range(0, count, chunk)
+        ])
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(n_lists + 1))
+        self._lists = [_RowList(rows[order[bounds[i]:bounds[i + 1]]]) for i in range(n_lists)]
+        self.trained_size = count
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def add(self, row: int, unit_vector: np.ndarray):
+        list_id = int(np.argmax(self.centroids @ unit_vector))
+        self._lists[list_id].append(row)
+
+    def candidates(self, query, n_probe: Optional[int] = None) -> np.ndarray:
+        """
+        Gallery rows filed under the n_probe centroids closest to the query.
+        """
+        q = np.asarray(query, dtype=np.float32).ravel()
+        norm = float(np.linalg.norm(q))
+        if norm > 0:
+            q = q / norm
+        n_probe = min(n_probe or self.n_probe, len(self._lists))
+        scores = self.centroids @ q
+        probe = np.argpartition(-scores, n_probe - 1)[:n_probe]
+        return np.concatenate([self._lists[i].view() for i in probe])
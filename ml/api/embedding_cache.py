@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+# Rough per-entry cost besides the embedding itself (key, face box, bookkeeping)
+_ENTRY_OVERHEAD = 512
+
+
+class CachedEmbedding(NamedTuple):
+    embedding: Optional[np.ndarray]
+    facial_area: Optional[Dict]
+    # Set instead of embedding when the upload was rejected (no face, unreadable...)
+    error: Optional[str] = None
+    # Quality gate reason (blurry, too_dark...) for rejections that call for a retake
+    reason: Optional[str] = None
+
+    @property
+    def nbytes(self) -> int:
+        return _ENTRY_OVERHEAD + (0 if self.embedding is None else self.embedding.nbytes)
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of upload embeddings keyed by a hash of the image bytes.
+
+    Clients retry uploads on flaky networks; a retry of the same bytes is answered
+    from here instead of running detection and embedding again. Only the embedding
+    and face box are cached, never match results, so a hit is still verified
+    against the current gallery. Rejections (no face, several faces) are cached
+    too, since the same bytes are rejected the same way.
+
+    Entries expire after ttl seconds and the least recently used ones are evicted
+    once the cache holds more than max_bytes.
+    """
+
+    def __init__(self, namespace: str, max_bytes: int = 64 * 2**20, ttl: float = 300.0):
+        # Part of every key, so a model or preprocessing change never serves stale embeddings
+        self.namespace = namespace.encode("utf-8")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, entry)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, data: bytes) -> str:
+        digest = hashlib.sha256(self.namespace)
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[CachedEmbedding]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: str, embedding, facial_area: Optional[Dict] = None) -> CachedEmbedding:
+        entry = CachedEmbedding(np.asarray(embedding, dtype=np.float32), facial_area)
+        self._store(key, entry)
+        return entry
+
+    def put_error(self, key: str, message: str, reason: Optional[str] = None) -> CachedEmbedding:
+        entry = CachedEmbedding(None, None, message, reason)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key: str, entry: CachedEmbedding):
+        if entry.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key: str):
+        _, entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
@@ -0,0 +1,172 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from face_recognition_module import FaceRecognitionModule
+from quality import FaceQualityError
+
+# The module used inside worker processes. With the "fork" start method it is the
+# parent's already warmed-up instance, inherited copy-on-write; with "spawn" each
+# worker builds its own in _init_worker.
+_worker_module: Optional[FaceRecognitionModule] = None
+
+
+def _init_worker(module_kwargs: Optional[Dict]):
+    global _worker_module
+    if _worker_module is None and module_kwargs is not None:
+        # Workers never search the gallery, so they skip building an ANN index
+        _worker_module = FaceRecognitionModule(**dict(module_kwargs, ann_min_size=None))
+        _worker_module.warm_up()
+
+
+def _ping() -> bool:
+    return _worker_module is not None
+
+
+def embed_upload(data: bytes) -> Tuple[list, Dict, Dict[str, float]]:
+    """
+    Decodes one upload and returns its single-face (embedding, facial_area) and
+    the milliseconds spent per pipeline stage.
+    """
+    prepared = _worker_module.prepare(data)
+    embedding, facial_area = _worker_module.embed_image(prepared)
+    return embedding, facial_area, prepared.timings
+
+
+def embed_registration(data: bytes) -> Tuple[list, Dict, Dict[str, float], bytes, Optional[list]]:
+    """
+    Like embed_upload, but also returns the PNG-encoded aligned face crop, which
+    is kept with the registration, and with a cascade the light model's embedding
+    of that crop (else None).
+    """
+    prepared = _worker_module.prepare(data)
+    embedding, facial_area, face_crop = _worker_module.embed_image_with_crop(prepared)
+    start = time.perf_counter()
+    light_embedding = _worker_module.embed_crop_light(face_crop)
+    if light_embedding is not None:
+        prepared.timings["embed_ms"] += (time.perf_counter() - start) * 1000
+    return embedding, facial_area, prepared.timings, face_crop, light_embedding
+
+
+def embed_uploads(datas: List[bytes]) -> List[Union[Tuple[list, Dict, Dict[str, float]], ValueError]]:
+    """
+    Decodes many uploads and embeds them in batched passes, returning
+    (embedding, facial_area, timings) per upload. Failures are returned in place
+    as ValueError (FaceQualityError as itself) so they pickle back to the parent.
+    """
+    results: List[Union[Tuple[list, Dict, Dict[str, float]], ValueError]] = [None] * len(datas)
+    images = []
+    positions = []
+    for i, data in enumerate(datas):
+        try:
+            images.append(_worker_module.prepare(data))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = e
+
+    for i, image, result in zip(positions, images, _worker_module.embed_images(images)):
+        if isinstance(result, Exception):
+            results[i] = result if isinstance(result, FaceQualityError) else ValueError(str(result))
+        else:
+            results[i] = result + (image.timings,)
+    return results
+
+
+def embed_uploads_light(datas: List[bytes]) -> List[Union[Tuple[list, Dict, Dict[str, float], np.ndarray], ValueError]]:
+    """
+    First stage of cascade verification: like embed_uploads, but the faces are
+    embedded with the light (cascade) model, and each result also carries the
+    face crop, as float32, for embed_crops should the main model have to decide.
+    """
+    results: List[Union[Tuple[list, Dict, Dict[str, float], np.ndarray], ValueError]] = [None] * len(datas)
+    images = []
+    positions = []
+    for i, data in enumerate(datas):
+        try:
+            images.append(_worker_module.prepare(data))
+            positions.append(i)
+        except ValueError as e:
+            results[i] = e
+
+    for i, image, result in zip(positions, images, _worker_module.embed_images_light(images)):
+        if isinstance(result, Exception):
+            results[i] = result if isinstance(result, FaceQualityError) else ValueError(str(result))
+        else:
+            embedding, facial_area, face = result
+            results[i] = (embedding, facial_area, image.timings, np.asarray(face, dtype=np.float32))
+    return results
+
+
+def embed_crops(faces: List[np.ndarray]) -> List[list]:
+    """
+    Embeds face crops from embed_uploads_light with the main model.
+    """
+    return _worker_module.embed_faces(faces)
+
+
+def embed_group_uploads(datas: List[bytes]) -> Tuple[List[Dict], List[list]]:
+    """
+    Decodes classroom photos and embeds every face in them.
+    """
+    return _worker_module.embed_group(datas)
+
+
+class InferencePool:
+    """
+    Runs the CPU-bound decode, detection and embedding stages off the event loop.
+
+    With workers > 0 they run on a process pool, so requests are served in parallel
+    across cores. The pool is started after the model is warmed up: with the "fork"
+    start method workers inherit the loaded model copy-on-write instead of loading
+    their own. With workers == 0 a single background thread is used, which keeps the
+    event loop (and health checks) responsive but does not add parallelism.
+    Gallery search stays in the parent, which owns the live gallery.
+    """
+
+    def __init__(self, module: FaceRecognitionModule, workers: int = 0, start_method: Optional[str] = None, module_kwargs: Optional[Dict] = None):
+        self.module = module
+        self.workers = workers
+        self.start_method = start_method
+        self.module_kwargs = module_kwargs
+        self._executor: Optional[Executor] = None
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        """
+        Creates the workers. Call after module.warm_up() so forked workers are warm.
+        """
+        global _worker_module
+        _worker_module = self.module
+
+        if self.workers <= 0:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+            return
+
+        methods = multiprocessing.get_all_start_methods()
+        start_method = self.start_method or ("fork" if "fork" in methods else "spawn")
+        context = multiprocessing.get_context(start_method)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(None if start_method == "fork" else self.module_kwargs,)
+        )
+        # Workers are created on demand; start them all now rather than on the first requests
+        for future in [self._executor.submit(_ping) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
@@ -0,0 +1,140 @@
+import asyncio
+import math
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from inference_pool import InferencePool, embed_uploads
+
+
+class Overloaded(Exception):
+    """
+    Raised by MicroBatcher.submit when the queue is full. retry_after is a
+    suggested wait in whole seconds.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy. Retry shortly.")
+        self.retry_after = retry_after
+
+
+class MicroBatcher:
+    """
+    Collects single-upload embedding requests that arrive together and runs them
+    through the inference pool as one embed_uploads call, i.e. one batched forward
+    pass instead of one per request.
+
+    A batch is dispatched once it holds max_batch uploads or max_wait_ms after its
+    first upload arrived, whichever comes first. At most `slots` batches run at
+    once (one per inference worker); while they do, new requests keep queueing, so
+    batches grow with load. The queue holds at most max_queue uploads; beyond that
+    submit raises Overloaded instead of letting latency grow without bound.
+    """
+
+    def __init__(self, pool: InferencePool, max_batch: int = 16, max_wait_ms: float = 5.0, max_queue: int = 256,
+                 on_batch: Optional[Callable[[int, List[float]], None]] = None, fn: Callable = embed_uploads):
+        self.pool = pool
+        # Pool function run on each batch of uploads, returning one result or exception per upload
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        # Called with (batch size, seconds each upload waited in the queue)
+        self.on_batch = on_batch
+        self.slots = max(1, pool.workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        # Moving average of batch run time, for Retry-After
+        self._batch_seconds = 0.5
+        self.shed = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        """
+        Starts the collector on the running event loop.
+        """
+        if self._collector is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._slots = asyncio.Semaphore(self.slots)
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                if not future.done():
+                    future.cancel()
+
+    def retry_after(self) -> int:
+        batches_ahead = math.ceil(self.depth / self.max_batch) / self.slots
+        return max(1, math.ceil(batches_ahead * self._batch_seconds))
+
+    async def submit(self, data: bytes) -> Tuple[list, Dict, Dict[str, float]]:
+        """
+        Embeds one upload as part of the next batch. Returns (embedding,
+        facial_area, timings) like embed_upload (or fn's result for the upload),
+        raises ValueError if the upload is rejected and Overloaded if the queue is
+        full.
+        """
+        if self._collector is None:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((data, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.shed += 1
+            raise Overloaded(self.retry_after())
+        return await future
+
+    async def _collect(self):
+        while True:
+            # Wait for a free slot first: while every slot is busy, requests pile
+            # up in the queue and the next batch is correspondingly bigger
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+                deadline = time.perf_counter() + self.max_wait
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            except BaseException:
+                self._slots.release()
+                raise
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[tuple]):
+        try:
+            # Requests cancelled while queued (client went away) are dropped
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                return
+            started = time.perf_counter()
+            if self.on_batch is not None:
+                self.on_batch(len(batch), [started - queued for _, _, queued in batch])
+            try:
+                results = await self.pool.run(self.fn, [data for data, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self._batch_seconds = 0.8 * self._batch_seconds + 0.2 * (time.perf_counter() - started)
+            for (_, future, _), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._slots.release()
@@ -1,36 +1,389 @@
 import sys
 import os
-import shutil
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+from fastapi import Body, FastAPI, File, UploadFile, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+from starlette.routing import Match
 import uvicorn
 
 # Add parent directory to path to import python modules from ml folder
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from face_recognition_module import FaceRecognitionModule
+from concurrent.futures.process import BrokenProcessPool
+from face_recognition_module import FaceRecognitionModule, RosterSlice
+from inference_pool import InferencePool, embed_crops, embed_registration, embed_uploads, embed_uploads_light, embed_group_uploads
+from embedding_cache import CachedEmbedding, EmbeddingCache
+from micro_batcher import MicroBatcher, Overloaded
+from metrics import Registry
+from preprocessing import STAGES
+from quality import QualityGate
+from sharding import decode_embedding, encode_embedding
 
-app = FastAPI(title="Face Recognition API", description="API for Student Attendance Verification")
+logger = logging.getLogger(__name__)
 
 # Initialize Face Recognition Module
 # Ensure the paths are correct relative to where the script is run or absolute
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-EMBEDDINGS_FILE = os.path.join(BASE_DIR, "embeddings", "students.json")
-TEMP_DIR = os.path.join(BASE_DIR, "data", "temp_api")
-REGISTERED_DIR = os.path.join(BASE_DIR, "data", "registered_faces")
+# Another gallery directory, e.g. one per shard behind shard_router.py. Only the
+# default gallery is converted from the legacy students.json.
+GALLERY_DIR = os.environ.get("ML_GALLERY_DIR") or os.path.join(BASE_DIR, "embeddings", "gallery")
+LEGACY_EMBEDDINGS_FILE = None if os.environ.get("ML_GALLERY_DIR") else os.path.join(BASE_DIR, "embeddings", "students.json")
+# Registration photos and face crops are kept next to the gallery, so instances
+# with their own ML_GALLERY_DIR share no files
+REGISTERED_DIR = os.path.join(os.path.dirname(os.path.normpath(GALLERY_DIR)), "registered_faces") if os.environ.get("ML_GALLERY_DIR") else os.path.join(BASE_DIR, "data", "registered_faces")
+FACE_CROP_DIR = os.path.join(os.path.dirname(os.path.normpath(GALLERY_DIR)), "face_crops")
+PORT = int(os.environ.get("ML_PORT", "8001"))
+# Recognition model. The gallery records which model made each embedding and the
+# service refuses to start on a gallery from another one; switch models with
+# migrate_gallery.py
+MODEL_NAME = os.environ.get("ML_MODEL", "VGG-Face")
+# Faces are detected on a copy of the upload downscaled to this many pixels on its
+# longest side, then cropped from the full-size image for embedding (0 = off)
+MAX_IMAGE_EDGE = int(os.environ.get("ML_MAX_IMAGE_EDGE", "0"))
+# JPEGs are decoded at 1/2, 1/4 or 1/8 size while their longest side stays at least
+# this many pixels; that size is then the "full size" faces are cropped from (0 = off)
+DECODE_EDGE = int(os.environ.get("ML_DECODE_EDGE", "0"))
+# Worker processes for detection/embedding (0 = one background thread in this process)
+INFERENCE_WORKERS = int(os.environ.get("ML_INFERENCE_WORKERS", "0"))
+# "fork" (default where available) shares the warmed-up model with workers copy-on-write;
+# "spawn" makes every worker load its own copy
+POOL_START_METHOD = os.environ.get("ML_POOL_START_METHOD") or None
+# Galleries with at least this many students are searched through an approximate
+# (IVF) index instead of a full scan (0 = always exact)
+ANN_MIN_SIZE = int(os.environ.get("ML_ANN_MIN_SIZE", "20000"))
+# Index clusters scanned per query; higher is slower but closer to exact
+ANN_PROBE = int(os.environ.get("ML_ANN_PROBE", "8"))
+# Gallery storage: "float32", "float16" or "int8", optionally reduced to this many
+# PCA dimensions (0 = off). See benchmark_quantization.py for the accuracy cost.
+GALLERY_PRECISION = os.environ.get("ML_GALLERY_PRECISION", "float32")
+PCA_COMPONENTS = int(os.environ.get("ML_PCA_COMPONENTS", "0"))
+# Embeddings of recent uploads, keyed by content hash, so client retries skip the
+# pipeline (0 = off)
+CACHE_MB = float(os.environ.get("ML_CACHE_MB", "64"))
+CACHE_TTL = float(os.environ.get("ML_CACHE_TTL", "300"))
+# Concurrent single-image requests are embedded together: a batch is dispatched at
+# BATCH_MAX uploads or BATCH_WAIT_MS after its first one. Beyond QUEUE_MAX queued
+# uploads, requests are refused with 503 and Retry-After.
+BATCH_MAX = int(os.environ.get("ML_BATCH_MAX", "16"))
+BATCH_WAIT_MS = float(os.environ.get("ML_BATCH_WAIT_MS", "5"))
+QUEUE_MAX = int(os.environ.get("ML_QUEUE_MAX", "256"))
+# Blur, exposure, face size and pose checks after detection; uploads that fail are
+# rejected with a "quality_issue" before the embedding step (0 = off)
+QUALITY_GATE = os.environ.get("ML_QUALITY_GATE", "1") != "0"
+# "deepface", or "synthetic" for load tests: deterministic embeddings computed from
+# the pixels, with each forward pass and detection taking the given milliseconds
+EMBEDDING_BACKEND = os.environ.get("ML_EMBEDDING_BACKEND", "deepface")
+SYNTHETIC_EMBED_MS = float(os.environ.get("ML_SYNTHETIC_EMBED_MS", "0"))
+SYNTHETIC_DETECT_MS = float(os.environ.get("ML_SYNTHETIC_DETECT_MS", "0"))
+# Uvicorn worker processes when started with `python ml_api.py`. Workers map one
+# shared copy of the gallery and see each other's registrations (ML_SHARED_GALLERY=0
+# turns that off for a single worker that owns the gallery alone).
+API_WORKERS = int(os.environ.get("ML_API_WORKERS", "1"))
+SHARED_GALLERY = os.environ.get("ML_SHARED_GALLERY", "1") != "0"
+# Two-stage 1:1 verification: every claim is first checked with this light model
+# and only distances within ML_CASCADE_MARGIN (a fraction of its threshold) of its
+# threshold are re-checked with ML_MODEL. The light embeddings live in
+# <gallery>.<model> next to the gallery; see benchmark_cascade.py
+CASCADE_MODEL = os.environ.get("ML_CASCADE_MODEL") or None
+CASCADE_MARGIN = float(os.environ.get("ML_CASCADE_MARGIN", "0.25"))
 
-if not os.path.exists(TEMP_DIR):
-    os.makedirs(TEMP_DIR)
 if not os.path.exists(REGISTERED_DIR):
     os.makedirs(REGISTERED_DIR)
 
-# Initialize the module with the absolute path to embeddings
-ml_module = FaceRecognitionModule(embeddings_file=EMBEDDINGS_FILE)
+# Initialize the module with the absolute path to the embedding store
+MODULE_KWARGS = {
+    "gallery_dir": GALLERY_DIR,
+    "legacy_embeddings_file": LEGACY_EMBEDDINGS_FILE,
+    "face_crop_dir": FACE_CROP_DIR,
+    "model_name": MODEL_NAME,
+    "ann_min_size": ANN_MIN_SIZE or None,
+    "ann_probe": ANN_PROBE,
+    "gallery_precision": GALLERY_PRECISION,
+    "pca_components": PCA_COMPONENTS or None,
+    "max_image_edge": MAX_IMAGE_EDGE or None,
+    "decode_edge": DECODE_EDGE or None,
+    "quality_gate": QualityGate() if QUALITY_GATE else None,
+    "shared_gallery": SHARED_GALLERY,
+    "cascade_model": CASCADE_MODEL,
+    "cascade_margin": CASCADE_MARGIN,
+    "backend": EMBEDDING_BACKEND,
+    "backend_options": {"embed_latency_ms": SYNTHETIC_EMBED_MS, "detect_latency_ms": SYNTHETIC_DETECT_MS} if EMBEDDING_BACKEND == "synthetic" else None
+}
+ml_module = FaceRecognitionModule(**MODULE_KWARGS)
+inference_pool = InferencePool(ml_module, workers=INFERENCE_WORKERS, start_method=POOL_START_METHOD, module_kwargs=MODULE_KWARGS)
+embedding_cache = EmbeddingCache(
+    f"{ml_module.model_name}:{ml_module.detector_backend}:{MAX_IMAGE_EDGE}:{DECODE_EDGE}:{ml_module.quality_gate}",
+    max_bytes=int(CACHE_MB * 2**20), ttl=CACHE_TTL
+)
+batcher = MicroBatcher(
+    inference_pool, max_batch=BATCH_MAX, max_wait_ms=BATCH_WAIT_MS, max_queue=QUEUE_MAX,
+    on_batch=lambda size, waits: record_batch(size, waits)
+)
+# With a cascade, single 1:1 requests are batched through the light model instead
+light_batcher = MicroBatcher(
+    inference_pool, max_batch=BATCH_MAX, max_wait_ms=BATCH_WAIT_MS, max_queue=QUEUE_MAX,
+    on_batch=lambda size, waits: record_batch(size, waits), fn=embed_uploads_light
+) if ml_module.cascade is not None else None
+# Uploads currently being embedded, by cache key, so a retry that arrives while
+# the original is still running waits for it instead of starting over
+_inflight: Dict[str, asyncio.Future] = {}
+warmup_error = None
+
+# Prometheus metrics, served on /metrics. "inference" is the round trip to the
+# inference pool (queueing included); the decode..embed stages inside it are
+# timed by the worker. "disk" is saving a registration photo and journal record.
+PIPELINE_STAGES = ("upload", "inference", "queue") + STAGES + ("compare", "disk")
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram("ml_stage_duration_seconds", "Time spent in each pipeline stage.", ["stage"])
+REQUEST_SECONDS = metrics.histogram("ml_request_duration_seconds", "Request latency by endpoint.", ["method", "endpoint"])
+OUTCOMES = metrics.counter("ml_outcomes_total", "Processed images by endpoint and outcome (match, mismatch, registered, no_face, multiple_faces, low_quality, invalid_image, not_found, overloaded, error).", ["endpoint", "outcome"])
+IN_FLIGHT = metrics.gauge("ml_requests_in_flight", "Requests currently being served.", ["endpoint"])
+STREAM_DROPPED = metrics.counter("ml_stream_frames_dropped_total", "Streamed frames replaced by a newer one before they were processed.")
+BATCH_SIZE = metrics.histogram("ml_batch_size", "Uploads per micro-batch sent to the inference pool.", buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+metrics.gauge("ml_queue_depth", "Uploads waiting for a micro-batch.", function=lambda: batcher.depth + (light_batcher.depth if light_batcher else 0))
+metrics.counter("ml_queue_rejected_total", "Requests refused with 503 because the queue was full.", function=lambda: batcher.shed + (light_batcher.shed if light_batcher else 0))
+metrics.gauge("ml_gallery_size", "Registered students.", function=lambda: len(ml_module.gallery))
+metrics.gauge("ml_gallery_bytes", "Memory held by the gallery vectors.", function=lambda: ml_module.gallery.nbytes)
+metrics.gauge("ml_model_warm", "1 once the model and detector are warmed up.", function=lambda: float(ml_module.warm))
+metrics.gauge("ml_model_load_seconds", "Start-up time per warm-up step.", ["step"], function=lambda: {step[:-3]: ms / 1000 for step, ms in ml_module.load_timings.items()})
+metrics.gauge("ml_inference_workers", "Inference worker processes (0 = background thread).", function=lambda: inference_pool.workers)
+metrics.counter("ml_embedding_cache_hits_total", "Uploads answered from the embedding cache.", function=lambda: embedding_cache.hits)
+metrics.counter("ml_embedding_cache_misses_total", "Uploads not found in the embedding cache.", function=lambda: embedding_cache.misses)
+metrics.counter("ml_embedding_cache_evictions_total", "Embedding cache entries evicted for space.", function=lambda: embedding_cache.evictions)
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+def record_timings(timings: Dict[str, float]):
+    # Stage timings measured in the worker, in milliseconds
+    for key, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=key[:-3])
+
+def record_batch(size: int, waits: List[float]):
+    BATCH_SIZE.observe(size)
+    for wait in waits:
+        STAGE_SECONDS.observe(wait, stage="queue")
+
+def outcome_of(result: Optional[Dict] = None, message: Optional[str] = None, reason: Optional[str] = None) -> str:
+    """
+    The ml_outcomes_total label for a verification/registration result or a
+    rejection message (and quality gate reason).
+    """
+    if result is not None and result.get("status") != "error":
+        if "matched" in result:
+            return "match" if result["matched"] else "mismatch"
+        return "registered"
+    if reason or (result or {}).get("quality_issue"):
+        return "low_quality"
+    message = (message or (result or {}).get("message") or "").lower()
+    if "no face" in message or "could not be detected" in message:
+        return "no_face"
+    if "multiple faces" in message:
+        return "multiple_faces"
+    if "decode" in message:
+        return "invalid_image"
+    if "not found" in message:
+        return "not_found"
+    if "busy" in message:
+        return "overloaded"
+    return "error"
+
+def error_content(message: str, reason: Optional[str] = None, **content) -> Dict:
+    """
+    Body of a rejection. reason, when the quality gate refused the face (blurry,
+    too_dark...), is returned as "quality_issue" and tells the client to retake
+    the photo.
+    """
+    body = {"status": "error", "message": message}
+    if reason:
+        body["quality_issue"] = reason
+    body.update(content)
+    return body
+
+def stage_timing_summary() -> Dict[str, Dict]:
+    summary = {}
+    for stage in PIPELINE_STAGES:
+        observed = STAGE_SECONDS.summary(stage=stage)
+        if observed:
+            count, total = observed
+            summary[stage] = {"count": count, "mean_ms": round(total * 1000 / count, 2)}
+    return summary
+
+def warm_up_model():
+    global warmup_error
+    try:
+        timings = ml_module.warm_up()
+        logger.info(f"ML model warm: {timings}")
+        # Start workers only now, so forked workers inherit the loaded model
+        inference_pool.start()
+        logger.info(f"Inference pool started with {inference_pool.workers} worker process(es)")
+    except Exception as e:
+        warmup_error = str(e)
+        logger.error(f"ML model warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up off the event loop so liveness checks answer while the model loads;
+    # /health/ready reports 503 until it is done.
+    asyncio.get_running_loop().run_in_executor(None, warm_up_model)
+    batcher.start()
+    if light_batcher is not None:
+        light_batcher.start()
+    yield
+    await batcher.stop()
+    if light_batcher is not None:
+        await light_batcher.stop()
+    inference_pool.shutdown()
+
+def not_ready_response():
+    return JSONResponse(status_code=503, content={"status": "error", "message": "Model is still loading. Retry shortly."})
+
+def overloaded_response(error: Overloaded, **content):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+        content={"status": "error", "message": str(error), **content}
+    )
+
+app = FastAPI(title="Face Recognition API", description="API for Student Attendance Verification", lifespan=lifespan)
+
+@app.middleware("http")
+async def refresh_gallery(request: Request, call_next):
+    # Pick up registrations other uvicorn workers made; one shared-memory read when there are none
+    try:
+        ml_module.refresh()
+    except ValueError as e:
+        # migrate_gallery.py switched the gallery to another model: serve nothing until restarted with it
+        return JSONResponse(status_code=503, content={"status": "error", "message": str(e)})
+    return await call_next(request)
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    # Label by route template (/register/{student_id}), never by raw path
+    endpoint = next((route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL), None)
+    if endpoint is None or endpoint == "/metrics":
+        return await call_next(request)
+    IN_FLIGHT.inc(endpoint=endpoint)
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        IN_FLIGHT.dec(endpoint=endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
 
 @app.get("/")
 def read_root():
     return {"status": "online", "service": "Face Recognition API"}
 
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Prometheus scrape endpoint (text exposition format). Each uvicorn worker
+    process keeps its own metrics.
+    """
+    return Response(content=metrics.render(), media_type=Registry.CONTENT_TYPE)
+
+@app.get("/health/ready")
+def readiness():
+    """
+    Readiness probe: 200 only once the model and detector are loaded and warmed up.
+    """
+    ready = ml_module.warm and inference_pool.started
+    status = "ready" if ready else ("error" if warmup_error else "warming")
+    content = {
+        "status": status,
+        "model_name": ml_module.model_name,
+        "model_version": ml_module.model_version,
+        "detector_backend": ml_module.detector_backend,
+        "gallery_size": len(ml_module.gallery),
+        "ann_index": ml_module.gallery.index is not None,
+        "gallery_precision": ml_module.gallery.precision,
+        "cascade_model": CASCADE_MODEL,
+        "gallery_mb": round(ml_module.gallery.nbytes / 2**20, 1),
+        "warm": ml_module.warm,
+        "inference_workers": inference_pool.workers,
+        "embedding_cache": embedding_cache.stats(),
+        "max_image_edge": MAX_IMAGE_EDGE,
+        "decode_edge": DECODE_EDGE,
+        "stage_timings": stage_timing_summary(),
+        "load_timings_ms": ml_module.load_timings
+    }
+    if warmup_error:
+        content["error"] = warmup_error
+    if not ready:
+        return JSONResponse(status_code=503, content=content)
+    return content
+
+async def embed_upload_cached(data: bytes) -> Tuple[CachedEmbedding, bool]:
+    """
+    Embeds one upload on the inference pool unless the same bytes were embedded
+    recently. Returns (entry, cached); entry.error is set if the upload was rejected.
+    """
+    key = embedding_cache.key(data)
+    entry = embedding_cache.get(key)
+    if entry is not None:
+        return entry, True
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        entry = await asyncio.shield(inflight)
+        if entry is not None:
+            return entry, True
+        # The original request failed unexpectedly; try on our own
+        return await embed_upload_cached(data)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        try:
+            with timed("inference"):
+                # Joins the next micro-batch; raises Overloaded when the queue is full
+                embedding, facial_area, timings = await batcher.submit(data)
+            record_timings(timings)
+            entry = embedding_cache.put(key, embedding, facial_area)
+        except ValueError as e:
+            # No face, several faces, poor quality, undecodable: the same bytes always
+            # fail the same way
+            entry = embedding_cache.put_error(key, str(e), getattr(e, "reason", None))
+        return entry, False
+    finally:
+        _inflight.pop(key, None)
+        future.set_result(entry)
+
+async def verify_cascade(student_ids: List[str], embedded: List[tuple]) -> List[Dict]:
+    """
+    Finishes cascade verification of uploads that embed_uploads_light detected
+    and embedded with the light model: claims it is sure of are decided by it,
+    the others have their face crops embedded with the main model in one pool
+    call. Results carry "cascade_stage" ("fast" or "full") and "facial_area".
+    """
+    results: List[Optional[Dict]] = []
+    escalated = []
+    for i, (student_id, (embedding, _, timings, _)) in enumerate(zip(student_ids, embedded)):
+        record_timings(timings)
+        with timed("compare"):
+            results.append(ml_module.verify_light(student_id, embedding))
+        if results[i] is None:
+            escalated.append(i)
+    if escalated:
+        with timed("inference"):
+            embeddings = await inference_pool.run(embed_crops, [embedded[i][3] for i in escalated])
+        for i, embedding in zip(escalated, embeddings):
+            with timed("compare"):
+                results[i] = dict(ml_module.verify_embedding(student_ids[i], embedding), cascade_stage="full")
+    for result, (_, facial_area, _, _) in zip(results, embedded):
+        result["facial_area"] = facial_area
+    return results
+
 @app.post("/register")
 async def register_student(
     student_id: str = Form(...),
@@ -48,18 +401,52 @@ async def register_student(
     saved_filename = f"{safe_id}{file_ext}"
     saved_file_path = os.path.join(REGISTERED_DIR, saved_filename)
     
+    if not inference_pool.started:
+        return not_ready_response()
+
     try:
-        # Save uploaded file permanently
-        with open(saved_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Call ML module
-        result = ml_module.register_student(student_id, saved_file_path)
+        with timed("upload"):
+            contents = await file.read()
+        try:
+            # Decode, detect and embed on the inference pool, keeping the aligned face
+            # crop so the gallery can be re-embedded if the model changes. The cascade
+            # model's embedding is made there too, not on the event loop.
+            with timed("inference"):
+                embedding, _, timings, face_crop, light_embedding = await inference_pool.run(embed_registration, contents)
+            record_timings(timings)
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            reason = getattr(e, "reason", None)
+            OUTCOMES.inc(endpoint="/register", outcome=outcome_of(message=str(e), reason=reason))
+            return JSONResponse(status_code=400, content=error_content(str(e), reason))
+
+        with timed("disk"):
+            # Keep the original upload as the student's reference photo
+            with open(saved_file_path, "wb") as buffer:
+                buffer.write(contents)
+
+            result = ml_module.register_embedding(
+                student_id, embedding, registered_image=saved_file_path, face_crop=face_crop, light_embedding=light_embedding
+            )
+        OUTCOMES.inc(endpoint="/register", outcome=outcome_of(result))
+        
+        return result
+
+    except Exception as e:
+        OUTCOMES.inc(endpoint="/register", outcome="error")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.delete("/register/{student_id}")
+async def unregister_student(student_id: str):
+    """
+    Remove a student's face from the gallery.
+    """
+    try:
+        result = ml_module.unregister_student(student_id)
         
         if result.get("status") == "error":
-            # If registration failed, maybe delete the file? 
-            # But let's keep it for debug or cleanup later
-            return JSONResponse(status_code=400, content=result)
+            return JSONResponse(status_code=404, content=result)
             
         return result
 
@@ -69,43 +456,394 @@ async def register_student(
 @app.post("/verify")
 async def verify_attendance(
     student_id: Optional[str] = Form(None),
+    top_k: int = Form(1),
+    candidate_ids: Optional[List[str]] = Form(None),
     file: UploadFile = File(...)
 ):
     """
     Verify attendance. 
     If student_id is provided, performs 1:1 verification.
-    If student_id is NOT provided, performs 1:N identification (finds best match).
+    If student_id is NOT provided, performs 1:N identification (finds best match)
+    and returns the top_k closest candidates. candidate_ids (repeated) restricts the
+    search to those students, e.g. the roster of the class being held.
     """
-    temp_file_path = os.path.join(TEMP_DIR, f"verify_{file.filename}")
-    
+    if not inference_pool.started:
+        return not_ready_response()
+
+    if student_id and student_id not in ml_module.gallery:
+        # Fail fast without spending an inference on an unknown student
+        OUTCOMES.inc(endpoint="/verify", outcome="not_found")
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Student ID not found in database.", "match": False, "matched": False})
+
     try:
-        # Save uploaded file
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
+        # Decode the upload in memory (nothing is written to disk), then detect and
+        # embed on the inference pool; the event loop only does the gallery search.
+        # A retry of the same bytes reuses the cached embedding. With a cascade, a
+        # 1:1 claim is embedded with the light model first and not cached.
+        entry, cached = None, False
+        try:
+            with timed("upload"):
+                contents = await file.read()
+            if student_id and light_batcher is not None:
+                with timed("inference"):
+                    light = await light_batcher.submit(contents)
+            else:
+                entry, cached = await embed_upload_cached(contents)
+        except BrokenProcessPool:
+            raise
+        except Overloaded as e:
+            OUTCOMES.inc(endpoint="/verify", outcome="overloaded")
+            return overloaded_response(e, matched=False)
+        except Exception as e:
+            reason = getattr(e, "reason", None)
+            OUTCOMES.inc(endpoint="/verify", outcome=outcome_of(message=str(e), reason=reason))
+            return JSONResponse(status_code=400, content=error_content(str(e), reason, matched=False))
+        if entry is not None and entry.error:
+            OUTCOMES.inc(endpoint="/verify", outcome=outcome_of(message=entry.error, reason=entry.reason))
+            return JSONResponse(status_code=400, content=error_content(entry.error, entry.reason, matched=False, cached=cached))
+
         # Call ML module
+        if entry is None:
+            result = (await verify_cascade([student_id], [light]))[0]
+        else:
+            with timed("compare"):
+                if student_id:
+                    result = ml_module.verify_embedding(student_id, entry.embedding)
+                else:
+                    result = ml_module.identify_embedding(entry.embedding, top_k=top_k, candidate_ids=candidate_ids)
+            result["facial_area"] = entry.facial_area
         if student_id:
-            result = ml_module.verify_student(student_id, temp_file_path)
             # Map verify_student result keys to expectations if needed, or rely on client to handle
             result["matched"] = result.get("match", False)
             result["confidence"] = result.get("confidence_score", 0.0)
-        else:
-            result = ml_module.identify_student(temp_file_path)
+        OUTCOMES.inc(endpoint="/verify", outcome=outcome_of(result))
         
         if result.get("status") == "error":
             if "not found" in result.get("message", "").lower():
                 return JSONResponse(status_code=404, content=result)
             return JSONResponse(status_code=400, content=result)
-            
+
+        result["cached"] = cached
         return result
 
     except Exception as e:
+        OUTCOMES.inc(endpoint="/verify", outcome="error")
         return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
-    
+
+@app.post("/verify/batch")
+async def verify_attendance_batch(
+    files: List[UploadFile] = File(...),
+    student_ids: Optional[List[str]] = Form(None),
+    top_k: int = Form(1),
+    candidate_ids: Optional[List[str]] = Form(None)
+):
+    """
+    Verify many images in one request.
+    If student_ids is provided (one per file, same order), performs 1:1 verification per pair.
+    Otherwise performs 1:N identification for every image, restricted to
+    candidate_ids when given.
+    Faces are detected per image and embedded in batched forward passes.
+    Returns one JSON array with a result per file, in upload order.
+    """
+    if student_ids and len(student_ids) != len(files):
+        return JSONResponse(status_code=400, content={
+            "status": "error",
+            "message": f"Got {len(student_ids)} student IDs for {len(files)} files."
+        })
+
+    if not inference_pool.started:
+        return not_ready_response()
+
+    try:
+        results: List[Optional[dict]] = [None] * len(files)
+        pending = []
+        for i in range(len(files)):
+            if student_ids and student_ids[i] not in ml_module.gallery:
+                results[i] = {"status": "error", "message": "Student ID not found in database.", "match": False, "matched": False}
+            else:
+                pending.append(i)
+
+        if student_ids and ml_module.cascade is not None:
+            # Light model first for every pair, the main model only where it is unsure
+            datas = []
+            for i in pending:
+                with timed("upload"):
+                    datas.append(await files[i].read())
+            with timed("inference"):
+                embedded = await inference_pool.run(embed_uploads_light, datas)
+            found = []
+            for i, result in zip(pending, embedded):
+                if isinstance(result, Exception):
+                    results[i] = error_content(str(result), getattr(result, "reason", None), matched=False)
+                else:
+                    found.append((i, result))
+            verified = await verify_cascade([student_ids[i] for i, _ in found], [result for _, result in found])
+            for (i, _), result in zip(found, verified):
+                result["matched"] = result.get("match", False)
+                result["confidence"] = result.get("confidence_score", 0.0)
+                results[i] = result
+            for i in pending:
+                results[i]["cached"] = False
+            pending = []
+
+        entries: Dict[int, CachedEmbedding] = {}
+        cached = set()
+        misses = []
+        keys = {}
+        for i in pending:
+            with timed("upload"):
+                data = await files[i].read()
+            keys[i] = embedding_cache.key(data)
+            entry = embedding_cache.get(keys[i])
+            if entry is not None:
+                entries[i] = entry
+                cached.add(i)
+            else:
+                misses.append((i, data))
+
+        if misses:
+            with timed("inference"):
+                embedded = await inference_pool.run(embed_uploads, [data for _, data in misses])
+            for (i, _), result in zip(misses, embedded):
+                if isinstance(result, Exception):
+                    entries[i] = embedding_cache.put_error(keys[i], str(result), getattr(result, "reason", None))
+                else:
+                    embedding, facial_area, timings = result
+                    record_timings(timings)
+                    entries[i] = embedding_cache.put(keys[i], embedding, facial_area)
+
+        for i in pending:
+            entry = entries[i]
+            embedding = entry.embedding
+            if entry.error:
+                results[i] = error_content(entry.error, entry.reason, matched=False)
+            elif student_ids:
+                with timed("compare"):
+                    result = ml_module.verify_embedding(student_ids[i], embedding)
+                result["matched"] = result.get("match", False)
+                result["confidence"] = result.get("confidence_score", 0.0)
+                results[i] = result
+            else:
+                with timed("compare"):
+                    results[i] = ml_module.identify_embedding(embedding, top_k=top_k, candidate_ids=candidate_ids)
+            if not entry.error:
+                results[i]["facial_area"] = entry.facial_area
+            results[i]["cached"] = i in cached
+
+        for i, result in enumerate(results):
+            OUTCOMES.inc(endpoint="/verify/batch", outcome=outcome_of(result))
+            result["index"] = i
+            result["filename"] = files[i].filename
+
+        return results
+
+    except Exception as e:
+        OUTCOMES.inc(endpoint="/verify/batch", outcome="error")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.post("/embed")
+async def embed_uploads_only(files: List[UploadFile] = File(...)):
+    """
+    Detects and embeds the face in each upload without searching the gallery.
+    Used by shard_router.py, which embeds a probe on one shard and searches every
+    shard with /identify/embeddings. Returns one result per file, in upload
+    order, with the base64 float32 "embedding" and "facial_area", or the
+    rejection.
+    """
+    if not inference_pool.started:
+        return not_ready_response()
+
+    try:
+        with timed("upload"):
+            contents = [await file.read() for file in files]
+        try:
+            # Concurrent submissions join the same micro-batch
+            embedded = await asyncio.gather(*(embed_upload_cached(data) for data in contents))
+        except BrokenProcessPool:
+            raise
+        except Overloaded as e:
+            OUTCOMES.inc(endpoint="/embed", outcome="overloaded")
+            return overloaded_response(e)
+
+        results = []
+        for entry, cached in embedded:
+            if entry.error:
+                OUTCOMES.inc(endpoint="/embed", outcome=outcome_of(message=entry.error, reason=entry.reason))
+                results.append(error_content(entry.error, entry.reason, cached=cached))
+            else:
+                results.append({"status": "success", "embedding": encode_embedding(entry.embedding), "facial_area": entry.facial_area, "cached": cached})
+        return results
+
+    except Exception as e:
+        OUTCOMES.inc(endpoint="/embed", outcome="error")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.post("/identify/embeddings")
+async def identify_embeddings(
+    embeddings: List[str] = Body(...),
+    top_k: int = Body(1),
+    candidate_ids: Optional[List[str]] = Body(None)
+):
+    """
+    1:N search of embeddings computed by /embed (on this or another shard)
+    against this instance's gallery, restricted to candidate_ids when given.
+    JSON body: {"embeddings": [base64 float32, ...], "top_k", "candidate_ids"}.
+    Returns one identification result per embedding.
+    """
+    try:
+        with timed("compare"):
+            return [
+                ml_module.identify_embedding(decode_embedding(embedding), top_k=top_k, candidate_ids=candidate_ids)
+                for embedding in embeddings
+            ]
+    except ValueError as e:
+        # Wrong dimension: the caller embedded with another model
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.post("/identify/group")
+async def identify_group(
+    files: List[UploadFile] = File(...),
+    candidate_ids: Optional[List[str]] = Form(None)
+):
+    """
+    Group roll call. Detects every face in one or more classroom photos and matches
+    them one-to-one against the roster (candidate_ids, or the whole gallery).
+    """
+    if not inference_pool.started:
+        return not_ready_response()
+
+    try:
+        with timed("upload"):
+            contents = [await file.read() for file in files]
+        try:
+            with timed("inference"):
+                faces, embeddings = await inference_pool.run(embed_group_uploads, contents)
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            OUTCOMES.inc(endpoint="/identify/group", outcome=outcome_of(message=str(e)))
+            return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+
+        with timed("compare"):
+            result = ml_module.match_group(faces, embeddings, candidate_ids=candidate_ids)
+        # One outcome per detected face
+        OUTCOMES.inc(len(result.get("matches", [])), endpoint="/identify/group", outcome="match")
+        OUTCOMES.inc(len(result.get("unmatched_faces", [])), endpoint="/identify/group", outcome="mismatch")
+        return result
+
+    except Exception as e:
+        OUTCOMES.inc(endpoint="/identify/group", outcome="error")
+        return JSONResponse(status_code=500, content={"status": "error", "message": str(e)})
+
+@app.websocket("/verify/stream")
+async def verify_stream(websocket: WebSocket):
+    """
+    Streaming 1:N identification for door cameras and browser kiosks. The client
+    sends JPEG frames as binary messages and gets a JSON event per processed
+    frame. Frames that arrive while the previous one is still being processed
+    replace each other, so only the newest is processed and the stream never lags
+    behind. An optional roster (candidate_ids query parameters, or a text message
+    {"candidate_ids": [...]}) restricts the search; its gallery rows are looked
+    up once for the session.
+    """
+    await websocket.accept()
+    if not inference_pool.started:
+        await websocket.send_json({"type": "error", "message": "Model is still loading. Retry shortly."})
+        # 1013: try again later
+        await websocket.close(code=1013)
+        return
+
+    candidate_ids = websocket.query_params.getlist("candidate_ids")
+    roster = RosterSlice(candidate_ids) if candidate_ids else None
+    latest: Dict = {}
+    frame_ready = asyncio.Event()
+    identified = set()
+    counters = {"received": 0, "dropped": 0}
+
+    async def receive_frames():
+        nonlocal roster
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                counters["received"] += 1
+                if "data" in latest:
+                    # The previous frame was never picked up; it is stale now
+                    counters["dropped"] += 1
+                    STREAM_DROPPED.inc()
+                latest["data"] = message["bytes"]
+                latest["seq"] = counters["received"]
+                latest["received_at"] = time.perf_counter()
+                frame_ready.set()
+            elif message.get("text"):
+                try:
+                    ids = json.loads(message["text"]).get("candidate_ids")
+                except (ValueError, AttributeError):
+                    await websocket.send_json({"type": "error", "message": "Expected JSON like {\"candidate_ids\": [...]}."})
+                    continue
+                roster = RosterSlice(ids) if ids else None
+                await websocket.send_json({"type": "roster", "roster_size": len(roster) if roster else None})
+
+    async def process_frames():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            data, seq, received_at = latest.pop("data"), latest.pop("seq"), latest.pop("received_at")
+            event = {"frame": seq, "dropped": counters["dropped"]}
+            try:
+                with timed("inference"):
+                    embedding, facial_area, timings = await batcher.submit(data)
+                record_timings(timings)
+            except Overloaded as e:
+                OUTCOMES.inc(endpoint="/verify/stream", outcome="overloaded")
+                await websocket.send_json({**event, "type": "busy", "message": str(e), "retry_after": e.retry_after})
+                continue
+            except ValueError as e:
+                reason = getattr(e, "reason", None)
+                OUTCOMES.inc(endpoint="/verify/stream", outcome=outcome_of(message=str(e), reason=reason))
+                if reason:
+                    event["quality_issue"] = reason
+                await websocket.send_json({**event, "type": "rejected", "message": str(e), "latency_ms": round((time.perf_counter() - received_at) * 1000, 1)})
+                continue
+
+            with timed("compare"):
+                result = ml_module.identify_embedding(embedding, candidate_ids=roster)
+            OUTCOMES.inc(endpoint="/verify/stream", outcome=outcome_of(result))
+            event.update(
+                type="identified" if result["matched"] else "no_match",
+                student_id=result["student_id"],
+                confidence=result["confidence"],
+                distance=result["distance"],
+                facial_area=facial_area,
+                latency_ms=round((time.perf_counter() - received_at) * 1000, 1)
+            )
+            if result["matched"]:
+                # First sighting of this student on this connection
+                event["first"] = result["student_id"] not in identified
+                identified.add(result["student_id"])
+            await websocket.send_json(event)
+
+    IN_FLIGHT.inc(endpoint="/verify/stream")
+    await websocket.send_json({"type": "ready", "roster_size": len(roster) if roster else None})
+    processor = asyncio.create_task(process_frames())
+    try:
+        receiver = asyncio.create_task(receive_frames())
+        # Whichever ends first (client gone, or a send failing) ends the session
+        done, _ = await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+        receiver.cancel()
+        for task in done:
+            if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), (WebSocketDisconnect, RuntimeError)):
+                logger.error(f"Stream session failed: {task.exception()}")
     finally:
-        # Cleanup
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        processor.cancel()
+        IN_FLIGHT.dec(endpoint="/verify/stream")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8001)
+    if API_WORKERS > 1:
+        # Each worker imports this module and loads its own model; the gallery is shared
+        uvicorn.run("ml_api:app", host="127.0.0.1", port=PORT, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=PORT)
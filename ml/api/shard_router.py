@@ -0,0 +1,298 @@
+import asyncio
+import itertools
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, File, UploadFile, Form
+from fastapi.responses import JSONResponse, Response
+
+from sharding import HashRing, merge_groups, merge_identifications, parse_shards
+
+logger = logging.getLogger(__name__)
+
+# Gallery shards: ML API instances (ml_api.py), each with its own ML_GALLERY_DIR,
+# as comma-separated base URLs or name=URL pairs. Students are placed on shards by
+# consistent hashing of their ID (on the shard name), so keep names stable: adding
+# a shard moves about 1/N of the students, who must then be registered again.
+SHARDS = parse_shards(os.environ.get("ML_SHARDS", ""))
+# The router answers on the ML service's usual port, so the backend's MLClient
+# talks to it unchanged
+PORT = int(os.environ.get("ML_ROUTER_PORT", "8001"))
+SHARD_TIMEOUT = float(os.environ.get("ML_SHARD_TIMEOUT", "60"))
+
+if not SHARDS:
+    raise RuntimeError("Set ML_SHARDS to the comma-separated base URLs of the ML API shards.")
+
+URLS: Dict[str, str] = dict(SHARDS)
+ring = HashRing([name for name, _ in SHARDS])
+# Shard that embeds the next identification probe; any shard can, since all run the same model
+_embedders = itertools.cycle([name for name, _ in SHARDS])
+client: Optional[httpx.AsyncClient] = None
+
+
+class ShardUnavailable(Exception):
+    """
+    A shard could not be reached or is overloaded; the whole request fails
+    rather than answering from part of the gallery.
+    """
+
+    def __init__(self, shard: str, message: str, retry_after: Optional[str] = None):
+        super().__init__(f"Shard {shard} unavailable: {message}")
+        self.retry_after = retry_after
+
+
+def unavailable_response(e: ShardUnavailable, **content):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": e.retry_after} if e.retry_after else None,
+        content={"status": "error", "message": str(e), **content}
+    )
+
+
+async def call(shard: str, method: str, path: str, **kwargs) -> httpx.Response:
+    """
+    Sends one request to a shard. Connection failures and 503s raise
+    ShardUnavailable; other responses are returned as they are.
+    """
+    try:
+        response = await client.request(method, URLS[shard] + path, **kwargs)
+    except httpx.RequestError as e:
+        logger.error(f"Shard {shard} request to {path} failed: {e}")
+        raise ShardUnavailable(shard, str(e))
+    if response.status_code == 503:
+        try:
+            message = response.json().get("message", "busy")
+        except ValueError:
+            message = response.text
+        raise ShardUnavailable(shard, message, response.headers.get("Retry-After"))
+    return response
+
+
+def relay(response: httpx.Response) -> Response:
+    return Response(content=response.content, status_code=response.status_code, media_type=response.headers.get("content-type"))
+
+
+def upload(file: UploadFile, content: bytes):
+    return file.filename, content, file.content_type
+
+
+def scatter_targets(candidate_ids: Optional[List[str]]) -> Dict[str, Optional[List[str]]]:
+    """
+    Shards to search and the candidate IDs each owns; every shard, unrestricted,
+    when there is no roster.
+    """
+    if not candidate_ids:
+        return {name: None for name, _ in SHARDS}
+    return ring.partition(candidate_ids)
+
+
+async def embed(files: list) -> httpx.Response:
+    """
+    Embeds uploads on the next shard in turn, moving on to the following one if
+    it is unavailable: any shard can embed, only the search needs all of them.
+    """
+    for attempt in range(len(SHARDS)):
+        try:
+            return await call(next(_embedders), "POST", "/embed", files=files)
+        except ShardUnavailable:
+            if attempt == len(SHARDS) - 1:
+                raise
+
+
+async def identify(embeddings: List[str], top_k: int, candidate_ids: Optional[List[str]]) -> List[Dict]:
+    """
+    Searches every shard holding candidates for each embedding in parallel and
+    merges their answers.
+    """
+    targets = scatter_targets(candidate_ids)
+    responses = await asyncio.gather(*(
+        call(shard, "POST", "/identify/embeddings", json={"embeddings": embeddings, "top_k": top_k, "candidate_ids": ids})
+        for shard, ids in targets.items()
+    ))
+    per_shard = []
+    for shard, response in zip(targets, responses):
+        if response.status_code != 200:
+            raise ShardUnavailable(shard, response.text)
+        per_shard.append(response.json())
+    return [merge_identifications([results[i] for results in per_shard], top_k) for i in range(len(embeddings))]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client
+    client = httpx.AsyncClient(timeout=SHARD_TIMEOUT, trust_env=False)
+    yield
+    await client.aclose()
+
+app = FastAPI(title="Face Recognition Shard Router", description="Routes the ML API over a gallery sharded by student ID", lifespan=lifespan)
+
+@app.get("/")
+def read_root():
+    return {"status": "online", "service": "Face Recognition Shard Router", "shards": len(SHARDS)}
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Ready only when every shard is.
+    """
+    async def probe(shard: str) -> Dict:
+        try:
+            response = await client.get(URLS[shard] + "/health/ready")
+            return {"shard": shard, "ready": response.status_code == 200, **response.json()}
+        except (httpx.RequestError, ValueError) as e:
+            return {"shard": shard, "ready": False, "status": "unreachable", "error": str(e)}
+
+    shards = await asyncio.gather(*(probe(name) for name, _ in SHARDS))
+    ready = all(shard["ready"] for shard in shards)
+    content = {
+        "status": "ready" if ready else "degraded",
+        "gallery_size": sum(shard.get("gallery_size", 0) for shard in shards),
+        "shards": shards
+    }
+    if not ready:
+        return JSONResponse(status_code=503, content=content)
+    return content
+
+@app.post("/register")
+async def register_student(
+    student_id: str = Form(...),
+    file: UploadFile = File(...)
+):
+    """
+    Registers the student on the shard owning its ID.
+    """
+    try:
+        response = await call(ring.shard_for(student_id), "POST", "/register",
+                              data={"student_id": student_id}, files={"file": upload(file, await file.read())})
+    except ShardUnavailable as e:
+        return unavailable_response(e)
+    return relay(response)
+
+@app.delete("/register/{student_id}")
+async def unregister_student(student_id: str):
+    try:
+        response = await call(ring.shard_for(student_id), "DELETE", f"/register/{student_id}")
+    except ShardUnavailable as e:
+        return unavailable_response(e)
+    return relay(response)
+
+@app.post("/verify")
+async def verify_attendance(
+    student_id: Optional[str] = Form(None),
+    top_k: int = Form(1),
+    candidate_ids: Optional[List[str]] = Form(None),
+    file: UploadFile = File(...)
+):
+    """
+    1:1 verification goes straight to the shard owning student_id. 1:N
+    identification embeds the upload once, on the next shard in turn, then
+    searches every shard holding candidates and merges their top_k.
+    """
+    contents = await file.read()
+    try:
+        if student_id:
+            response = await call(ring.shard_for(student_id), "POST", "/verify",
+                                  data={"student_id": student_id}, files={"file": upload(file, contents)})
+            return relay(response)
+
+        response = await embed([("files", upload(file, contents))])
+        if response.status_code != 200:
+            return relay(response)
+        embedded = response.json()[0]
+        if embedded["status"] == "error":
+            return JSONResponse(status_code=400, content=dict(embedded, matched=False))
+        result = (await identify([embedded["embedding"]], top_k, candidate_ids))[0]
+    except ShardUnavailable as e:
+        return unavailable_response(e, matched=False)
+
+    result["facial_area"] = embedded["facial_area"]
+    result["cached"] = embedded["cached"]
+    return result
+
+@app.post("/verify/batch")
+async def verify_attendance_batch(
+    files: List[UploadFile] = File(...),
+    student_ids: Optional[List[str]] = Form(None),
+    top_k: int = Form(1),
+    candidate_ids: Optional[List[str]] = Form(None)
+):
+    """
+    With student_ids, each shard verifies the pairs it owns in one sub-batch;
+    otherwise all images are embedded on one shard and searched on every shard.
+    Returns one result per file, in upload order.
+    """
+    if student_ids and len(student_ids) != len(files):
+        return JSONResponse(status_code=400, content={
+            "status": "error",
+            "message": f"Got {len(student_ids)} student IDs for {len(files)} files."
+        })
+
+    contents = [await file.read() for file in files]
+    results: List[Optional[Dict]] = [None] * len(files)
+    try:
+        if student_ids:
+            owned: Dict[str, List[int]] = {}
+            for i, student_id in enumerate(student_ids):
+                owned.setdefault(ring.shard_for(student_id), []).append(i)
+            responses = await asyncio.gather(*(
+                call(shard, "POST", "/verify/batch",
+                     data={"student_ids": [student_ids[i] for i in indices]},
+                     files=[("files", upload(files[i], contents[i])) for i in indices])
+                for shard, indices in owned.items()
+            ))
+            for (shard, indices), response in zip(owned.items(), responses):
+                if response.status_code != 200:
+                    return relay(response)
+                for i, result in zip(indices, response.json()):
+                    results[i] = result
+        else:
+            response = await embed([("files", upload(file, data)) for file, data in zip(files, contents)])
+            if response.status_code != 200:
+                return relay(response)
+            embedded = response.json()
+            found = [i for i, entry in enumerate(embedded) if entry["status"] == "success"]
+            identified = await identify([embedded[i]["embedding"] for i in found], top_k, candidate_ids) if found else []
+            for i, entry in enumerate(embedded):
+                if entry["status"] != "success":
+                    results[i] = dict(entry, matched=False)
+            for i, result in zip(found, identified):
+                results[i] = dict(result, facial_area=embedded[i]["facial_area"], cached=embedded[i]["cached"])
+    except ShardUnavailable as e:
+        return unavailable_response(e)
+
+    for i, result in enumerate(results):
+        result["index"] = i
+        result["filename"] = files[i].filename
+    return results
+
+@app.post("/identify/group")
+async def identify_group(
+    files: List[UploadFile] = File(...),
+    candidate_ids: Optional[List[str]] = Form(None)
+):
+    """
+    Group roll call: every shard holding part of the roster matches the photos
+    against its part, and faces matched on several shards go to the closest match.
+    """
+    contents = [await file.read() for file in files]
+    targets = scatter_targets(candidate_ids)
+    try:
+        responses = await asyncio.gather(*(
+            call(shard, "POST", "/identify/group",
+                 data={"candidate_ids": ids} if ids else None,
+                 files=[("files", upload(file, data)) for file, data in zip(files, contents)])
+            for shard, ids in targets.items()
+        ))
+    except ShardUnavailable as e:
+        return unavailable_response(e)
+    for response in responses:
+        if response.status_code != 200:
+            return relay(response)
+    return merge_groups([response.json() for response in responses])
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=PORT)
@@ -0,0 +1,117 @@
+import base64
+import bisect
+import hashlib
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def parse_shards(spec: str) -> List[Tuple[str, str]]:
+    """
+    (name, base URL) per shard from a comma-separated list of URLs or
+    name=URL pairs. The name places a shard on the hash ring, so naming shards
+    lets them move to another host without changing which students they own.
+    """
+    shards = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, url = item.split("=", 1) if "=" in item.split("://", 1)[0] else (None, item)
+        url = url.strip().rstrip("/")
+        # An unnamed shard is named after its normalized URL
+        shards.append((name.strip() if name is not None else url, url))
+    return shards
+
+
+class HashRing:
+    """
+    Consistent hashing of student IDs onto shards. Each shard owns `replicas`
+    points on a 64-bit ring and a student belongs to the shard owning the first
+    point at or after the hash of its ID, so adding or removing a shard only
+    moves the students on that shard's arcs (about 1/N of them).
+    """
+
+    def __init__(self, shards: List[str], replicas: int = 128):
+        if not shards:
+            raise ValueError("At least one shard is required.")
+        self.shards = list(shards)
+        points = sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(replicas))
+        self._keys = [key for key, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    def shard_for(self, student_id: str) -> str:
+        return self._owners[bisect.bisect(self._keys, _hash(student_id)) % len(self._keys)]
+
+    def partition(self, student_ids: List[str]) -> Dict[str, List[str]]:
+        """
+        The given students grouped by owning shard; shards owning none are left out.
+        """
+        groups: Dict[str, List[str]] = {}
+        for student_id in student_ids:
+            groups.setdefault(self.shard_for(student_id), []).append(student_id)
+        return groups
+
+
+def encode_embedding(embedding) -> str:
+    """
+    Embeddings travel between the router and shards as base64 float32, a quarter
+    of the size of a JSON list of floats.
+    """
+    return base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_embedding(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4")
+
+
+def merge_identifications(results: List[Dict], top_k: int) -> Dict:
+    """
+    Combines identify_embedding results for one face from every searched shard
+    into the result one gallery holding all their students would give: the
+    closest match decides, and candidates are the top_k closest overall.
+    """
+    answered = [result for result in results if result.get("candidates")]
+    if not answered:
+        return results[0]
+    best = min(answered, key=lambda result: result["candidates"][0]["distance"])
+    candidates = sorted((c for result in answered for c in result["candidates"]), key=lambda c: c["distance"])
+    return dict(best, candidates=candidates[:max(1, top_k)])
+
+
+def merge_groups(results: List[Dict]) -> Dict:
+    """
+    Combines match_group results from shards that each matched the same photos
+    against their part of the roster. Students are disjoint across shards, so
+    the only conflicts are faces matched on several shards; the closest match
+    keeps the face. This is a greedy approximation of one assignment over the
+    whole roster.
+    """
+    def face_key(face: Dict) -> Tuple:
+        area = face.get("facial_area") or {}
+        return face["image_index"], tuple(sorted((k, v) for k, v in area.items() if isinstance(v, (int, float))))
+
+    best: Dict[Tuple, Dict] = {}
+    for result in results:
+        for match in result.get("matches", []):
+            key = face_key(match)
+            if key not in best or match["distance"] < best[key]["distance"]:
+                best[key] = match
+    unmatched: Dict[Tuple, Dict] = {}
+    for result in results:
+        for face in result.get("unmatched_faces", []):
+            if face_key(face) not in best:
+                unmatched.setdefault(face_key(face), face)
+
+    matches = sorted(best.values(), key=lambda match: match["distance"])
+    return {
+        "status": "success",
+        "faces_detected": max((result.get("faces_detected", 0) for result in results), default=0),
+        "roster_size": sum(result.get("roster_size", 0) for result in results),
+        "matched_count": len(matches),
+        "matches": matches,
+        "unmatched_faces": list(unmatched.values())
+    }
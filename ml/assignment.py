@@ -0,0 +1,56 @@
+import numpy as np
+from typing import List, Tuple
+
+
+def linear_assignment(cost: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Minimum-cost one-to-one assignment (Hungarian algorithm, O(n^2 m)) for a
+    rectangular cost matrix. Returns (row, col) pairs; every row is assigned when
+    rows <= cols and every column otherwise, and no row or column is used twice.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.size == 0:
+        return []
+    if cost.shape[0] > cost.shape[1]:
+        return [(row, col) for col, row in linear_assignment(cost.T)]
+
+    n, m = cost.shape
+    # 1-based potentials and matching as in the classic shortest augmenting path formulation
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)  # p[j]: row matched to column j (0 = none)
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            improve = free & (reduced < minv[1:])
+            minv[1:][improve] = reduced[improve]
+            way[1:][improve] = j0
+
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+
+            used_cols = np.flatnonzero(used)
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[1:][free] -= delta
+
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return sorted((int(p[j]) - 1, j - 1) for j in range(1, m + 1) if p[j] != 0)
@@ -0,0 +1,103 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore
+from gallery import EmbeddingGallery
+
+def synthetic_gallery(size: int, dim: int, identities_per_cluster: int = 50, seed: int = 0) -> EmbeddingGallery:
+    """
+    Clustered random embeddings, a rough stand-in for real face embeddings which
+    are far from uniformly spread.
+    """
+    rng = np.random.default_rng(seed)
+    clusters = max(1, size // identities_per_cluster)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size)] + 0.5 * rng.standard_normal((size, dim)).astype(np.float32)
+    gallery = EmbeddingGallery(initial_capacity=size)
+    for i, vector in enumerate(vectors):
+        gallery.add(f"S{i:07d}", vector)
+    return gallery
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare IVF index search against exact search: recall@k and latency.")
+    parser.add_argument("--gallery", default=None, help="Embedding store directory to benchmark (default: synthetic gallery)")
+    parser.add_argument("--size", type=int, default=100000, help="Synthetic gallery size")
+    parser.add_argument("--dim", type=int, default=512, help="Synthetic embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--top-k", type=int, default=1, help="k for recall@k")
+    parser.add_argument("--lists", type=int, default=None, help="Number of index clusters (default: 4*sqrt(size))")
+    parser.add_argument("--probe", type=int, nargs="+", default=[1, 4, 8, 16, 32], help="n_probe values to measure")
+    parser.add_argument("--metric", default="cosine", choices=["cosine", "euclidean"])
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.gallery:
+        gallery, _ = EmbeddingStore(args.gallery).load()
+    else:
+        gallery = synthetic_gallery(args.size, args.dim, seed=args.seed)
+    if len(gallery) == 0:
+        print(json.dumps({"status": "error", "message": "Gallery is empty."}))
+        return
+
+    # Queries are noisy copies of gallery members, like a new photo of a registered student
+    rng = np.random.default_rng(args.seed + 1)
+    ids = gallery.ids
+    picks = rng.integers(0, len(ids), args.queries)
+    dim = gallery.input_dim
+    members = np.stack([gallery.get(ids[i]) for i in picks])
+    queries = members / np.linalg.norm(members, axis=1, keepdims=True)
+    queries += 0.3 * rng.standard_normal((args.queries, dim)).astype(np.float32) / np.sqrt(dim)
+
+    start = time.perf_counter()
+    index = IVFIndex(n_lists=args.lists)
+    gallery.build_index(index)
+    gallery.index = index
+    build_seconds = time.perf_counter() - start
+
+    exact = []
+    exact_times = []
+    for query in queries:
+        start = time.perf_counter()
+        exact.append({student_id for student_id, _ in gallery.search(query, args.top_k, args.metric)})
+        exact_times.append(time.perf_counter() - start)
+
+    results = []
+    for n_probe in args.probe:
+        hits = 0
+        times = []
+        for query, truth in zip(queries, exact):
+            start = time.perf_counter()
+            rows = gallery.index_candidates(query, n_probe)
+            found = gallery.search(query, args.top_k, args.metric, rows=rows)
+            times.append(time.perf_counter() - start)
+            hits += len(truth & {student_id for student_id, _ in found})
+        results.append({
+            "n_probe": n_probe,
+            f"recall@{args.top_k}": round(hits / (len(queries) * min(args.top_k, len(gallery))), 4),
+            "p50_ms": percentile_ms(times, 50),
+            "p99_ms": percentile_ms(times, 99)
+        })
+
+    print(json.dumps({
+        "status": "success",
+        "gallery_size": len(gallery),
+        "dim": gallery.input_dim,
+        "lists": len(index.centroids),
+        "build_seconds": round(build_seconds, 2),
+        "exact": {"p50_ms": percentile_ms(exact_times, 50), "p99_ms": percentile_ms(exact_times, 99)},
+        "ann": results
+    }, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from benchmark_models import load_dataset, percentiles_ms, probe_images
+
+def probe_all(module, dataset: Tuple[list, list, list], repeats: int, seed: int) -> Tuple[List[Dict], int]:
+    """
+    Runs every probe through detection and both models once. Returns per-probe
+    timings and distances to the claimed student, plus the number of probes whose
+    face was not detected.
+    """
+    gallery, genuine, impostor = dataset
+    rng = np.random.default_rng(seed)
+    enrolled = [identity for identity, path in gallery if module.register_student(identity, path)["status"] == "success"]
+    light = module.cascade
+
+    probes = []
+    failures = 0
+    for kind, photos in (("genuine", genuine), ("impostor", impostor)):
+        for identity, path in photos:
+            if kind == "genuine" and identity not in enrolled:
+                continue
+            for img in probe_images(path, repeats, any(g == (identity, path) for g in gallery), rng):
+                # Impostors claim a random enrolled student
+                claim = identity if kind == "genuine" else str(rng.choice(enrolled))
+                try:
+                    prepared = module.prepare(img)
+                    faces = module.find_faces(prepared)
+                except ValueError:
+                    faces = []
+                if len(faces) != 1:
+                    failures += 1
+                    continue
+                face = faces[0]["face"]
+
+                start = time.perf_counter()
+                light_embedding = light.embed_faces([face])[0]
+                light_ms = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                full_embedding = module.embed_faces([face])[0]
+                full_ms = (time.perf_counter() - start) * 1000
+
+                probes.append({
+                    "genuine": kind == "genuine",
+                    "detect_ms": prepared.timings.get("detect_ms", 0.0) + prepared.timings.get("crop_ms", 0.0),
+                    "light_ms": light_ms,
+                    "full_ms": full_ms,
+                    "light_distance": light.verify_embedding(claim, light_embedding)["distance"],
+                    "full_distance": module.verify_embedding(claim, full_embedding)["distance"]
+                })
+    return probes, failures
+
+def rates(decisions: List[bool], probes: List[Dict]) -> Dict[str, float]:
+    genuine = [accept for accept, probe in zip(decisions, probes) if probe["genuine"]]
+    impostor = [accept for accept, probe in zip(decisions, probes) if not probe["genuine"]]
+    return {
+        "true_accept_rate": round(sum(genuine) / len(genuine), 4) if genuine else None,
+        "false_accept_rate": round(sum(impostor) / len(impostor), 4) if impostor else None
+    }
+
+def evaluate(probes: List[Dict], threshold: float, light_threshold: float, margin: float) -> Dict:
+    """
+    Replays the cascade decision for one margin over the measured probes.
+    """
+    band = margin * light_threshold
+    escalated = [abs(probe["light_distance"] - light_threshold) <= band for probe in probes]
+    decisions = [
+        probe["full_distance"] <= threshold if escalate else probe["light_distance"] <= light_threshold
+        for probe, escalate in zip(probes, escalated)
+    ]
+    full_decisions = [probe["full_distance"] <= threshold for probe in probes]
+    latency = [
+        probe["detect_ms"] + probe["light_ms"] + (probe["full_ms"] if escalate else 0.0)
+        for probe, escalate in zip(probes, escalated)
+    ]
+    baseline = [probe["detect_ms"] + probe["full_ms"] for probe in probes]
+    saved = float(np.mean(baseline) - np.mean(latency))
+    return dict(
+        margin=margin,
+        escalation_rate=round(sum(escalated) / len(probes), 4),
+        mean_latency_ms=round(float(np.mean(latency)), 2),
+        latency_ms=percentiles_ms(latency),
+        latency_saved_ms=round(saved, 2),
+        latency_saved_pct=round(100 * saved / float(np.mean(baseline)), 1),
+        # Share of probes where the cascade reaches the same decision as the main model alone
+        agreement_with_full=round(sum(a == b for a, b in zip(decisions, full_decisions)) / len(probes), 4),
+        **rates(decisions, probes)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how many verifications a light cascade model decides alone and the latency it saves.")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "test_faces"),
+                        help="Image directory: loose photos of one person each, or one sub-directory per person with --by-folder (default: ml/data/test_faces)")
+    parser.add_argument("--by-folder", action="store_true", help="Treat each sub-directory of photos as one person")
+    parser.add_argument("--model", default="VGG-Face", help="Main (heavy) recognition model")
+    parser.add_argument("--cascade-model", default="SFace", help="Light recognition model tried first")
+    parser.add_argument("--detector", default="opencv", help="DeepFace detector backend")
+    parser.add_argument("--margins", type=float, nargs="+", default=[0.1, 0.25, 0.5],
+                        help="Escalation bands to compare, as fractions of the light model's threshold")
+    parser.add_argument("--holdout", type=float, default=0.25, help="Fraction of identities kept out of the gallery as impostors")
+    parser.add_argument("--repeats", type=int, default=3, help="Probes per genuine/impostor photo: the photo, then perturbed copies")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.data, args.by_folder, args.holdout, args.seed)
+    if not dataset[0]:
+        print(json.dumps({"status": "error", "message": f"No images found under {args.data}."}))
+        return
+
+    from face_recognition_module import FaceRecognitionModule
+
+    with tempfile.TemporaryDirectory() as tmp:
+        module = FaceRecognitionModule(
+            gallery_dir=os.path.join(tmp, "gallery"),
+            legacy_embeddings_file=None,
+            model_name=args.model,
+            detector_backend=args.detector,
+            ann_min_size=None,
+            cascade_model=args.cascade_model,
+            face_crop_dir=os.path.join(tmp, "face_crops")
+        )
+        module.warm_up()
+        probes, failures = probe_all(module, dataset, args.repeats, args.seed)
+
+    if not probes:
+        print(json.dumps({"status": "error", "message": "No probe had a detectable face."}))
+        return
+
+    report = {
+        "status": "success",
+        "data": os.path.abspath(args.data),
+        "model": args.model,
+        "cascade_model": args.cascade_model,
+        "threshold": module.threshold,
+        "cascade_threshold": module.cascade.threshold,
+        "probes": len(probes),
+        "detection_failures": failures,
+        "light_embed_ms": percentiles_ms([probe["light_ms"] for probe in probes]),
+        "full_embed_ms": percentiles_ms([probe["full_ms"] for probe in probes]),
+        "full_only": dict(
+            mean_latency_ms=round(float(np.mean([probe["detect_ms"] + probe["full_ms"] for probe in probes])), 2),
+            **rates([probe["full_distance"] <= module.threshold for probe in probes], probes)
+        ),
+        "cascade": [evaluate(probes, module.threshold, module.cascade.threshold, margin) for margin in args.margins]
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+def list_images(directory: str) -> List[str]:
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def load_dataset(data_dir: str, by_folder: bool, holdout: float, seed: int) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Splits the images in data_dir into (gallery, genuine probes, impostor probes),
+    each a list of (identity, path).
+
+    By default every photo directly in data_dir is its own identity, enrolled as
+    it is and probed with perturbed copies; sub-directories are ignored, so
+    copies of the same student kept elsewhere (e.g. registered_faces next to
+    test_faces) never pose as different people. With by_folder, each
+    sub-directory of photos is one person: the first photo is enrolled and the
+    others are genuine probes. Either way a holdout fraction of identities,
+    rounded but at least one when there are two or more, is not enrolled; their
+    photos are the impostor probes.
+    """
+    people: Dict[str, List[str]] = {}
+    for root, dirs, _ in os.walk(data_dir):
+        dirs.sort()
+        if not by_folder:
+            dirs.clear()
+        for path in list_images(root):
+            if by_folder and os.path.abspath(root) != os.path.abspath(data_dir):
+                identity = os.path.relpath(root, data_dir)
+            else:
+                identity = os.path.splitext(os.path.relpath(path, data_dir))[0]
+            people.setdefault(identity, []).append(path)
+
+    rng = np.random.default_rng(seed)
+    identities = sorted(people)
+    # At least one impostor, so there is a false accept rate to report, and at
+    # least one enrolled identity
+    count = min(max(1, int(round(len(identities) * holdout))), len(identities) - 1) if holdout > 0 else 0
+    held_out = set(rng.choice(identities, count, replace=False)) if count > 0 else set()
+
+    gallery, genuine, impostor = [], [], []
+    for identity in identities:
+        paths = people[identity]
+        if identity in held_out:
+            impostor.extend((identity, path) for path in paths)
+            continue
+        gallery.append((identity, paths[0]))
+        # A lone photo is probed with perturbed copies of itself
+        genuine.extend((identity, path) for path in (paths[1:] or paths))
+    return gallery, genuine, impostor
+
+def probe_images(path: str, repeats: int, enrolled: bool, rng) -> Iterator:
+    """
+    The repeats images a probe photo is tried as: the photo itself (unless it
+    is the enrolled one), then perturbed copies, so repeated probes of genuine
+    and impostor photos alike are different shots rather than the same image.
+    """
+    img = None
+    for i in range(repeats):
+        if i == 0 and not enrolled:
+            yield path
+            continue
+        if img is None:
+            img = cv2.imread(path)
+        # Unreadable photos are passed on as paths and fail detection
+        yield path if img is None else perturb(img, rng)
+
+def perturb(img: np.ndarray, rng) -> np.ndarray:
+    """
+    Another "photo" of the same face: mirrored, re-lit, slightly rotated and
+    re-compressed at a lower resolution.
+    """
+    img = cv2.flip(img, 1)
+    img = cv2.convertScaleAbs(img, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+    height, width = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-8, 8), 1.0)
+    img = cv2.warpAffine(img, matrix, (width, height), borderMode=cv2.BORDER_REFLECT)
+    img = cv2.resize(img, (max(1, int(width * 0.7)), max(1, int(height * 0.7))), interpolation=cv2.INTER_AREA)
+    return cv2.imdecode(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])[1], cv2.IMREAD_COLOR)
+
+def percentiles_ms(samples: List[float]) -> Optional[Dict[str, float]]:
+    if not samples:
+        return None
+    return {f"p{q}": round(float(np.percentile(samples, q)), 2) for q in (50, 95, 99)}
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def run_config(detector: str, model: str, max_edge: int, dataset: Tuple[list, list, list], repeats: int, seed: int) -> Dict:
+    """
+    Benchmarks one detector/model/max-edge combination. Runs in a fresh process
+    so the peak RSS is that combination's own.
+    """
+    from face_recognition_module import FaceRecognitionModule
+
+    result = {"detector": detector, "model": model, "max_image_edge": max_edge}
+    gallery, genuine, impostor = dataset
+    rng = np.random.default_rng(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            module = FaceRecognitionModule(
+                gallery_dir=os.path.join(tmp, "gallery"),
+                legacy_embeddings_file=os.path.join(tmp, "students.json"),
+                model_name=model,
+                detector_backend=detector,
+                ann_min_size=None,
+                max_image_edge=max_edge or None
+            )
+            load = module.warm_up()
+        except Exception as e:
+            return dict(result, status="error", message=f"Could not load {model} with {detector}: {e}")
+
+        detect_ms, embed_ms, compare_ms = [], [], []
+        failures = {"enroll": 0, "genuine": 0, "impostor": 0}
+
+        def embed(img, kind):
+            prepared = None
+            embedding = None
+            try:
+                prepared = module.prepare(img)
+                embedding, _ = module.embed_image(prepared)
+                embed_ms.append(prepared.timings["embed_ms"])
+            except ValueError:
+                # Unreadable, no face or several faces
+                failures[kind] += 1
+            if prepared is not None and "detect_ms" in prepared.timings:
+                detect_ms.append(prepared.timings["detect_ms"])
+            return embedding
+
+        for identity, path in gallery:
+            embedding = embed(path, "enroll")
+            if embedding is not None:
+                module.register_embedding(identity, embedding)
+
+        outcomes = {"genuine": [], "impostor": []}
+        for kind, probes in (("genuine", genuine), ("impostor", impostor)):
+            for identity, path in probes:
+                enrolled = any(g == (identity, path) for g in gallery)
+                for img in probe_images(path, repeats, enrolled, rng):
+                    embedding = embed(img, kind)
+                    if embedding is None:
+                        continue
+                    start = time.perf_counter()
+                    match = module.identify_embedding(embedding, top_k=1)
+                    compare_ms.append((time.perf_counter() - start) * 1000)
+                    top = match["candidates"][0]["student_id"] if match["candidates"] else None
+                    outcomes[kind].append((identity, top, match["matched"]))
+
+    genuine_outcomes = outcomes["genuine"]
+    attempts = {kind: len(outcomes[kind]) + failures[kind] for kind in outcomes}
+    return dict(
+        result,
+        status="success",
+        threshold=module.threshold,
+        embedding_dim=module.gallery.input_dim,
+        model_load_ms=load.get("model_load_ms"),
+        warmup_ms=load.get("total_ms"),
+        peak_rss_mb=peak_rss_mb(),
+        detect_ms=percentiles_ms(detect_ms),
+        embed_ms=percentiles_ms(embed_ms),
+        compare_ms=percentiles_ms(compare_ms),
+        enrolled=len(module.gallery),
+        enroll_failures=failures["enroll"],
+        genuine_probes=attempts["genuine"],
+        impostor_probes=attempts["impostor"],
+        detection_failure_rate=round((failures["genuine"] + failures["impostor"]) / max(1, sum(attempts.values())), 4),
+        # Probes whose face was not detected count as misses
+        rank1_accuracy=round(sum(top == identity for identity, top, _ in genuine_outcomes) / max(1, attempts["genuine"]), 4),
+        true_accept_rate=round(sum(top == identity and matched for identity, top, matched in genuine_outcomes) / max(1, attempts["genuine"]), 4),
+        false_accept_rate=round(sum(matched for _, _, matched in outcomes["impostor"]) / max(1, attempts["impostor"]), 4) if attempts["impostor"] else None
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare face detectors and recognition models: latency percentiles, peak memory and match accuracy.")
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "test_faces"),
+                        help="Image directory: loose photos of one person each, or one sub-directory per person with --by-folder (default: ml/data/test_faces)")
+    parser.add_argument("--by-folder", action="store_true", help="Treat each sub-directory of photos as one person")
+    parser.add_argument("--detectors", nargs="+", default=["opencv"], help="DeepFace detector backends, e.g. opencv ssd mtcnn retinaface")
+    parser.add_argument("--models", nargs="+", default=["VGG-Face", "Facenet", "Facenet512", "ArcFace"], help="DeepFace recognition models")
+    parser.add_argument("--max-edges", type=int, nargs="+", default=[0], help="Detection image size caps to compare (0 = full size)")
+    parser.add_argument("--holdout", type=float, default=0.25, help="Fraction of identities kept out of the gallery as impostors")
+    parser.add_argument("--repeats", type=int, default=3, help="Probes per genuine/impostor photo: the photo, then perturbed copies")
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.data, args.by_folder, args.holdout, args.seed)
+    if not dataset[0]:
+        print(json.dumps({"status": "error", "message": f"No images found under {args.data}."}))
+        return
+
+    # One fresh process per combination, so models and peak RSS do not mix
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for detector in args.detectors:
+        for model in args.models:
+            for max_edge in args.max_edges:
+                with context.Pool(1) as pool:
+                    results.append(pool.apply(run_config, (detector, model, max_edge, dataset, args.repeats, args.seed)))
+                print(f"{detector}/{model}/{max_edge or 'full'}: {results[-1].get('status')}", file=sys.stderr)
+
+    report = {
+        "status": "success",
+        "data": os.path.abspath(args.data),
+        "cpu_count": os.cpu_count(),
+        "identities_enrolled": len(dataset[0]),
+        "genuine_photos": len(dataset[1]),
+        "impostor_photos": len(dataset[2]),
+        "results": results
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
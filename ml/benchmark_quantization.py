@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from typing import Optional
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from embedding_store import EmbeddingStore
+from gallery import EmbeddingGallery
+
+def synthetic_identities(count: int, dim: int, rank: int, seed: int = 0):
+    """
+    Random identities in a rank-dimensional latent space and a fixed mixing into
+    dim outputs. Real face embeddings also vary along far fewer directions than
+    they have dimensions, which is what PCA exploits.
+    """
+    rng = np.random.default_rng(seed)
+    latent = rng.standard_normal((count, rank)).astype(np.float32)
+    mixing = rng.standard_normal((rank, dim)).astype(np.float32) / np.sqrt(rank)
+    return latent, mixing
+
+def photo_of(latent: np.ndarray, mixing: Optional[np.ndarray], noise: float, rng) -> np.ndarray:
+    # Another photo of the same person: per-photo variation on the identity, then
+    # (for synthetic identities) the mixing and a ReLU like the VGG-Face output layer
+    varied = latent + noise * rng.standard_normal(latent.shape).astype(np.float32)
+    return varied if mixing is None else np.maximum(varied @ mixing, 0)
+
+def parse_config(config: str):
+    precision, _, pca = config.partition(":")
+    components = int(pca[3:]) if pca.startswith("pca") else None
+    return precision, components
+
+def main():
+    parser = argparse.ArgumentParser(description="Report memory and accuracy of compact gallery formats (float16/int8/PCA) against float32.")
+    parser.add_argument("--gallery", default=None, help="Embedding store directory to use (default: synthetic gallery)")
+    parser.add_argument("--size", type=int, default=20000, help="Synthetic gallery size")
+    parser.add_argument("--dim", type=int, default=4096, help="Synthetic embedding dimension (VGG-Face: 4096)")
+    parser.add_argument("--rank", type=int, default=256, help="Synthetic identity directions")
+    parser.add_argument("--noise", type=float, default=0.6, help="Synthetic per-photo variation")
+    parser.add_argument("--queries", type=int, default=500, help="Genuine and impostor probes each")
+    parser.add_argument("--threshold", type=float, default=0.40, help="Cosine distance threshold for a match")
+    parser.add_argument("--configs", nargs="+", default=["float32", "float16", "int8", "float32:pca512", "int8:pca512", "int8:pca256", "int8:pca128"],
+                        help="Formats to measure as precision[:pcaN]")
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed + 1)
+
+    if args.gallery:
+        stored, _ = EmbeddingStore(args.gallery).load()
+        all_ids = stored.ids
+        if len(all_ids) < 20:
+            print(json.dumps({"status": "error", "message": "Gallery too small to benchmark."}))
+            return
+        # Probes are stored embeddings plus noise in the embedding space itself
+        embeddings = np.stack([stored.get(student_id) for student_id in all_ids])
+        scale = float(np.median(np.linalg.norm(embeddings, axis=1))) / np.sqrt(embeddings.shape[1])
+        mixing = None
+        noise = args.noise * scale
+    else:
+        embeddings, mixing = synthetic_identities(args.size + args.queries, args.dim, args.rank, seed=args.seed)
+        all_ids = [f"S{i:07d}" for i in range(len(embeddings))]
+        noise = args.noise
+
+    # Hold some identities out of the gallery to act as impostors
+    impostors = min(args.queries, len(all_ids) // 10)
+    order = rng.permutation(len(all_ids))
+    enrolled = order[impostors:]
+    held_out = order[:impostors]
+    registered = embeddings[enrolled] if args.gallery else photo_of(embeddings[enrolled], mixing, noise, rng)
+    enrolled_ids = [all_ids[i] for i in enrolled]
+
+    genuine_picks = rng.integers(0, len(enrolled), args.queries)
+    genuine = photo_of(embeddings[enrolled[genuine_picks]], mixing, noise, rng)
+    impostor = photo_of(embeddings[held_out], mixing, noise, rng)
+    expected = [enrolled_ids[i] for i in genuine_picks]
+
+    baseline = EmbeddingGallery(initial_capacity=len(enrolled_ids))
+    for student_id, embedding in zip(enrolled_ids, registered):
+        baseline.add(student_id, embedding)
+
+    def evaluate(gallery: EmbeddingGallery):
+        top1 = []
+        times = []
+        for query in genuine:
+            start = time.perf_counter()
+            top1.append(gallery.search(query, 1)[0])
+            times.append(time.perf_counter() - start)
+        impostor_best = [gallery.search(query, 1)[0][1] for query in impostor]
+        true_distances = np.array([gallery.distance(student_id, query) for student_id, query in zip(expected, genuine)])
+        return top1, impostor_best, true_distances, times
+
+    base_top1, base_impostor, base_true, _ = evaluate(baseline)
+    base_far = float(np.mean(np.array(base_impostor) <= args.threshold))
+
+    results = []
+    for config in args.configs:
+        precision, components = parse_config(config)
+        start = time.perf_counter()
+        gallery = baseline.converted(precision, components)
+        convert_seconds = time.perf_counter() - start
+        top1, impostor_best, true_distances, times = evaluate(gallery)
+        # Compact formats shift distances; this threshold gives the float32 false
+        # accept rate again and shows how much the configured one must move
+        calibrated = float(np.quantile(impostor_best, base_far)) if base_far > 0 else float(np.min(impostor_best)) - 1e-6
+
+        results.append({
+            "config": config,
+            "dim": gallery.dim,
+            "bytes_per_student": gallery.nbytes // max(1, len(gallery)),
+            "gallery_mb": round(gallery.nbytes / 2**20, 2),
+            "convert_seconds": round(convert_seconds, 2),
+            # Same top-1 identity as the float32 gallery
+            "top1_agreement": round(float(np.mean([a[0] == b[0] for a, b in zip(top1, base_top1)])), 4),
+            "rank1_accuracy": round(float(np.mean([match[0] == student_id for match, student_id in zip(top1, expected)])), 4),
+            "true_accept_rate": round(float(np.mean([match[0] == student_id and match[1] <= args.threshold for match, student_id in zip(top1, expected)])), 4),
+            "false_accept_rate": round(float(np.mean(np.array(impostor_best) <= args.threshold)), 4),
+            "calibrated_threshold": round(calibrated, 4),
+            "calibrated_true_accept_rate": round(float(np.mean([match[0] == student_id and match[1] <= calibrated for match, student_id in zip(top1, expected)])), 4),
+            "mean_abs_distance_error": round(float(np.mean(np.abs(true_distances - base_true))), 5),
+            "max_abs_distance_error": round(float(np.max(np.abs(true_distances - base_true))), 5),
+            "search_p50_ms": round(float(np.percentile(times, 50)) * 1000, 3)
+        })
+
+    print(json.dumps({
+        "status": "success",
+        "gallery_size": len(baseline),
+        "input_dim": baseline.input_dim,
+        "threshold": args.threshold,
+        "float32_reference": {
+            "genuine_mean_distance": round(float(np.mean(base_true)), 4),
+            "impostor_mean_distance": round(float(np.mean(base_impostor)), 4)
+        },
+        "results": results
+    }, indent=4))
+
+if __name__ == "__main__":
+    main()
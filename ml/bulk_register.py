@@ -0,0 +1,257 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from face_recognition_module import FaceRecognitionModule
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# The module used inside each worker process, loaded once by _init_worker
+_worker_module: Optional[FaceRecognitionModule] = None
+
+
+def entries_from_dir(directory: str) -> List[Tuple[str, str]]:
+    """
+    (student_id, image path) for every image under directory, named after the
+    file: data/intake/STUDENT_001.jpg enrolls STUDENT_001.
+    """
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                entries.append((os.path.splitext(name)[0], os.path.join(root, name)))
+    return entries
+
+
+def entries_from_csv(csv_file: str, id_column: str, image_column: str) -> List[Tuple[str, str]]:
+    """
+    (student_id, image path) for every row of a CSV with a header. Relative image
+    paths are resolved against the CSV's directory.
+    """
+    base = os.path.dirname(os.path.abspath(csv_file))
+    with open(csv_file, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in (id_column, image_column) if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV file has no column(s): {', '.join(missing)}")
+        return [
+            (row[id_column].strip(), os.path.join(base, row[image_column].strip()))
+            for row in reader if row[id_column].strip()
+        ]
+
+
+def read_checkpoint(path: str) -> Dict[Tuple[str, str], Dict]:
+    """
+    Results of earlier runs keyed by (student_id, image). A line torn by a crash
+    is ignored.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[(record["student_id"], record["image"])] = record
+    return done
+
+
+class Checkpoint:
+    """
+    JSON-lines record of finished images. Successes are only written once the
+    batch holding them is committed to the gallery, so a resumed run never skips
+    an image that was not registered.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a')
+
+    def write(self, records: List[Dict]):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _init_worker(module_kwargs: Dict, scratch_dir: str):
+    global _worker_module
+    # Workers only embed; they get an empty scratch gallery so the parent is the
+    # only process appending to the real journal
+    _worker_module = FaceRecognitionModule(
+        gallery_dir=tempfile.mkdtemp(dir=scratch_dir), legacy_embeddings_file=None,
+        ann_min_size=None, **module_kwargs
+    )
+    _worker_module.warm_up()
+
+
+def _embed_chunk(chunk: List[Tuple[str, str]]) -> List[Tuple[str, str, Optional[Tuple[list, bytes]], Optional[str]]]:
+    """
+    Embeds a chunk of (student_id, image path) in batched forward passes and
+    returns (student_id, image, (embedding, face crop), error) per image.
+    """
+    results = []
+    for (student_id, image), result in zip(chunk, _worker_module.embed_images([image for _, image in chunk], crops=True)):
+        if isinstance(result, Exception):
+            results.append((student_id, image, None, str(result)))
+        else:
+            embedding, _, face_crop = result
+            results.append((student_id, image, ([float(x) for x in embedding], face_crop), None))
+    return results
+
+
+def _chunks(entries: List[Tuple[str, str]], size: int) -> Iterator[List[Tuple[str, str]]]:
+    for start in range(0, len(entries), size):
+        yield entries[start:start + size]
+
+
+def bulk_register(entries: List[Tuple[str, str]], gallery_dir: str, checkpoint_path: str, module_kwargs: Dict,
+                  workers: int, chunk_size: int, commit_every: int, retry_failed: bool = False) -> List[Dict]:
+    """
+    Registers every (student_id, image path) entry and returns one result per
+    entry: {"student_id", "image", "status", "message"}. Entries already in the
+    checkpoint are not processed again (failures neither, unless retry_failed).
+    """
+    done = read_checkpoint(checkpoint_path)
+    results: Dict[Tuple[str, str], Dict] = {}
+    todo = []
+    seen = set()
+    rejected = []
+    for student_id, image in entries:
+        previous = done.get((student_id, image))
+        if previous is not None and (previous["status"] == "success" or not retry_failed):
+            results[(student_id, image)] = dict(previous, resumed=True)
+        elif student_id in seen:
+            rejected.append({"student_id": student_id, "image": image, "status": "error", "message": "Duplicate student ID in input; only the first image is registered."})
+        elif not os.path.exists(image):
+            rejected.append({"student_id": student_id, "image": image, "status": "error", "message": f"Image file not found: {image}"})
+        else:
+            todo.append((student_id, image))
+        seen.add(student_id)
+
+    checkpoint = Checkpoint(checkpoint_path)
+    checkpoint.write(rejected)
+    for record in rejected:
+        results[(record["student_id"], record["image"])] = record
+
+    # Shared, so the ML API can keep serving (and registering into) the same gallery meanwhile
+    module = FaceRecognitionModule(gallery_dir=gallery_dir, ann_min_size=None, shared_gallery=True, **module_kwargs)
+    scratch_dir = tempfile.mkdtemp(prefix="bulk_register-")
+    pending: List[Tuple[str, str, Tuple[list, bytes]]] = []
+
+    def commit():
+        if not pending:
+            return
+        module.register_embeddings([(student_id, embedding, image, face_crop) for student_id, image, (embedding, face_crop) in pending])
+        records = [{"student_id": student_id, "image": image, "status": "success", "message": f"Student {student_id} registered successfully."}
+                   for student_id, image, _ in pending]
+        checkpoint.write(records)
+        for record in records:
+            results[(record["student_id"], record["image"])] = record
+        pending.clear()
+
+    started = time.perf_counter()
+    processed = 0
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(workers, initializer=_init_worker, initargs=(module_kwargs, scratch_dir)) as pool:
+            for chunk_results in pool.imap_unordered(_embed_chunk, _chunks(todo, chunk_size)):
+                failures = []
+                for student_id, image, embedded, error in chunk_results:
+                    if error is None:
+                        pending.append((student_id, image, embedded))
+                    else:
+                        failures.append({"student_id": student_id, "image": image, "status": "error", "message": error})
+                checkpoint.write(failures)
+                for record in failures:
+                    results[(record["student_id"], record["image"])] = record
+                if len(pending) >= commit_every:
+                    commit()
+                processed += len(chunk_results)
+                rate = processed / max(time.perf_counter() - started, 1e-9)
+                print(f"{processed}/{len(todo)} images ({rate:.1f}/s)", file=sys.stderr)
+        commit()
+        # Fold the journal into a snapshot so the next start does not replay it
+        module.compact(background=False)
+    finally:
+        checkpoint.close()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    return [results[entry] for entry in entries if entry in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register many student faces in parallel from a directory or a CSV file.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="Directory of face images, one per student, named <student ID>.<ext>")
+    source.add_argument("--csv", help="CSV file mapping student IDs to image paths")
+    parser.add_argument("--id-column", default="student_id", help="CSV column holding the student ID")
+    parser.add_argument("--image-column", default="image", help="CSV column holding the image path")
+    parser.add_argument("--gallery", default="embeddings/gallery", help="Embedding store directory to register into")
+    parser.add_argument("--checkpoint", default=None, help="Progress file used to resume an interrupted run (default: <gallery>.bulk_checkpoint.jsonl)")
+    parser.add_argument("--retry-failed", action="store_true", help="Process images that failed in an earlier run again")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Worker processes, each loading the model once")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Images embedded per worker task (one batched forward pass)")
+    parser.add_argument("--commit-every", type=int, default=256, help="Registrations committed to the gallery per journal write")
+    parser.add_argument("--model", default="VGG-Face", help="DeepFace recognition model")
+    parser.add_argument("--detector", default="opencv", help="DeepFace detector backend")
+    parser.add_argument("--max-edge", type=int, default=None, help="Downscale images to this many pixels for detection")
+    parser.add_argument("--report", default=None, help="Also write the JSON report to this file")
+
+    args = parser.parse_args()
+
+    source = args.dir or args.csv
+    if not os.path.exists(source):
+        print(json.dumps({"status": "error", "message": f"Input not found: {source}"}))
+        return
+    try:
+        entries = entries_from_dir(args.dir) if args.dir else entries_from_csv(args.csv, args.id_column, args.image_column)
+    except ValueError as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        return
+
+    checkpoint = args.checkpoint or os.path.normpath(args.gallery) + ".bulk_checkpoint.jsonl"
+    module_kwargs = {
+        "model_name": args.model,
+        "detector_backend": args.detector,
+        "batch_size": args.chunk_size,
+        "max_image_edge": args.max_edge
+    }
+    results = bulk_register(
+        entries, args.gallery, checkpoint, module_kwargs,
+        workers=max(1, args.workers), chunk_size=max(1, args.chunk_size),
+        commit_every=max(1, args.commit_every), retry_failed=args.retry_failed
+    )
+
+    registered = sum(1 for result in results if result["status"] == "success")
+    report = {
+        "status": "success" if registered else "error",
+        "message": f"Registered {registered} of {len(results)} images.",
+        "registered": registered,
+        "failed": len(results) - registered,
+        "checkpoint": checkpoint,
+        "results": results
+    }
+
+    # Output JSON
+    print(json.dumps(report, indent=4))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import json
+import os
+import sys
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from embedding_store import EmbeddingStore, convert_json_embeddings
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the legacy students.json gallery into the binary embedding store.")
+    parser.add_argument("--json", default="embeddings/students.json", help="Path to the legacy students.json file")
+    parser.add_argument("--out", default="embeddings/gallery", help="Embedding store directory to write")
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing embedding store")
+    
+    args = parser.parse_args()
+    
+    if not os.path.exists(args.json):
+        print(json.dumps({"status": "error", "message": f"Embeddings file not found: {args.json}"}))
+        return
+
+    store = EmbeddingStore(args.out)
+    if store.exists() and not args.force:
+        print(json.dumps({"status": "error", "message": f"Embedding store already exists at {args.out}. Use --force to overwrite."}))
+        return
+
+    count = convert_json_embeddings(args.json, store)
+    
+    # Output JSON
+    print(json.dumps({
+        "status": "success",
+        "message": f"Converted {count} students.",
+        "store": args.out,
+        "snapshot": store.current_snapshot()
+    }, indent=4))
+
+if __name__ == "__main__":
+    main()
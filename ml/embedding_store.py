@@ -0,0 +1,614 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import threading
+import zlib
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from gallery import EmbeddingGallery, PCAProjection
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock_file(fd: int, blocking: bool = True) -> bool:
+    """
+    Takes an exclusive lock on the open file fd. Returns False if blocking is off
+    and another process holds it.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        if blocking:
+            raise
+        return False
+    return True
+
+
+def _unlock_file(fd: int):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class StoreLock:
+    """
+    Exclusive lock on a store, shared by the threads of this process and, with a
+    path, by every process that locks the same file. Re-entrant for the thread
+    holding it; release() may come from another thread than acquire().
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._fd = None
+        self._thread_lock = threading.Lock()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._owner == threading.get_ident():
+            self._depth += 1
+            return True
+        if not self._thread_lock.acquire(blocking):
+            return False
+        if self.path is not None:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if not _lock_file(self._fd, blocking):
+                self._thread_lock.release()
+                return False
+        self._owner = threading.get_ident()
+        self._depth = 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            if self._fd is not None:
+                _unlock_file(self._fd)
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class GenerationCounter:
+    """
+    Change counter of a store shared by several processes: an 8-byte file that
+    every process maps. Writers bump it, holding the store lock, after every
+    change; readers compare it with the value they last caught up at, which costs
+    one memory read.
+    """
+
+    LAYOUT = struct.Struct("<Q")
+
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self.LAYOUT.size:
+                os.ftruncate(fd, self.LAYOUT.size)
+            self._map = mmap.mmap(fd, self.LAYOUT.size)
+        finally:
+            os.close(fd)
+
+    @property
+    def value(self) -> int:
+        return self.LAYOUT.unpack_from(self._map)[0]
+
+    def bump(self) -> int:
+        value = self.value + 1
+        self.LAYOUT.pack_into(self._map, 0, value)
+        return value
+
+
+class RegistrationLog:
+    """
+    Append-only log of registrations and removals applied on top of a snapshot.
+    Every record is fsync'd before the call returns, so a registration that was
+    acknowledged survives a crash without rewriting the gallery.
+
+    Record layout: header <op:1s><id_len:H><meta_len:I><dim:I>, then the UTF-8
+    student ID, JSON metadata, float32 embedding and a CRC32 of everything before it.
+    A torn record at the tail (crash mid-write) is ignored and truncated on open.
+    """
+
+    REGISTER = b"R"
+    UNREGISTER = b"U"
+    HEADER = struct.Struct("<cHII")
+    CRC = struct.Struct("<I")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0
+        self._file = None
+
+    def read(self, start: int = 0) -> Iterator[Tuple[int, bytes, str, Optional[np.ndarray], Dict]]:
+        """
+        Yields (end offset, op, student_id, embedding, metadata) for every intact
+        record from byte offset start on.
+        """
+        if not os.path.exists(self.path):
+            return
+        offset = start
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+                op, id_len, meta_len, dim = self.HEADER.unpack(header)
+                body_len = id_len + meta_len + dim * 4
+                payload = f.read(body_len)
+                crc = f.read(self.CRC.size)
+                if len(payload) < body_len or len(crc) < self.CRC.size:
+                    return
+                if self.CRC.unpack(crc)[0] != zlib.crc32(header + payload):
+                    return
+                offset += self.HEADER.size + body_len + self.CRC.size
+                student_id = payload[:id_len].decode("utf-8")
+                metadata = json.loads(payload[id_len:id_len + meta_len]) if meta_len else {}
+                embedding = np.frombuffer(payload[id_len + meta_len:], dtype=np.float32) if dim else None
+                yield offset, op, student_id, embedding, metadata
+
+    def open(self):
+        valid_length = 0
+        self.records = 0
+        for valid_length, *_ in self.read():
+            self.records += 1
+        self._file = open(self.path, 'ab')
+        if self._file.tell() != valid_length:
+            self._file.truncate(valid_length)
+            self._file.seek(valid_length)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, op: bytes, student_id: str, embedding=None, metadata: Optional[Dict] = None, sync: bool = True):
+        """
+        With sync=False the record is only written; call sync() before
+        acknowledging it.
+        """
+        id_bytes = student_id.encode("utf-8")
+        meta_bytes = json.dumps(metadata).encode("utf-8") if metadata else b""
+        vector = b""
+        dim = 0
+        if embedding is not None:
+            array = np.asarray(embedding, dtype=np.float32).ravel()
+            vector = array.tobytes()
+            dim = array.shape[0]
+        header = self.HEADER.pack(op, len(id_bytes), len(meta_bytes), dim)
+        payload = id_bytes + meta_bytes + vector
+        self._file.write(header + payload + self.CRC.pack(zlib.crc32(header + payload)))
+        self.records += 1
+        if sync:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    @property
+    def size(self) -> int:
+        """
+        Bytes written so far, including unflushed ones.
+        """
+        return self._file.tell()
+
+    @property
+    def file_size(self) -> int:
+        """
+        Length of the file on disk, including bytes other processes appended.
+        """
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    def truncate(self, length: int):
+        self._file.flush()
+        self._file.truncate(length)
+        self._file.seek(length)
+
+
+class EmbeddingStore:
+    """
+    Binary on-disk gallery.
+
+    Layout of the store directory:
+        CURRENT                 name of the live snapshot directory
+        snapshot-000001/
+            vectors.npy         (capacity, dim) L2-normalized rows at the gallery's
+                                precision (float32, float16 or int8)
+            norms.npy           float32 (capacity,) original embedding norms
+            scales.npy          float32 (capacity,) per-row scales, float16/int8 only
+            projection.npy      float32 (dim, input_dim) PCA components, if projected
+            index.json          {"dim", "precision", "count", "ids", "metadata"}
+        journal-000001.log      registrations/removals made after snapshot 1
+
+    Snapshots are opened with np.memmap in copy-on-write mode, so startup only
+    maps the files and pages are read on demand. A new snapshot is written to
+    its own directory and published by atomically replacing CURRENT.
+
+    Writes only append to the active journal. Compaction rotates to a new journal,
+    writes the state at the time of rotation as the next snapshot and then drops
+    the journals it folded in. On load, every journal at or after the current
+    snapshot's generation is replayed, so a crash at any point loses nothing.
+
+    With shared=True several processes (e.g. uvicorn workers) can use the store
+    at once. They all map the same snapshot files, so the page cache holds one
+    copy of the vectors. Writes, rotations and loads are serialized by lock()
+    (a LOCK file), and every change bumps a GenerationCounter (the GENERATION
+    file). A process that sees the counter move calls follow() to read only the
+    journal records appended since its last look instead of reloading.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    NORMS_FILE = "norms.npy"
+    SCALES_FILE = "scales.npy"
+    PROJECTION_FILE = "projection.npy"
+    INDEX_FILE = "index.json"
+    CURRENT_FILE = "CURRENT"
+    LOCK_FILE = "LOCK"
+    COMPACTION_LOCK_FILE = "COMPACTION.lock"
+    GENERATION_FILE = "GENERATION"
+    FORMAT_VERSION = 2
+
+    def __init__(self, directory: str, shared: bool = False):
+        self.directory = directory
+        self.journal = None
+        self._active_generation = 0
+        self.shared = shared
+        if shared:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = StoreLock(os.path.join(directory, self.LOCK_FILE) if shared else None)
+        # Held by whichever process is writing a snapshot, so only one compacts at a time
+        self.compaction_lock = StoreLock(os.path.join(directory, self.COMPACTION_LOCK_FILE) if shared else None)
+        self.counter = GenerationCounter(os.path.join(directory, self.GENERATION_FILE)) if shared else None
+        # What this process has read: the snapshot it mapped, the journal position
+        # it has replayed up to and the counter value at that time
+        self._snapshot = None
+        self._position = (0, 0)
+        self._seen = 0
+
+    def lock(self) -> StoreLock:
+        """
+        Exclusive access to the store. Hold it around load(), follow() and appends
+        when the store is shared.
+        """
+        return self._lock
+
+    def stale(self) -> bool:
+        """
+        Whether another process changed the shared store since this one last
+        loaded or followed it.
+        """
+        return self.shared and self.counter.value != self._seen
+
+    def _changed(self):
+        # Called after this process wrote, caught up, so its own change is not read back
+        if self.journal is not None:
+            self._position = (self._active_generation, self.journal.size)
+        if self.shared:
+            self._seen = self.counter.bump()
+
+    def _snapshot_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"journal-{generation:06d}.log")
+
+    @staticmethod
+    def _generation(name: str) -> int:
+        return int(name.rsplit("-", 1)[-1].split(".")[0])
+
+    def current_snapshot(self):
+        current_file = os.path.join(self.directory, self.CURRENT_FILE)
+        if not os.path.exists(current_file):
+            return None
+        with open(current_file, 'r') as f:
+            name = f.read().strip()
+        return name or None
+
+    def exists(self) -> bool:
+        return self.current_snapshot() is not None or bool(self._journal_generations())
+
+    def _journal_generations(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            self._generation(entry) for entry in os.listdir(self.directory)
+            if entry.startswith("journal-") and entry.endswith(".log")
+        )
+
+    @property
+    def pending_records(self) -> int:
+        """
+        Records in the active journal that are not folded into a snapshot yet.
+        """
+        return 0 if self.journal is None else self.journal.records
+
+    def _load_snapshot(self, name: Optional[str]) -> Tuple[EmbeddingGallery, Dict]:
+        if name is None:
+            return EmbeddingGallery(), {}
+
+        snapshot_dir = self._snapshot_path(name)
+        with open(os.path.join(snapshot_dir, self.INDEX_FILE), 'r') as f:
+            index = json.load(f)
+
+        projection = None
+        if index.get("projected"):
+            projection = PCAProjection(np.load(os.path.join(snapshot_dir, self.PROJECTION_FILE)))
+
+        if index.get("count", 0) == 0:
+            # Version 1 snapshots predate "precision" and are always float32
+            gallery = EmbeddingGallery(dim=index.get("dim"), precision=index.get("precision", "float32"), projection=projection)
+            return gallery, index.get("metadata", {})
+
+        # mmap_mode="c": pages are shared with the page cache and only copied on write
+        vectors = np.load(os.path.join(snapshot_dir, self.VECTORS_FILE), mmap_mode="c")
+        norms = np.load(os.path.join(snapshot_dir, self.NORMS_FILE), mmap_mode="c")
+        scales = None
+        if vectors.dtype != np.float32:
+            scales = np.load(os.path.join(snapshot_dir, self.SCALES_FILE), mmap_mode="c")
+        gallery = EmbeddingGallery.from_arrays(index["ids"], vectors, norms, scales=scales, projection=projection)
+        return gallery, index.get("metadata", {})
+
+    def load(self, writable: bool = True, validate: Optional[Callable[[Dict], None]] = None) -> Tuple[EmbeddingGallery, Dict]:
+        """
+        Maps the current snapshot, replays the journals written after it and opens
+        the newest journal for appends. Returns (gallery, metadata).
+        With writable=False no journal is opened, so another process can keep
+        writing to the store meanwhile. validate is called with the metadata before
+        anything is committed; if it raises, this process keeps its previous view
+        of the store (and stays stale, so the next look fails the same way).
+        """
+        seen = self.counter.value if self.shared else 0
+        name = self.current_snapshot()
+        gallery, metadata = self._load_snapshot(name)
+        snapshot_generation = self._generation(name) if name is not None else 0
+
+        position = (snapshot_generation, 0)
+        generations = [g for g in self._journal_generations() if g >= snapshot_generation]
+        for generation in generations:
+            offset = 0
+            for offset, op, student_id, embedding, meta in RegistrationLog(self._journal_path(generation)).read():
+                self.apply(gallery, metadata, op, student_id, embedding, meta)
+            position = (generation, offset)
+        if validate is not None:
+            validate(metadata)
+        self._seen = seen
+        self._snapshot = name
+        self._position = position
+
+        if writable:
+            self._open_journal(max(generations + [snapshot_generation]))
+        return gallery, metadata
+
+    @staticmethod
+    def apply(gallery: EmbeddingGallery, metadata: Dict, op: bytes, student_id: str, embedding, meta: Dict):
+        """
+        Applies one journal record to (gallery, metadata) in place.
+        """
+        if op == RegistrationLog.REGISTER:
+            gallery.add(student_id, embedding)
+            metadata[student_id] = meta
+        elif op == RegistrationLog.UNREGISTER:
+            gallery.remove(student_id)
+            metadata.pop(student_id, None)
+
+    def follow(self) -> Optional[List[Tuple[bytes, str, Optional[np.ndarray], Dict]]]:
+        """
+        Journal records other processes appended to the shared store since this
+        one last loaded or followed it, in order, as (op, student_id, embedding,
+        metadata). Returns None if another process published a new snapshot in
+        the meantime; call load() then. Hold lock() while calling this.
+        """
+        seen = self.counter.value
+        if self.current_snapshot() != self._snapshot:
+            # Still stale until load() has taken the new snapshot in
+            return None
+        self._seen = seen
+
+        generation, offset = self._position
+        records = []
+        for g in self._journal_generations():
+            if g < generation:
+                continue
+            end = offset if g == generation else 0
+            for end, op, student_id, embedding, meta in RegistrationLog(self._journal_path(g)).read(end):
+                records.append((op, student_id, embedding, meta))
+            self._position = (g, end)
+
+        if self.journal is not None:
+            if self._position[0] != self._active_generation:
+                # Another process rotated the journal; append to the new one
+                self._open_journal(self._position[0])
+            else:
+                self.journal.records += len(records)
+                if self.journal.file_size != self._position[1]:
+                    # A process died mid-append; drop its torn record before appending after
+                    # it. Our own offset can't tell: O_APPEND writes land at the end of the file
+                    self.journal.truncate(self._position[1])
+        return records
+
+    def _open_journal(self, generation: int):
+        if self.journal is not None:
+            self.journal.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self.journal = RegistrationLog(self._journal_path(generation))
+        self.journal.open()
+        self._active_generation = generation
+
+    def append_register(self, student_id: str, embedding, metadata: Dict):
+        self.journal.append(RegistrationLog.REGISTER, student_id, embedding, metadata)
+        self._changed()
+
+    def append_registers(self, records: List[Tuple[str, np.ndarray, Dict]]):
+        """
+        Appends (student_id, embedding, metadata) records with a single fsync.
+        """
+        for student_id, embedding, metadata in records:
+            self.journal.append(RegistrationLog.REGISTER, student_id, embedding, metadata, sync=False)
+        self.journal.sync()
+        self._changed()
+
+    def append_unregister(self, student_id: str):
+        self.journal.append(RegistrationLog.UNREGISTER, student_id)
+        self._changed()
+
+    def rotate(self) -> int:
+        """
+        Starts a new journal and returns its generation. The next snapshot must be
+        written with this generation from the state as of this call.
+        """
+        with self.lock():
+            if self.journal is None:
+                self.load()
+            generation = self._active_generation + 1
+            self._open_journal(generation)
+            self._changed()
+        return generation
+
+    def write_snapshot(self, gallery: EmbeddingGallery, metadata: Dict, generation: int) -> str:
+        """
+        Writes the gallery as snapshot `generation` and makes it current.
+        Spare rows beyond the live count are left as sparse zeros so appends after
+        the next load do not immediately have to grow the matrix.
+        """
+        name = f"snapshot-{generation:06d}"
+        snapshot_dir = self._snapshot_path(name)
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        ids = gallery.ids
+        count = len(ids)
+        if count:
+            capacity = max(gallery.capacity, count)
+            for file_name, array in zip((self.VECTORS_FILE, self.NORMS_FILE, self.SCALES_FILE), gallery.arrays()):
+                if array is None:
+                    continue
+                out = np.lib.format.open_memmap(
+                    os.path.join(snapshot_dir, file_name), mode="w+",
+                    dtype=array.dtype, shape=(capacity,) + array.shape[1:]
+                )
+                out[:count] = array
+                out.flush()
+                del out
+        if gallery.projection is not None:
+            np.save(os.path.join(snapshot_dir, self.PROJECTION_FILE), gallery.projection.components)
+
+        index = {
+            "version": self.FORMAT_VERSION,
+            "dim": gallery.dim,
+            "precision": gallery.precision,
+            "projected": gallery.projection is not None,
+            "count": count,
+            "ids": ids,
+            "metadata": {student_id: metadata.get(student_id, {}) for student_id in ids}
+        }
+        with open(os.path.join(snapshot_dir, self.INDEX_FILE), 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self.lock():
+            current_tmp = os.path.join(self.directory, self.CURRENT_FILE + ".tmp")
+            with open(current_tmp, 'w') as f:
+                f.write(name)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(current_tmp, os.path.join(self.directory, self.CURRENT_FILE))
+            if self.shared:
+                # Other processes re-map the new snapshot on their next look
+                self.counter.bump()
+
+        self._remove_stale_files(generation)
+        return name
+
+    def save(self, gallery: EmbeddingGallery, metadata: Dict) -> str:
+        """
+        Synchronously writes the full gallery as a new snapshot.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return self.write_snapshot(gallery, metadata, self.rotate())
+
+    def _remove_stale_files(self, generation: int):
+        # On Windows a snapshot that is still mapped cannot be removed; it is
+        # left behind and cleaned up by a later compaction.
+        for entry in os.listdir(self.directory):
+            if entry.startswith("snapshot-") and self._generation(entry) != generation:
+                shutil.rmtree(self._snapshot_path(entry), ignore_errors=True)
+            elif entry.startswith("journal-") and entry.endswith(".log") and self._generation(entry) < generation:
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                except OSError:
+                    pass
+
+
+class FaceCropStore:
+    """
+    Aligned face crops kept from registration, one PNG per student, so the
+    gallery can be re-embedded with another model without re-detecting faces
+    (see migrate_gallery.py).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, student_id: str) -> str:
+        # Student IDs may contain path separators; quote them into a single name
+        return os.path.join(self.directory, quote(student_id, safe="") + ".png")
+
+    def write(self, student_id: str, data: bytes) -> str:
+        """
+        Atomically writes the encoded crop and returns its path.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(student_id)
+        tmp = path + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return path
+
+    def remove(self, student_id: str):
+        try:
+            os.remove(self.path(student_id))
+        except OSError:
+            pass
+
+
+def convert_json_embeddings(json_file: str, store: EmbeddingStore) -> int:
+    """
+    One-shot conversion of the legacy students.json gallery into the binary store.
+    Returns the number of students converted.
+    """
+    with open(json_file, 'r') as f:
+        embeddings = json.load(f)
+
+    gallery = EmbeddingGallery.from_embeddings(embeddings)
+    metadata = {
+        student_id: {key: value for key, value in data.items() if key != "embedding"}
+        for student_id, data in embeddings.items()
+    }
+    store.save(gallery, metadata)
+    return len(gallery)
@@ -1,85 +1,820 @@
 import os
 import json
+import importlib.metadata
+import time
+import threading
+import cv2
 import numpy as np
-from deepface import DeepFace
-from typing import Dict, Union, Tuple
+from typing import Dict, List, Optional, Union, Tuple
 
-class FaceRecognitionModule:
-    def __init__(self, embeddings_file: str = "embeddings/students.json", model_name: str = "VGG-Face", distance_metric: str = "cosine"):
-        self.embeddings_file = embeddings_file
+from gallery import EmbeddingGallery
+from assignment import linear_assignment
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore, FaceCropStore, convert_json_embeddings
+from preprocessing import PreparedImage, crop_face, decode_face_crop, encode_face_crop, prepare_array, prepare_image, scale_area
+from quality import FaceQualityError, QualityGate
+
+# A file path, encoded image bytes, a decoded BGR array or the output of prepare()
+ImageInput = Union[str, bytes, np.ndarray, PreparedImage]
+
+
+def deepface_version() -> str:
+    try:
+        return importlib.metadata.version("deepface")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class EmbeddingBackend:
+    """
+    Face detection and embedding model behind FaceRecognitionModule.
+    detect returns one dict per face like DeepFace.extract_faces ("face" as an
+    aligned RGB crop with floats in [0, 1], "facial_area", "confidence"); embed
+    returns one embedding per face.
+    """
+    model_name = ""
+    version = ""
+
+    def load_model(self):
+        pass
+
+    def load_detector(self):
+        pass
+
+    def detect(self, img, enforce_detection: bool = True) -> List[Dict]:
+        raise NotImplementedError
+
+    def embed(self, faces: List[np.ndarray], batch_size: int) -> List[list]:
+        raise NotImplementedError
+
+
+class DeepFaceBackend(EmbeddingBackend):
+    """
+    DeepFace recognition models and detectors. DeepFace (and TensorFlow) are
+    only imported once a model or detector is first used.
+    """
+
+    def __init__(self, model_name: str = "VGG-Face", detector_backend: str = "opencv"):
         self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.version = deepface_version()
+        self._model = None
+
+    def load_model(self):
+        if self._model is None:
+            from deepface import DeepFace
+            self._model = DeepFace.build_model(self.model_name)
+        return self._model
+
+    def load_detector(self):
+        from deepface import DeepFace
+        try:
+            DeepFace.build_model(model_name=self.detector_backend, task="face_detector")
+        except TypeError:
+            # Older deepface builds detectors lazily; the first detection loads it
+            pass
+
+    def detect(self, img, enforce_detection: bool = True) -> List[Dict]:
+        from deepface import DeepFace
+        return DeepFace.extract_faces(
+            img_path=img,
+            detector_backend=self.detector_backend,
+            enforce_detection=enforce_detection,
+            align=True
+        )
+
+    def embed(self, faces: List[np.ndarray], batch_size: int) -> List[list]:
+        """
+        Batched forward passes of up to batch_size faces, mirroring the
+        preprocessing of DeepFace.represent.
+        """
+        from deepface.modules import preprocessing
+
+        model = self.load_model()
+        target_size = model.input_shape
+        embeddings = []
+        for start in range(0, len(faces), batch_size):
+            batch = np.concatenate([
+                preprocessing.normalize_input(
+                    img=preprocessing.resize_image(img=face[:, :, ::-1], target_size=(target_size[1], target_size[0])),
+                    normalization="base"
+                )
+                for face in faces[start:start + batch_size]
+            ])
+            output = np.asarray(model.forward(batch), dtype=np.float32)
+            if output.ndim == 1:
+                output = output.reshape(1, -1)
+            if output.shape[0] != batch.shape[0]:
+                # Older deepface models only return the first row of a batch
+                output = np.stack([np.asarray(model.forward(batch[i:i + 1]), dtype=np.float32).ravel() for i in range(batch.shape[0])])
+            embeddings.extend(row.tolist() for row in output)
+        return embeddings
+
+
+class SyntheticBackend(EmbeddingBackend):
+    """
+    Deterministic stand-in for load tests on machines without TensorFlow or model
+    weights. The whole image is the face (a blank image has none), and the
+    embedding is a fixed random projection of the face shrunk to 16x16 pixels:
+    the same photo always gets the same embedding and similar photos get close
+    ones. embed_latency_ms per forward pass and detect_latency_ms per image are
+    slept to stand in for a real model's cost.
+    """
+    model_name = "Synthetic"
+    version = "1"
+
+    def __init__(self, dim: int = 512, embed_latency_ms: float = 0.0, detect_latency_ms: float = 0.0, seed: int = 0):
+        self.dim = dim
+        self.embed_latency_ms = embed_latency_ms
+        self.detect_latency_ms = detect_latency_ms
+        self.seed = seed
+        self._projection = None
+
+    def load_model(self):
+        if self._projection is None:
+            rng = np.random.default_rng(self.seed)
+            self._projection = (rng.standard_normal((16 * 16 * 3, self.dim)) / np.sqrt(self.dim)).astype(np.float32)
+        return self._projection
+
+    def detect(self, img, enforce_detection: bool = True) -> List[Dict]:
+        if self.detect_latency_ms:
+            time.sleep(self.detect_latency_ms / 1000)
+        if isinstance(img, str):
+            path = img
+            img = cv2.imread(path)
+            if img is None:
+                raise ValueError(f"Could not read image: {path}")
+        if float(np.std(img)) < 2.0:
+            if enforce_detection:
+                raise ValueError("Face could not be detected. Please confirm that the picture is a face photo.")
+            return []
+        height, width = img.shape[:2]
+        return [{"face": img[:, :, ::-1] / 255, "facial_area": {"x": 0, "y": 0, "w": width, "h": height}, "confidence": 1.0}]
+
+    def embed(self, faces: List[np.ndarray], batch_size: int) -> List[list]:
+        projection = self.load_model()
+        embeddings = []
+        for start in range(0, len(faces), batch_size):
+            if self.embed_latency_ms:
+                time.sleep(self.embed_latency_ms / 1000)
+            for face in faces[start:start + batch_size]:
+                pixels = cv2.resize(np.asarray(face, dtype=np.float32), (16, 16), interpolation=cv2.INTER_AREA).ravel()
+                embeddings.append((pixels - pixels.mean()) @ projection)
+        return [embedding.tolist() for embedding in embeddings]
+
+
+def make_backend(name: str, model_name: str, detector_backend: str, options: Optional[Dict] = None) -> EmbeddingBackend:
+    """
+    Builds an embedding backend by name: "deepface" (model_name and
+    detector_backend) or "synthetic" (options are SyntheticBackend's arguments).
+    """
+    if name == "deepface":
+        return DeepFaceBackend(model_name, detector_backend)
+    if name == "synthetic":
+        return SyntheticBackend(**(options or {}))
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+class RosterSlice:
+    """
+    The gallery rows of a fixed set of students, e.g. a class roster for the life
+    of a streaming session. Rows are looked up once and again only when the
+    gallery is replaced by a write, instead of on every identification.
+    """
+
+    def __init__(self, candidate_ids: List[str]):
+        self.candidate_ids = list(candidate_ids)
+        self._gallery = None
+        self._rows = None
+
+    def rows(self, gallery: EmbeddingGallery) -> np.ndarray:
+        if gallery is not self._gallery:
+            self._rows = gallery.rows_for(self.candidate_ids)
+            self._gallery = gallery
+        return self._rows
+
+    def __len__(self):
+        return len(self.candidate_ids)
+
+class FaceRecognitionModule:
+    def __init__(self, gallery_dir: str = "embeddings/gallery", model_name: str = "VGG-Face", distance_metric: str = "cosine", legacy_embeddings_file: str = "embeddings/students.json", compact_after: int = 500, detector_backend: str = "opencv", batch_size: int = 32, ann_min_size: Optional[int] = 20000, ann_probe: int = 8, gallery_precision: str = "float32", pca_components: Optional[int] = None, max_image_edge: Optional[int] = None, decode_edge: Optional[int] = None, face_crop_dir: Optional[str] = None, quality_gate: Optional[QualityGate] = QualityGate(), cascade_model: Optional[str] = None, cascade_margin: float = 0.25, backend: str = "deepface", backend_options: Optional[Dict] = None, shared_gallery: bool = False):
+        # shared_gallery: several processes (e.g. uvicorn workers) serve and write the
+        # same gallery; see refresh()
+        self.store = EmbeddingStore(gallery_dir, shared=shared_gallery)
+        # Aligned face crops saved at registration, next to the gallery by default
+        self.face_crops = FaceCropStore(face_crop_dir or os.path.join(os.path.dirname(os.path.normpath(gallery_dir)), "face_crops"))
+        self.legacy_embeddings_file = legacy_embeddings_file
+        # Detection and embedding are delegated to an EmbeddingBackend: DeepFace, or
+        # the deterministic "synthetic" stub for load tests without model weights.
+        # The backend is named rather than passed in so the arguments stay picklable
+        # for inference worker processes.
+        self.backend_name = backend
+        self.backend_options = backend_options
+        self.backend = make_backend(backend, model_name, detector_backend, backend_options)
+        self.model_name = self.backend.model_name
+        self.detector_backend = detector_backend
         self.distance_metric = distance_metric
         self.thresholds = {
             "VGG-Face": {"cosine": 0.40, "euclidean": 0.60, "euclidean_l2": 0.86},
             "Facenet": {"cosine": 0.40, "euclidean": 10, "euclidean_l2": 0.80},
             "Facenet512": {"cosine": 0.30, "euclidean": 23.56, "euclidean_l2": 1.04},
-            "ArcFace": {"cosine": 0.68, "euclidean": 4.15, "euclidean_l2": 1.13}
+            "ArcFace": {"cosine": 0.68, "euclidean": 4.15, "euclidean_l2": 1.13},
+            "SFace": {"cosine": 0.593, "euclidean": 10.734, "euclidean_l2": 1.055},
+            "OpenFace": {"cosine": 0.10, "euclidean": 0.55, "euclidean_l2": 0.55},
+            "Synthetic": {"cosine": 0.30, "euclidean": 30.0, "euclidean_l2": 0.77}
         }
-        self.threshold = self.thresholds.get(model_name, {}).get(distance_metric, 0.40)
-        self.embeddings = self._load_embeddings()
+        self.threshold = self.thresholds.get(self.model_name, {}).get(distance_metric, 0.40)
+        # Stored with every registration; a gallery made by another model is refused
+        self.model_version = self.backend.version
+        # Journal records after which the gallery is folded into a new snapshot
+        self.compact_after = compact_after
+        self._write_lock = threading.Lock()
+        self._compaction_thread = None
+        # Storage format of the gallery: "float32", "float16" or "int8", optionally
+        # PCA-projected to pca_components dimensions. Applied on load and compaction.
+        self.gallery_precision = gallery_precision
+        self.pca_components = pca_components
+        # self.embeddings holds per-student metadata only; vectors live in self.gallery.
+        # self.gallery is replaced (never mutated) on writes, so readers take a reference
+        # once and search it without locking.
+        self.gallery, self.embeddings = self._load_embeddings()
+        # Galleries with at least ann_min_size students are searched through an IVF
+        # index (built in the background); smaller ones, or None, use exact search
+        self.ann_min_size = ann_min_size
+        self.ann_probe = ann_probe
+        self._index_thread = None
+        self.build_index()
+        # Faces embedded per forward pass in batch calls
+        self.batch_size = batch_size
+        # Images are downscaled to max_image_edge pixels for detection and faces are
+        # cropped from the full-size image; JPEGs may be decoded at reduced size
+        # as long as their longest side stays at least decode_edge pixels
+        self.max_image_edge = max_image_edge
+        self.decode_edge = decode_edge
+        # Blur, exposure, face size and pose checks between detection and embedding
+        # for single-face images (None = off); group photos are not gated
+        self.quality_gate = quality_gate
+        # Optional two-stage verification: a light model embeds every face first and
+        # only distances within cascade_margin (a fraction of its threshold) of its
+        # threshold are re-checked with this module's model. The light embeddings
+        # live in a gallery of their own next to this one.
+        self.cascade_margin = cascade_margin
+        self.cascade: Optional["FaceRecognitionModule"] = None
+        if cascade_model:
+            self.cascade = FaceRecognitionModule(
+                gallery_dir=f"{os.path.normpath(gallery_dir)}.{cascade_model}",
+                model_name=cascade_model,
+                distance_metric=distance_metric,
+                legacy_embeddings_file=None,
+                compact_after=compact_after,
+                detector_backend=detector_backend,
+                batch_size=batch_size,
+                ann_min_size=None,
+                face_crop_dir=self.face_crops.directory,
+                quality_gate=None,
+                backend=backend,
+                backend_options=backend_options,
+                shared_gallery=shared_gallery
+            )
+        # Set by warm_up(); the backend otherwise loads the model on the first request
+        self.warm = False
+        self.load_timings: Dict[str, float] = {}
+
+    def _load_embeddings(self) -> Tuple[EmbeddingGallery, Dict]:
+        with self.store.lock():
+            if not self.store.exists() and self.legacy_embeddings_file and os.path.exists(self.legacy_embeddings_file):
+                # First start after upgrading: convert students.json into the binary store once
+                try:
+                    convert_json_embeddings(self.legacy_embeddings_file, self.store)
+                except json.JSONDecodeError:
+                    pass
+            gallery, metadata = self.store.load(validate=self._check_model)
+            converted = self._convert(gallery)
+            if converted is not gallery:
+                self.store.save(converted, metadata)
+                return self.store.load()
+            return gallery, metadata
+
+    def refresh(self) -> bool:
+        """
+        Picks up registrations and removals that other processes sharing the
+        gallery (shared_gallery=True) made since this one last looked. Only the new
+        journal records are applied; after another process compacted, the new
+        snapshot is mapped instead. Returns whether anything changed. When nothing
+        did, this costs one read of the store's generation counter.
+        """
+        changed = self.cascade.refresh() if self.cascade is not None else False
+        if not self.store.stale():
+            return changed
+        with self._write_lock, self.store.lock():
+            self._catch_up()
+        return True
+
+    def _catch_up(self):
+        # Callers hold self._write_lock and self.store.lock()
+        if not self.store.shared:
+            return
+        records = self.store.follow()
+        if records is None:
+            # migrate_gallery.py may have switched the gallery to another model. The
+            # check runs before the store takes the new snapshot in, so the refusal
+            # repeats on every refresh and write instead of only the first.
+            gallery, metadata = self.store.load(validate=self._check_model)
+            self.gallery, self.embeddings = gallery, metadata
+            # Row numbers changed, so the ANN index has to be rebuilt
+            self.build_index()
+        elif records:
+            gallery = self.gallery.copy()
+            for record in records:
+                self.store.apply(gallery, self.embeddings, *record)
+            self.gallery = gallery
 
-    def _load_embeddings(self) -> Dict:
-        if os.path.exists(self.embeddings_file):
+    def _check_model(self, metadata: Dict):
+        # Registrations from before model tagging carry no "model" and are assumed to match
+        models = {meta.get("model") for meta in metadata.values()} - {None, self.model_name}
+        if models:
+            raise ValueError(
+                f"The gallery at {self.store.directory} holds {', '.join(sorted(models))} embeddings, which cannot be "
+                f"compared with {self.model_name}. Re-embed it with: python migrate_gallery.py --model {self.model_name}"
+            )
+
+    def _registration_metadata(self, registered_image: Optional[str], face_crop: Optional[str]) -> Dict:
+        metadata = {
+            "registered_image": registered_image,
+            "model": self.model_name,
+            "model_version": self.model_version
+        }
+        if face_crop is not None:
+            metadata["face_crop"] = face_crop
+        return metadata
+
+    def _convert(self, gallery: EmbeddingGallery) -> EmbeddingGallery:
+        """
+        Returns the gallery in the configured storage format (the same object if it
+        already is). PCA is only fitted once there are at least pca_components
+        students; until then the gallery keeps its current projection.
+        """
+        current = gallery.projection.output_dim if gallery.projection is not None else None
+        components = self.pca_components or None
+        if components and components != current and len(gallery) < components:
+            components = current
+        if len(gallery) == 0 or (gallery.precision == self.gallery_precision and components == current):
+            return gallery
+        return gallery.converted(self.gallery_precision, components)
+
+    def compact(self, background: bool = True):
+        """
+        Folds the registration journal into a new snapshot. Writes made while the
+        snapshot is being written go to the next journal and are not blocked.
+        With background=False a compaction already in progress is waited for first.
+        """
+        running = self._compaction_thread
+        if not background and running is not None and running.is_alive():
+            running.join()
+        with self._write_lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            if not self.store.compaction_lock.acquire(blocking=False):
+                # Another process sharing the gallery is compacting it
+                return
+            try:
+                with self.store.lock():
+                    self._catch_up()
+                    gallery = self.gallery
+                    metadata = dict(self.embeddings)
+                    generation = self.store.rotate()
+            except BaseException:
+                self.store.compaction_lock.release()
+                raise
+
+        def run():
             try:
-                with open(self.embeddings_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-        return {}
+                self.store.write_snapshot(self._convert(gallery), metadata, generation)
+                # Re-map the compacted snapshot so dead rows and copy-on-write pages are released
+                with self._write_lock, self.store.lock():
+                    self.gallery, self.embeddings = self.store.load()
+            finally:
+                self.store.compaction_lock.release()
+            # Row numbers changed, so the ANN index has to be rebuilt
+            self.build_index()
+
+        if background:
+            self._compaction_thread = threading.Thread(target=run, name="gallery-compaction", daemon=True)
+            self._compaction_thread.start()
+        else:
+            run()
 
-    def _save_embeddings(self):
-        with open(self.embeddings_file, 'w') as f:
-            json.dump(self.embeddings, f, indent=4)
+    def _maybe_compact(self):
+        if self.store.pending_records >= self.compact_after:
+            self.compact()
 
-    def generate_embedding(self, img_path: str) -> Union[list, None]:
+    def build_index(self, background: bool = True):
         """
-        Generates embedding for a given image path.
-        Returns the embedding list or raises an exception if face is not found.
+        Trains an ANN index over the current gallery if it is large enough. Searches
+        stay exact until the index is attached; registrations made while it trains
+        are filed into it on attach.
         """
-        try:
-            # DeepFace.represent returns a list of dicts. We assume 1 face per image for registration.
-            results = DeepFace.represent(
-                img_path=img_path,
-                model_name=self.model_name,
-                enforce_detection=True,
-                detector_backend="opencv"
-            )
-            
-            if not results:
-                raise ValueError("No face detected in the image.")
-            
-            if len(results) > 1:
-                # We can handle this by taking the largest face or raising error
-                # For strict registration, raising error is safer
-                raise ValueError(f"Multiple faces ({len(results)}) detected. Please provide an image with a single clear face.")
+        gallery = self.gallery
+        if self.ann_min_size is None or len(gallery) < self.ann_min_size:
+            return
 
-            return results[0]["embedding"]
-        except Exception as e:
-            raise e
+        def run():
+            index = IVFIndex(n_probe=self.ann_probe)
+            built_rows = gallery.build_index(index)
+            with self._write_lock:
+                # A compaction reload in the meantime renumbered the rows; it starts its own build
+                if not self.gallery.shares_rows(gallery):
+                    return
+                current = self.gallery.copy()
+                current.attach_index(index, built_rows)
+                self.gallery = current
+
+        if background:
+            self._index_thread = threading.Thread(target=run, name="gallery-index", daemon=True)
+            self._index_thread.start()
+        else:
+            run()
+
+    def warm_up(self) -> Dict[str, float]:
+        """
+        Loads the recognition model and face detector and runs one dummy inference
+        through each, so the first real request does not pay for weight loading and
+        buffer allocation. Returns the time spent in each stage in milliseconds.
+        """
+        timings = {}
+
+        start = time.perf_counter()
+        self.backend.load_model()
+        timings["model_load_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        self.backend.load_detector()
+        timings["detector_load_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        self.embed_faces([np.zeros((224, 224, 3), dtype=np.float32)])
+        timings["embedding_warmup_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        self.detect_faces(np.zeros((224, 224, 3), dtype=np.uint8), enforce_detection=False)
+        timings["detector_warmup_ms"] = (time.perf_counter() - start) * 1000
+
+        if self.cascade is not None:
+            start = time.perf_counter()
+            self.cascade.embed_faces([np.zeros((224, 224, 3), dtype=np.float32)])
+            timings["cascade_warmup_ms"] = (time.perf_counter() - start) * 1000
+
+        timings["total_ms"] = sum(timings.values())
+        self.load_timings = {stage: round(ms, 2) for stage, ms in timings.items()}
+        self.warm = True
+        return self.load_timings
+
+    def detect_faces(self, img_path: ImageInput, enforce_detection: bool = True) -> List[Dict]:
+        """
+        Runs the face detector. Returns one dict per face with the aligned RGB crop
+        ("face", floats in [0, 1]), "facial_area" and detector "confidence".
+        """
+        return self.backend.detect(img_path, enforce_detection=enforce_detection)
+
+    def prepare(self, img: ImageInput) -> PreparedImage:
+        """
+        Runs the preprocessing stage: decode (possibly at reduced size), EXIF
+        orientation and downscaling for detection. See preprocessing.prepare_image.
+        """
+        if isinstance(img, PreparedImage):
+            return img
+        if isinstance(img, str):
+            if not os.path.isfile(img):
+                # Not a file (URL, base64...): let DeepFace load it as before
+                return PreparedImage(None, img, 1.0, 1.0, {})
+            with open(img, "rb") as f:
+                img = f.read()
+        if isinstance(img, (bytes, bytearray)):
+            return prepare_image(bytes(img), max_edge=self.max_image_edge, decode_edge=self.decode_edge)
+        return prepare_array(img, max_edge=self.max_image_edge)
+
+    def find_faces(self, prepared: PreparedImage, enforce_detection: bool = True) -> List[Dict]:
+        """
+        Detects faces on the downscaled image, then crops each one from the
+        full-size image so the embedding sees every available pixel of the face.
+        Returned facial areas are in pixels of the original upload.
+        """
+        start = time.perf_counter()
+        detected = self.detect_faces(prepared.detection, enforce_detection=enforce_detection)
+        prepared.timings["detect_ms"] = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        faces = []
+        for face in detected:
+            area = face.get("facial_area") or {}
+            if prepared.scale != 1.0 and prepared.image is not None and area:
+                area = scale_area(area, prepared.scale)
+                crop = crop_face(prepared.image, area)
+            else:
+                crop = face["face"]
+            faces.append({"face": crop, "facial_area": scale_area(area, prepared.original_scale), "confidence": face.get("confidence")})
+        prepared.timings["crop_ms"] = (time.perf_counter() - start) * 1000
+        return faces
 
-    def register_student(self, student_id: str, img_path: str) -> Dict:
+    def embed_faces(self, faces: List[np.ndarray]) -> List[list]:
+        """
+        Embeds aligned face crops from detect_faces in batched forward passes of up
+        to self.batch_size faces.
+        """
+        if not faces:
+            return []
+        return self.backend.embed(faces, self.batch_size)
+
+    def _check_quality(self, prepared: PreparedImage, face: Dict):
+        """
+        Raises quality.FaceQualityError if the face is not worth embedding.
+        """
+        if self.quality_gate is None:
+            return
+        start = time.perf_counter()
         try:
-            embedding = self.generate_embedding(img_path)
-            
-            self.embeddings[student_id] = {
-                "embedding": embedding,
-                "registered_image": img_path
-            }
-            self._save_embeddings()
-            
-            return {
+            self.quality_gate.check(face["face"], face["facial_area"])
+        finally:
+            prepared.timings["quality_ms"] = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _error_result(error: Exception, **fields) -> Dict:
+        result = {
+            "status": "error",
+            "message": str(error)
+        }
+        if isinstance(error, FaceQualityError):
+            # Tells the caller the photo should be retaken, and why
+            result["quality_issue"] = error.reason
+        result.update(fields)
+        return result
+
+    def _single_face(self, faces: List[Dict]) -> Dict:
+        if not faces:
+            raise ValueError("No face detected in the image.")
+        
+        if len(faces) > 1:
+            # We can handle this by taking the largest face or raising error
+            # For strict registration, raising error is safer
+            raise ValueError(f"Multiple faces ({len(faces)}) detected. Please provide an image with a single clear face.")
+
+        return faces[0]
+
+    def generate_embedding(self, img_path: ImageInput) -> Union[list, None]:
+        """
+        Generates embedding for a given image path or decoded BGR image array.
+        Returns the embedding list or raises an exception if face is not found.
+        """
+        return self.embed_image(img_path)[0]
+
+    def embed_image(self, img_path: ImageInput) -> Tuple[list, Dict]:
+        """
+        Like generate_embedding, but returns (embedding, facial_area).
+        """
+        # We assume 1 face per image for registration and verification.
+        embedding, facial_area, _ = self.embed_image_with_crop(img_path, encode=False)
+        return embedding, facial_area
+
+    def embed_image_with_crop(self, img_path: ImageInput, encode: bool = True) -> Tuple[list, Dict, Optional[bytes]]:
+        """
+        Like embed_image, but also returns the aligned face crop that was embedded,
+        PNG-encoded for register_embedding (None if encode is False).
+        """
+        prepared = self.prepare(img_path)
+        face = self._single_face(self.find_faces(prepared))
+        self._check_quality(prepared, face)
+        start = time.perf_counter()
+        embedding = self.embed_faces([face["face"]])[0]
+        prepared.timings["embed_ms"] = (time.perf_counter() - start) * 1000
+        return embedding, face["facial_area"], encode_face_crop(face["face"]) if encode else None
+
+    def generate_embeddings_batch(self, images: List[ImageInput]) -> List[Union[list, Exception]]:
+        """
+        Detects faces image by image, then embeds every valid face in batched
+        forward passes. Returns, per image, the embedding or the exception that
+        rejected it.
+        """
+        return [result if isinstance(result, Exception) else result[0] for result in self.embed_images(images)]
+
+    def embed_images(self, images: List[ImageInput], crops: bool = False) -> List[Union[Tuple, Exception]]:
+        """
+        Like generate_embeddings_batch, but returns (embedding, facial_area) per
+        image, or (embedding, facial_area, PNG-encoded face crop) with crops=True.
+        """
+        results: List[Union[Tuple, Exception]] = [None] * len(images)
+        positions, prepared, faces = self._detect_single_faces(images, results)
+
+        start = time.perf_counter()
+        embeddings = self.embed_faces([face["face"] for face in faces])
+        # One batched pass serves every image; each is charged an equal share
+        share = (time.perf_counter() - start) * 1000 / max(1, len(faces))
+        for i, image, face, embedding in zip(positions, prepared, faces, embeddings):
+            image.timings["embed_ms"] = share
+            results[i] = (embedding, face["facial_area"]) + ((encode_face_crop(face["face"]),) if crops else ())
+        return results
+
+    def _detect_single_faces(self, images: List[ImageInput], results: List) -> Tuple[List[int], List[PreparedImage], List[Dict]]:
+        """
+        Prepares each image and finds its single face, passing the quality gate.
+        Rejections are stored as exceptions in results; returns (positions,
+        prepared images, faces) of the rest.
+        """
+        positions, prepared, faces = [], [], []
+        for i, img in enumerate(images):
+            try:
+                image = self.prepare(img)
+                face = self._single_face(self.find_faces(image))
+                self._check_quality(image, face)
+            except Exception as e:
+                results[i] = e
+                continue
+            positions.append(i)
+            prepared.append(image)
+            faces.append(face)
+        return positions, prepared, faces
+
+    def embed_crop_light(self, face_crop: bytes) -> Optional[list]:
+        """
+        The cascade model's embedding of a PNG-encoded face crop, as
+        register_embedding's light_embedding (None without a cascade).
+        """
+        if self.cascade is None:
+            return None
+        return self.cascade.embed_faces([decode_face_crop(face_crop)])[0]
+
+    def _register_cascade(self, registrations: List[Tuple[str, Optional[str], Optional[bytes], Optional[list]]]):
+        """
+        Adds the light model's embeddings of (student_id, registered_image,
+        face_crop, light_embedding) registrations to the cascade gallery, embedding
+        the crops of those without one. Runs after the main registration; a student
+        missing here is simply always escalated.
+        """
+        if self.cascade is None:
+            return
+        for student_id, _, face_crop, light_embedding in registrations:
+            if face_crop is None and light_embedding is None and student_id in self.cascade.gallery:
+                # Re-registered without a crop: the old light embedding is of the old photo
+                self.cascade.unregister_student(student_id)
+        registrations = [entry for entry in registrations if entry[2] is not None or entry[3] is not None]
+        if not registrations:
+            return
+        missing = [entry for entry in registrations if entry[3] is None]
+        computed = iter(self.cascade.embed_faces([decode_face_crop(face_crop) for _, _, face_crop, _ in missing]) if missing else [])
+        self.cascade.register_embeddings([
+            (student_id, next(computed) if light_embedding is None else light_embedding, registered_image, None)
+            for student_id, registered_image, _, light_embedding in registrations
+        ])
+
+    def register_embedding(self, student_id: str, embedding, registered_image: Optional[str] = None, face_crop: Optional[bytes] = None, light_embedding: Optional[list] = None) -> Dict:
+        """
+        Adds an already computed embedding to the gallery and the registration journal.
+        face_crop is the PNG-encoded aligned face it was computed from, kept so the
+        gallery can later be re-embedded with another model. With a cascade,
+        light_embedding is the crop's embed_crop_light(); without it the light
+        model is run here.
+        """
+        metadata = self._registration_metadata(
+            registered_image, self.face_crops.write(student_id, face_crop) if face_crop is not None else None
+        )
+
+        with self._write_lock, self.store.lock():
+            self._catch_up()
+            self.store.append_register(student_id, embedding, metadata)
+            gallery = self.gallery.copy()
+            gallery.add(student_id, embedding)
+            self.embeddings[student_id] = metadata
+            self.gallery = gallery
+        self._maybe_compact()
+        self._register_cascade([(student_id, registered_image, face_crop, light_embedding)])
+        
+        return {
+            "status": "success",
+            "message": f"Student {student_id} registered successfully.",
+            "student_id": student_id
+        }
+
+    def register_embeddings(self, registrations: List[Tuple[str, list, Optional[str], Optional[bytes]]]) -> List[Dict]:
+        """
+        Adds many (student_id, embedding, registered_image, face_crop) entries at
+        once: one journal fsync and one gallery copy for the whole batch.
+        """
+        records = [
+            (student_id, embedding, self._registration_metadata(
+                registered_image, self.face_crops.write(student_id, face_crop) if face_crop is not None else None
+            ))
+            for student_id, embedding, registered_image, face_crop in registrations
+        ]
+
+        with self._write_lock, self.store.lock():
+            self._catch_up()
+            self.store.append_registers(records)
+            gallery = self.gallery.copy()
+            for student_id, embedding, metadata in records:
+                gallery.add(student_id, embedding)
+                self.embeddings[student_id] = metadata
+            self.gallery = gallery
+        self._maybe_compact()
+        self._register_cascade([(student_id, registered_image, face_crop, None) for student_id, _, registered_image, face_crop in registrations])
+
+        return [
+            {
                 "status": "success",
                 "message": f"Student {student_id} registered successfully.",
                 "student_id": student_id
             }
+            for student_id, _, _ in records
+        ]
+
+    def build_cascade_gallery(self) -> int:
+        """
+        Gives students registered before the cascade was enabled a light embedding,
+        computed from their stored face crops. Returns the number added.
+        """
+        if self.cascade is None:
+            return 0
+        missing = [
+            (student_id, meta.get("registered_image"), meta["face_crop"])
+            for student_id, meta in list(self.embeddings.items())
+            if student_id not in self.cascade.gallery and meta.get("face_crop") and os.path.isfile(meta["face_crop"])
+        ]
+        for start in range(0, len(missing), self.batch_size):
+            batch = []
+            for student_id, registered_image, path in missing[start:start + self.batch_size]:
+                with open(path, 'rb') as f:
+                    batch.append((student_id, registered_image, f.read(), None))
+            self._register_cascade(batch)
+        return len(missing)
+
+    def register_student(self, student_id: str, img_path: ImageInput, registered_image: Optional[str] = None) -> Dict:
+        """
+        registered_image records where the source photo is kept when img_path is an
+        in-memory array.
+        """
+        try:
+            embedding, _, face_crop = self.embed_image_with_crop(img_path)
+            return self.register_embedding(
+                student_id, embedding,
+                registered_image=registered_image or (img_path if isinstance(img_path, str) else None),
+                face_crop=face_crop
+            )
         except Exception as e:
+            return self._error_result(e)
+
+    def unregister_student(self, student_id: str) -> Dict:
+        with self._write_lock, self.store.lock():
+            self._catch_up()
+            if student_id not in self.gallery:
+                return {
+                    "status": "error",
+                    "message": "Student ID not found in database."
+                }
+            self.store.append_unregister(student_id)
+            gallery = self.gallery.copy()
+            gallery.remove(student_id)
+            self.embeddings.pop(student_id, None)
+            self.gallery = gallery
+            self.face_crops.remove(student_id)
+        self._maybe_compact()
+        if self.cascade is not None and student_id in self.cascade.gallery:
+            self.cascade.unregister_student(student_id)
+        
+        return {
+            "status": "success",
+            "message": f"Student {student_id} unregistered successfully.",
+            "student_id": student_id
+        }
+
+    def verify_embedding(self, claimed_student_id: str, captured_embedding) -> Dict:
+        """
+        1:1 comparison of an already computed embedding against the claimed student.
+        """
+        self.refresh()
+        gallery = self.gallery
+        if claimed_student_id not in gallery:
             return {
                 "status": "error",
-                "message": str(e)
+                "message": "Student ID not found in database.",
+                "match": False
             }
 
-    def verify_student(self, claimed_student_id: str, img_path: str) -> Dict:
-        if claimed_student_id not in self.embeddings:
+        distance = gallery.distance(claimed_student_id, captured_embedding, self.distance_metric)
+        match = distance <= self.threshold
+        confidence = self._confidence(distance)
+        
+        reason = "Face matched" if match else "Face mismatch - proxy attempt"
+        
+        return {
+            "status": "success",
+            "match": bool(match),
+            "confidence_score": round(confidence, 2),
+            "distance": float(distance),
+            "threshold": self.threshold,
+            "reason": reason,
+            "student_id": claimed_student_id
+        }
+
+    def verify_student(self, claimed_student_id: str, img_path: ImageInput) -> Dict:
+        self.refresh()
+        if claimed_student_id not in self.gallery:
             return {
                 "status": "error",
                 "message": "Student ID not found in database.",
@@ -87,97 +822,246 @@ class FaceRecognitionModule:
             }
 
         try:
-            target_embedding = self.embeddings[claimed_student_id]["embedding"]
+            if self.cascade is not None:
+                return self.verify_batch([(claimed_student_id, img_path)])[0]
             captured_embedding = self.generate_embedding(img_path)
-            
-            distance = self._calculate_distance(target_embedding, captured_embedding)
-            match = distance <= self.threshold
-            
-            # Confidence score calculation (inverse of distance roughly)
-            # A distance of 0 is 100% match. A distance of threshold is "just matched".
-            # We can normalize it: max(0, (threshold - distance) / threshold) ? 
-            # Or just return distance. Let's return a simple percentage-like score based on threshold.
-            
-            confidence = 0.0
-            if distance <= self.threshold:
-                 # Linear interpolation from threshold (0%) to 0 (100%)
-                 confidence = (1 - (distance / self.threshold)) * 100
-                 confidence = max(0, min(100, confidence)) # Clamp
-            
-            reason = "Face matched" if match else "Face mismatch - proxy attempt"
-            
-            return {
-                "status": "success",
-                "match": bool(match),
-                "confidence_score": round(confidence, 2),
-                "distance": float(distance),
-                "threshold": self.threshold,
-                "reason": reason,
-                "student_id": claimed_student_id
-            }
+            return self.verify_embedding(claimed_student_id, captured_embedding)
 
         except Exception as e:
-            return {
-                "status": "error",
-                "message": str(e),
-                "match": False
-            }
-            
-    def identify_student(self, img_path: str) -> Dict:
+            return self._error_result(e, match=False)
+
+    def verify_batch(self, pairs: List[Tuple[str, ImageInput]]) -> List[Dict]:
+        """
+        1:1 verification of many (claimed_student_id, image) pairs with one batched
+        embedding pass. Results are returned in input order.
+
+        With a cascade model, every face is first compared with the light model.
+        Only distances within cascade_margin of its threshold, and students without
+        a light embedding, go on to the main model (again in one batch). Results
+        then say which model decided them in "cascade_stage" ("fast" or "full").
+        """
+        self.refresh()
+        results: List[Optional[Dict]] = [None] * len(pairs)
+        pending = []
+        for i, (student_id, img) in enumerate(pairs):
+            if student_id not in self.gallery:
+                results[i] = {
+                    "status": "error",
+                    "message": "Student ID not found in database.",
+                    "match": False
+                }
+            else:
+                pending.append(i)
+
+        if self.cascade is None:
+            embeddings = self.generate_embeddings_batch([pairs[i][1] for i in pending])
+            for i, embedding in zip(pending, embeddings):
+                if isinstance(embedding, Exception):
+                    results[i] = self._error_result(embedding, match=False)
+                else:
+                    results[i] = self.verify_embedding(pairs[i][0], embedding)
+            return results
+
+        full = []
+        for i, light in zip(pending, self.embed_images_light([pairs[i][1] for i in pending])):
+            if isinstance(light, Exception):
+                results[i] = self._error_result(light, match=False)
+                continue
+            embedding, _, face = light
+            results[i] = self.verify_light(pairs[i][0], embedding)
+            if results[i] is None:
+                full.append((i, face))
+
+        for (i, _), embedding in zip(full, self.embed_faces([face for _, face in full])):
+            results[i] = dict(self.verify_embedding(pairs[i][0], embedding), cascade_stage="full")
+        return results
+
+    def embed_images_light(self, images: List[ImageInput]) -> List[Union[Tuple, Exception]]:
         """
-        Identifies a student from the image by comparing with all registered embeddings.
-        Returns the best match if it meets the threshold.
+        First cascade stage: finds the single face in each image (with this
+        module's preprocessing and quality gate) and embeds it with the light
+        model. Returns (light embedding, facial_area, face crop) per image, the
+        crop being what the main model embeds if verify_light escalates, or the
+        exception that rejected the image.
+        """
+        results: List[Union[Tuple, Exception]] = [None] * len(images)
+        positions, prepared, faces = self._detect_single_faces(images, results)
+
+        start = time.perf_counter()
+        embeddings = self.cascade.embed_faces([face["face"] for face in faces])
+        share = (time.perf_counter() - start) * 1000 / max(1, len(faces))
+        for i, image, face, embedding in zip(positions, prepared, faces, embeddings):
+            image.timings["embed_ms"] = share
+            results[i] = (embedding, face["facial_area"], face["face"])
+        return results
+
+    def verify_light(self, claimed_student_id: str, light_embedding) -> Optional[Dict]:
+        """
+        Decides a claim with the light model when it is sure: returns its result
+        with cascade_stage "fast", or None if the claim has to go on to the main
+        model (distance within cascade_margin of the light threshold, or no light
+        embedding for the student).
+        """
+        light = self.cascade
+        if claimed_student_id not in light.gallery:
+            return None
+        result = light.verify_embedding(claimed_student_id, light_embedding)
+        if result["status"] == "success" and abs(result["distance"] - light.threshold) > self.cascade_margin * light.threshold:
+            return dict(result, cascade_stage="fast")
+        return None
+
+    def identify_embedding(self, captured_embedding, top_k: int = 1, candidate_ids: Optional[Union[List[str], RosterSlice]] = None) -> Dict:
+        """
+        1:N search of an already computed embedding against the whole gallery, or
+        only against candidate_ids (e.g. the class roster, as a list or a
+        RosterSlice) when given.
+        """
+        self.refresh()
+        gallery = self.gallery
+        nearest = []
+        if candidate_ids is not None:
+            # Scoring only the expected students is faster and avoids false matches
+            # with look-alikes elsewhere in a large gallery
+            rows = candidate_ids.rows(gallery) if isinstance(candidate_ids, RosterSlice) else gallery.rows_for(candidate_ids)
+            nearest = gallery.search(captured_embedding, top_k=max(1, top_k), metric=self.distance_metric, rows=rows)
+        elif gallery.index is not None:
+            # Score only the rows in the clusters nearest to the query
+            rows = gallery.index_candidates(captured_embedding, self.ann_probe)
+            nearest = gallery.search(captured_embedding, top_k=max(1, top_k), metric=self.distance_metric, rows=rows)
+        if not nearest and candidate_ids is None:
+            # One matrix-vector product over the whole gallery
+            nearest = gallery.search(captured_embedding, top_k=max(1, top_k), metric=self.distance_metric)
+        
+        best_match_id, best_distance = nearest[0] if nearest else (None, float("inf"))
+        match = best_distance <= self.threshold
+        confidence = self._confidence(best_distance)
+        
+        reason = "Face matched" if match else "Face not recognized"
+        
+        return {
+            "status": "success",
+            "matched": bool(match),
+            "confidence": round(confidence, 2),
+            "distance": float(best_distance) if best_distance != float("inf") else 0.0,
+            "student_id": best_match_id if match else None,
+            "reason": reason,
+            "candidates": [
+                {
+                    "student_id": student_id,
+                    "distance": distance,
+                    "confidence": round(self._confidence(distance), 2)
+                }
+                for student_id, distance in nearest
+            ]
+        }
+
+    def identify_student(self, img_path: ImageInput, top_k: int = 1, candidate_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Identifies a student from the image by comparing with all registered embeddings
+        (or only candidate_ids). Returns the best match if it meets the threshold, plus
+        the top_k closest candidates.
         """
         try:
             captured_embedding = self.generate_embedding(img_path)
+            return self.identify_embedding(captured_embedding, top_k=top_k, candidate_ids=candidate_ids)
             
-            best_match_id = None
-            best_distance = float("inf")
-            
-            for student_id, data in self.embeddings.items():
-                stored_embedding = data["embedding"]
-                distance = self._calculate_distance(stored_embedding, captured_embedding)
-                
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match_id = student_id
-            
-            match = best_distance <= self.threshold
-            
-            confidence = 0.0
-            if match:
-                 confidence = (1 - (best_distance / self.threshold)) * 100
-                 confidence = max(0, min(100, confidence))
-            
-            reason = "Face matched" if match else "Face not recognized"
-            
-            return {
-                "status": "success",
-                "matched": bool(match),
-                "confidence": round(confidence, 2),
-                "distance": float(best_distance) if best_distance != float("inf") else 0.0,
-                "student_id": best_match_id if match else None,
-                "reason": reason
-            }
-            
+        except Exception as e:
+            return self._error_result(e, matched=False)
+
+    def identify_batch(self, images: List[ImageInput], top_k: int = 1, candidate_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        1:N identification of many images with one batched embedding pass.
+        """
+        results = []
+        for embedding in self.generate_embeddings_batch(images):
+            if isinstance(embedding, Exception):
+                results.append(self._error_result(embedding, matched=False))
+            else:
+                results.append(self.identify_embedding(embedding, top_k=top_k, candidate_ids=candidate_ids))
+        return results
+
+    def embed_group(self, images: List[ImageInput]) -> Tuple[List[Dict], List[list]]:
+        """
+        Detects every face in every image and embeds them in batched passes.
+        Returns (faces, embeddings) where faces carry "image_index" and "facial_area".
+        """
+        faces = []
+        crops = []
+        for image_index, img in enumerate(images):
+            # Undecodable photos fail the request; photos without faces do not
+            prepared = self.prepare(img)
+            try:
+                detected = self.find_faces(prepared)
+            except ValueError:
+                # No face in this photo; the others may still have some
+                detected = []
+            for face in detected:
+                faces.append({"image_index": image_index, "facial_area": face["facial_area"]})
+                crops.append(face["face"])
+        return faces, self.embed_faces(crops)
+
+    def match_group(self, faces: List[Dict], embeddings: List[list], candidate_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Matches faces from embed_group against the roster (candidate_ids, or the
+        whole gallery) with a minimum-distance one-to-one assignment, so no student
+        is matched to two faces. Faces whose assigned distance is above the
+        threshold are reported as unmatched.
+        """
+        self.refresh()
+        distances, roster = self.gallery.distance_matrix(embeddings, candidate_ids, metric=self.distance_metric)
+
+        matches = []
+        matched_faces = set()
+        if distances.size:
+            # Pairs above the threshold can never be a match; make them very expensive
+            # so the assignment maximizes accepted matches first
+            cost = np.where(distances <= self.threshold, distances, 1e6)
+            for face_idx, roster_idx in linear_assignment(cost):
+                distance = float(distances[face_idx, roster_idx])
+                if distance > self.threshold:
+                    continue
+                matched_faces.add(face_idx)
+                matches.append({
+                    "student_id": roster[roster_idx],
+                    "distance": distance,
+                    "confidence": round(self._confidence(distance), 2),
+                    "image_index": faces[face_idx]["image_index"],
+                    "facial_area": faces[face_idx]["facial_area"]
+                })
+
+        unmatched = [
+            {"image_index": face["image_index"], "facial_area": face["facial_area"]}
+            for face_idx, face in enumerate(faces) if face_idx not in matched_faces
+        ]
+
+        return {
+            "status": "success",
+            "faces_detected": len(faces),
+            "roster_size": len(roster),
+            "matched_count": len(matches),
+            "matches": sorted(matches, key=lambda match: match["distance"]),
+            "unmatched_faces": unmatched
+        }
+
+    def identify_group(self, images: List[ImageInput], candidate_ids: Optional[List[str]] = None) -> Dict:
+        """
+        Roll call from one or more classroom photos: embed_group followed by match_group.
+        """
+        try:
+            faces, embeddings = self.embed_group(images)
+            return self.match_group(faces, embeddings, candidate_ids)
+
         except Exception as e:
             return {
                 "status": "error",
-                "message": str(e),
-                "matched": False
+                "message": str(e)
             }
 
-    def _calculate_distance(self, embedding1, embedding2):
-        if self.distance_metric == 'cosine':
-            a = np.array(embedding1)
-            b = np.array(embedding2)
-            denom = (np.linalg.norm(a) * np.linalg.norm(b))
-            if denom == 0:
-                return 1.0 # Max distance
-            return 1 - (np.dot(a, b) / denom)
-        elif self.distance_metric == 'euclidean':
-            a = np.array(embedding1)
-            b = np.array(embedding2)
-            return np.linalg.norm(a - b)
-        else:
-             raise ValueError("Unsupported metric")
+    def _confidence(self, distance: float) -> float:
+        """
+        Linear interpolation from threshold (0%) to a distance of 0 (100%).
+        """
+        if distance > self.threshold:
+            return 0.0
+        confidence = (1 - (distance / self.threshold)) * 100
+        return max(0, min(100, confidence)) # Clamp
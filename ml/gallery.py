@@ -0,0 +1,498 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Storage types for gallery rows. float16 halves and int8 quarters the memory of
+# float32; compact rows carry a per-row scale.
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# Compact rows are converted to float32 about this many values at a time while
+# scoring, so a search never materializes a float32 copy of the whole gallery and
+# each converted block stays in cache
+_SCORE_BLOCK_VALUES = 1 << 20
+
+# float16 -> float32 for every bit pattern. numpy's own conversion takes a slow
+# path for zeros, which ReLU embeddings such as VGG-Face are full of; a table
+# lookup costs the same for every value.
+_FLOAT16_TABLE = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16).view(np.float16).astype(np.float32)
+
+
+def _decode(block: np.ndarray) -> np.ndarray:
+    if block.dtype == np.float16:
+        return _FLOAT16_TABLE[block.view(np.uint16)]
+    return block.astype(np.float32)
+
+
+class PCAProjection:
+    """
+    Projects embeddings onto the top principal directions of the registered set.
+    The projection is uncentered and re-normalized, so cosine similarities in the
+    reduced space approximate the original ones.
+    """
+
+    def __init__(self, components: np.ndarray):
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (output_dim, input_dim)
+
+    @property
+    def input_dim(self) -> int:
+        return self.components.shape[1]
+
+    @property
+    def output_dim(self) -> int:
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, unit_vectors: np.ndarray, n_components: int, max_samples: int = 10000, power_iters: int = 2, seed: int = 0) -> "PCAProjection":
+        rng = np.random.default_rng(seed)
+        sample = unit_vectors
+        if sample.shape[0] > max_samples:
+            sample = sample[np.sort(rng.choice(sample.shape[0], max_samples, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+        n_components = min(n_components, sample.shape[0], sample.shape[1])
+
+        # Randomized SVD (Halko et al.): find the range of the top directions first so
+        # only a (k, dim) matrix is decomposed instead of the whole sample
+        k = min(n_components + 16, *sample.shape)
+        basis, _ = np.linalg.qr(sample @ rng.standard_normal((sample.shape[1], k)).astype(np.float32))
+        for _ in range(power_iters):
+            basis, _ = np.linalg.qr(sample @ (sample.T @ basis))
+        # Rows of vt are the top eigenvectors of the sample's second-moment matrix
+        _, _, vt = np.linalg.svd(basis.T @ sample, full_matrices=False)
+        return cls(vt[:n_components])
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Unit vectors in the reduced space.
+        """
+        projected = np.atleast_2d(np.asarray(vectors, dtype=np.float32)) @ self.components.T
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return np.divide(projected, norms, out=np.zeros_like(projected), where=norms > 0)
+
+    def reconstruct(self, projected: np.ndarray) -> np.ndarray:
+        return np.atleast_2d(projected) @ self.components
+
+
+class EmbeddingGallery:
+    """
+    Registered embeddings kept as one contiguous matrix of L2-normalized rows
+    with a parallel list of student IDs. A 1:N search is a single
+    matrix-vector product instead of a Python loop over every student.
+
+    Rows are stored at the gallery's precision (float32, or float16/int8 with a
+    per-row scale), optionally after a PCA projection to fewer dimensions.
+    Distances are computed from the compact rows directly; queries are projected
+    the same way.
+
+    Rows are append-only: re-registering a student appends a new row and removal
+    only clears the row's alive flag. copy() therefore shares the matrix with the
+    original, and mutating the newest copy never changes a row an older copy can
+    see, which lets readers keep searching a published gallery while a writer
+    prepares the next one. Dead rows are dropped when the gallery is compacted
+    into a new store snapshot.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024, precision: str = "float32", projection: Optional[PCAProjection] = None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision {precision!r}, expected one of {', '.join(PRECISIONS)}.")
+        self.precision = precision
+        self.projection = projection
+        self.dim = projection.output_dim if projection is not None else dim  # stored row width
+        self._initial_capacity = max(1, initial_capacity)
+        self._vectors = None  # (capacity, dim) unit rows
+        self._norms = None  # (capacity,) original L2 norms, needed for euclidean
+        self._scales = None  # (capacity,) float16/int8 only: row = stored * scale
+        self._alive = None  # (capacity,) False for replaced/removed rows
+        self._ids: List[str] = []  # row -> id, shared between copies and only appended to
+        self._rows: Dict[str, int] = {}  # id -> live row
+        self._count = 0  # rows used by this copy
+        # Optional ANN index (see ann_index.IVFIndex) over this gallery's rows, shared by copies
+        self.index = None
+
+    @classmethod
+    def from_embeddings(cls, embeddings: Dict) -> "EmbeddingGallery":
+        """
+        Builds a gallery from the {student_id: {"embedding": [...]}} layout of students.json.
+        """
+        gallery = cls(initial_capacity=max(1024, len(embeddings)))
+        for student_id, data in embeddings.items():
+            gallery.add(student_id, data["embedding"])
+        return gallery
+
+    @classmethod
+    def from_arrays(cls, ids: List[str], vectors: np.ndarray, norms: np.ndarray, scales: Optional[np.ndarray] = None, projection: Optional[PCAProjection] = None) -> "EmbeddingGallery":
+        """
+        Wraps stored arrays (e.g. memory-mapped from an EmbeddingStore) without
+        copying. The precision follows the vectors' dtype. Rows beyond len(ids) are
+        spare capacity.
+        """
+        precision = np.dtype(vectors.dtype).name
+        gallery = cls(dim=vectors.shape[1], precision=precision, projection=projection)
+        gallery._vectors = vectors
+        gallery._norms = norms
+        gallery._scales = scales
+        gallery._alive = np.zeros(vectors.shape[0], dtype=bool)
+        gallery._alive[:len(ids)] = True
+        gallery._ids = list(ids)
+        gallery._rows = {student_id: row for row, student_id in enumerate(gallery._ids)}
+        gallery._count = len(gallery._ids)
+        return gallery
+
+    def copy(self) -> "EmbeddingGallery":
+        """
+        Returns a gallery sharing this one's matrix. Only the newest copy may be
+        mutated; this one stays valid for readers.
+        """
+        gallery = EmbeddingGallery(dim=self.dim, initial_capacity=self._initial_capacity, precision=self.precision, projection=self.projection)
+        gallery._vectors = self._vectors
+        gallery._norms = self._norms
+        gallery._scales = self._scales
+        gallery._alive = None if self._alive is None else self._alive.copy()
+        gallery._ids = self._ids
+        gallery._rows = dict(self._rows)
+        gallery._count = self._count
+        gallery.index = self.index
+        return gallery
+
+    def converted(self, precision: str, components: Optional[int] = None) -> "EmbeddingGallery":
+        """
+        Returns a compacted copy of the live rows stored at another precision and/or
+        projected to `components` PCA dimensions (None = no projection). A new
+        projection is fitted on the registered set. Converting an already compact
+        gallery starts from its approximate rows, so it cannot restore precision.
+        """
+        live = self._live_rows()
+        current = self.projection.output_dim if self.projection is not None else None
+        if components == current:
+            projection = self.projection
+            source = self.unit_rows  # already in the target space
+        else:
+            # Fit on an even sample of rows rather than decoding the whole gallery at once
+            sample = live[np.linspace(0, live.size - 1, min(live.size, 10000)).astype(np.int64)] if live.size else live
+            projection = PCAProjection.fit(self._input_rows(sample), components) if components else None
+            source = self._input_rows if projection is None else (lambda rows: projection.project(self._input_rows(rows)))
+
+        gallery = EmbeddingGallery(
+            dim=self.input_dim, initial_capacity=max(self._initial_capacity, live.size),
+            precision=precision, projection=projection
+        )
+        if live.size:
+            gallery._ensure_capacity(live.size)
+            block = max(1, _SCORE_BLOCK_VALUES // self.input_dim)
+            for start in range(0, live.size, block):
+                rows = live[start:start + block]
+                stored, scales = gallery._encode(source(rows))
+                gallery._vectors[start:start + rows.size] = stored
+                if scales is not None:
+                    gallery._scales[start:start + rows.size] = scales
+                gallery._norms[start:start + rows.size] = self._norms[rows]
+            gallery._alive[:live.size] = True
+            gallery._ids = [self._ids[row] for row in live]
+            gallery._rows = {student_id: row for row, student_id in enumerate(gallery._ids)}
+            gallery._count = live.size
+        return gallery
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, student_id) -> bool:
+        return student_id in self._rows
+
+    @property
+    def ids(self) -> List[str]:
+        """
+        Live student IDs in row order.
+        """
+        return [self._ids[row] for row in self._live_rows()]
+
+    @property
+    def input_dim(self) -> Optional[int]:
+        """
+        Dimension of the embeddings accepted by add() and search().
+        """
+        return self.projection.input_dim if self.projection is not None else self.dim
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._vectors is None else self._vectors.shape[0]
+
+    @property
+    def dead_rows(self) -> int:
+        return self._count - len(self._rows)
+
+    @property
+    def row_count(self) -> int:
+        """
+        Rows used by this copy, dead ones included.
+        """
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the rows of this copy (vectors, norms and scales).
+        """
+        if self._vectors is None:
+            return 0
+        per_row = self._vectors.itemsize * self.dim + self._norms.itemsize
+        if self._scales is not None:
+            per_row += self._scales.itemsize
+        return per_row * self._count
+
+    def shares_rows(self, other: "EmbeddingGallery") -> bool:
+        """
+        True if both galleries are copies of one another, i.e. row numbers agree.
+        """
+        return self._ids is other._ids
+
+    def build_index(self, index) -> int:
+        """
+        Trains an ANN index on this copy's live rows without attaching it, so it can
+        run in the background. Returns the row count the index covers.
+        """
+        index.train(self._live_rows(), self.unit_rows)
+        return self._count
+
+    def attach_index(self, index, built_rows: int):
+        """
+        Files the rows appended since the index was built and attaches it. Must be
+        called on a copy of the gallery the index was built from.
+        """
+        for row in range(built_rows, self._count):
+            if self._alive[row]:
+                index.add(row, self.unit_rows(np.array([row]))[0])
+        self.index = index
+
+    def index_candidates(self, query, n_probe: Optional[int] = None) -> np.ndarray:
+        """
+        Rows the attached ANN index proposes for a query embedding.
+        """
+        return self.index.candidates(self._unit_queries(query)[0], n_probe)
+
+    def _live_rows(self) -> np.ndarray:
+        if self._count == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(self._alive[:self._count])
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        Returns the live stored (vectors, norms, scales) rows in the same order as
+        ids; scales is None for float32. These are views when no
+        rows are dead, copies otherwise.
+        """
+        if self._vectors is None:
+            dtype = PRECISIONS[self.precision]
+            scales = None if self.precision == "float32" else np.zeros(0, dtype=np.float32)
+            return np.zeros((0, self.dim or 0), dtype=dtype), np.zeros(0, dtype=np.float32), scales
+        selector = slice(0, self._count) if self.dead_rows == 0 else self._live_rows()
+        scales = None if self._scales is None else self._scales[selector]
+        return self._vectors[selector], self._norms[selector], scales
+
+    def unit_rows(self, rows) -> np.ndarray:
+        """
+        Stored rows decoded to float32 (in the projected space, if any).
+        """
+        vectors = _decode(self._vectors[rows])
+        if self._scales is not None:
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def _input_rows(self, rows) -> np.ndarray:
+        # Unit rows mapped back to the embedding space (approximate when projected)
+        units = self.unit_rows(rows)
+        return units if self.projection is None else self.projection.reconstruct(units)
+
+    def _encode(self, units: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Converts float32 unit rows to the storage type. Returns (rows, scales).
+        """
+        if self.precision == "float32":
+            return units.astype(np.float32), None
+        # Scale every row to a peak of 127 (int8) or 1 (float16). For float16 this keeps
+        # the small components of high-dimensional unit vectors out of the subnormal
+        # range, which is both imprecise and slow to convert.
+        peaks = np.abs(units).max(axis=1)
+        top = 127.0 if self.precision == "int8" else 1.0
+        scales = np.where(peaks > 0, peaks / top, 1.0).astype(np.float32)
+        scaled = units / scales[:, None]
+        if self.precision == "int8":
+            scaled = np.round(scaled)
+        return scaled.astype(PRECISIONS[self.precision]), scales
+
+    def _ensure_capacity(self, needed: int):
+        capacity = self.capacity
+        if needed <= capacity:
+            return
+        new_capacity = max(self._initial_capacity, capacity * 2, needed)
+        vectors = np.zeros((new_capacity, self.dim), dtype=PRECISIONS[self.precision])
+        norms = np.zeros(new_capacity, dtype=np.float32)
+        alive = np.zeros(new_capacity, dtype=bool)
+        scales = None if self.precision == "float32" else np.zeros(new_capacity, dtype=np.float32)
+        if capacity:
+            vectors[:self._count] = self._vectors[:self._count]
+            norms[:self._count] = self._norms[:self._count]
+            alive[:self._count] = self._alive[:self._count]
+            if scales is not None:
+                scales[:self._count] = self._scales[:self._count]
+        self._vectors = vectors
+        self._norms = norms
+        self._alive = alive
+        self._scales = scales
+
+    def add(self, student_id: str, embedding: Iterable[float]) -> int:
+        """
+        Inserts or replaces the embedding for a student by appending a row.
+        Returns the new row.
+        """
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        if self.dim is None:
+            self.dim = vector.shape[0]
+        elif vector.shape[0] != self.input_dim:
+            raise ValueError(f"Embedding has {vector.shape[0]} dimensions, gallery expects {self.input_dim}.")
+
+        row = self._count
+        self._ensure_capacity(row + 1)
+        norm = float(np.linalg.norm(vector))
+        unit = vector / norm if norm > 0 else np.zeros_like(vector)
+        if self.projection is not None:
+            unit = self.projection.project(unit)[0]
+        stored, scales = self._encode(unit[None, :])
+        self._norms[row] = norm
+        self._vectors[row] = stored[0]
+        if scales is not None:
+            self._scales[row] = scales[0]
+
+        # Older copies only read ids below their own row count, so appending is safe
+        del self._ids[row:]
+        self._ids.append(student_id)
+
+        previous = self._rows.get(student_id)
+        if previous is not None:
+            self._alive[previous] = False
+        self._alive[row] = True
+        self._rows[student_id] = row
+        self._count = row + 1
+        if self.index is not None:
+            self.index.add(row, unit)
+        return row
+
+    def remove(self, student_id: str) -> bool:
+        """
+        Removes a student by marking its row dead.
+        """
+        row = self._rows.pop(student_id, None)
+        if row is None:
+            return False
+        self._alive[row] = False
+        return True
+
+    def get(self, student_id: str) -> Optional[np.ndarray]:
+        """
+        Returns the original (un-normalized) embedding for a student, or None.
+        Compact galleries return an approximation.
+        """
+        row = self._rows.get(student_id)
+        if row is None:
+            return None
+        return self._input_rows(np.array([row]))[0] * self._norms[row]
+
+    def _unit_queries(self, queries) -> np.ndarray:
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q_norms = np.linalg.norm(q, axis=1)
+        unit = np.divide(q, q_norms[:, None], out=np.zeros_like(q), where=q_norms[:, None] > 0)
+        if self.projection is not None:
+            unit = self.projection.project(unit)
+        return unit
+
+    def _similarities(self, unit: np.ndarray, rows) -> np.ndarray:
+        vectors = self._vectors[rows]
+        if vectors.dtype == np.float32:
+            return unit @ vectors.T
+        similarities = np.empty((unit.shape[0], vectors.shape[0]), dtype=np.float32)
+        rows_per_block = max(1, _SCORE_BLOCK_VALUES // self.dim)
+        for start in range(0, vectors.shape[0], rows_per_block):
+            block = _decode(vectors[start:start + rows_per_block])
+            similarities[:, start:start + block.shape[0]] = unit @ block.T
+        if self._scales is not None:
+            similarities *= self._scales[rows][None, :]
+        return similarities
+
+    def _distances(self, rows, queries, metric: str) -> np.ndarray:
+        """
+        (queries, rows) distance matrix between query embeddings and the given rows
+        (a slice or an array of row numbers).
+        """
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        q_norms = np.linalg.norm(q, axis=1)
+        similarities = self._similarities(self._unit_queries(q), rows)
+
+        if metric == "cosine":
+            # Zero-norm rows have a similarity of 0, i.e. the maximum distance of 1.0
+            return np.clip(1.0 - similarities, 0.0, 2.0)
+        elif metric == "euclidean":
+            norms = self._norms[rows]
+            squared = norms[None, :] ** 2 + q_norms[:, None] ** 2 - 2.0 * norms[None, :] * q_norms[:, None] * similarities
+            return np.sqrt(np.maximum(squared, 0.0))
+        else:
+            raise ValueError("Unsupported metric")
+
+    def distance(self, student_id: str, query, metric: str = "cosine") -> float:
+        row = self._rows[student_id]
+        return float(self._distances(slice(row, row + 1), query, metric)[0, 0])
+
+    def rows_for(self, student_ids: Iterable[str]) -> np.ndarray:
+        """
+        Live rows of the listed students; unknown IDs are skipped.
+        """
+        return np.array([self._rows[s] for s in student_ids if s in self._rows], dtype=np.int64)
+
+    def distance_matrix(self, queries, student_ids: Optional[List[str]] = None, metric: str = "cosine") -> Tuple[np.ndarray, List[str]]:
+        """
+        Distances from every query embedding (rows) to every listed student, or to
+        the whole gallery (columns), in one matrix product. Unknown IDs are skipped.
+        Returns (distances, column_ids).
+        """
+        if student_ids is None:
+            rows = self._live_rows()
+        else:
+            rows = self.rows_for(student_ids)
+        column_ids = [self._ids[row] for row in rows]
+
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if q.shape[0] == 0 or q.shape[1] == 0 or rows.size == 0:
+            return np.zeros((q.shape[0], rows.size), dtype=np.float32), column_ids
+
+        if student_ids is None and self.dead_rows == 0:
+            return self._distances(slice(0, self._count), q, metric), column_ids
+        return self._distances(rows, q, metric), column_ids
+
+    def search(self, query, top_k: int = 1, metric: str = "cosine", rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        Returns up to top_k (student_id, distance) pairs, closest first. When rows is
+        given (e.g. ANN index candidates), only those rows are scored.
+        """
+        count = self._count
+        live = len(self._rows)
+        if live == 0 or top_k <= 0:
+            return []
+
+        if rows is None:
+            distances = self._distances(slice(0, count), query, metric)[0]
+            if live < count:
+                distances[~self._alive[:count]] = np.inf
+            k = min(top_k, live)
+        else:
+            # Candidates may include rows that are dead or newer than this copy
+            rows = rows[rows < count]
+            rows = rows[self._alive[rows]]
+            if rows.size == 0:
+                return []
+            distances = self._distances(rows, query, metric)[0]
+            k = min(top_k, rows.size)
+
+        if k == 1:
+            best = [int(np.argmin(distances))]
+        else:
+            best = np.argpartition(distances, k - 1)[:k]
+            best = best[np.argsort(distances[best])]
+        if rows is None:
+            return [(self._ids[i], float(distances[i])) for i in best]
+        return [(self._ids[rows[i]], float(distances[i])) for i in best]
@@ -4,6 +4,8 @@ import time
 import os
 import json
 import sys
+import threading
+from typing import Dict, List, Optional, Tuple
 
 # Ensure we can import the module
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -18,30 +20,222 @@ RESET = "\033[0m"
 def draw_text(img, text, position, color=(0, 255, 0)):
     cv2.putText(img, text, position, cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
 
-def main():
-    parser = argparse.ArgumentParser(description="Live Face Verification Testing Tool")
-    parser.add_argument("--id", required=True, help="Student ID to verify against")
-    args = parser.parse_args()
-    
-    student_id = args.id
-    
-    # Initialize ML Module
-    print(f"{YELLOW}Initializing Face Recognition Module...{RESET}")
-    ml_module = FaceRecognitionModule()
-    
-    # Verify the student exists in DB
-    if student_id not in ml_module.embeddings:
-        print(f"{RED}Error: Student ID '{student_id}' not found in database!{RESET}")
-        print("Please register the student first using register_student.py")
-        return
+class FrameGrabber(threading.Thread):
+    """
+    Reads the camera continuously and keeps only the newest frame, so neither the
+    preview nor inference ever works through a backlog of stale frames.
+    """
 
-    # Open Webcam
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print(f"{RED}Error: Could not open webcam.{RESET}")
-        return
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.lock = threading.Lock()
+        self.frame = None
+        self.frame_time = 0.0
+        self.frame_index = 0
+        self.running = True
 
-    print(f"{GREEN}Webcam started.{RESET}")
+    def run(self):
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                self.running = False
+                break
+            with self.lock:
+                self.frame = frame
+                self.frame_time = time.perf_counter()
+                self.frame_index += 1
+
+    def latest(self) -> Tuple[Optional[object], float, int]:
+        with self.lock:
+            return self.frame, self.frame_time, self.frame_index
+
+    def stop(self):
+        self.running = False
+
+def iou(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+class Track:
+    def __init__(self, track_id: int, box: Tuple[int, int, int, int], now: float):
+        self.track_id = track_id
+        self.box = box
+        self.last_seen = now
+        self.student_id: Optional[str] = None
+        self.confidence = 0.0
+        # When identification was last attempted; unknown faces are retried
+        self.attempted_at: Optional[float] = None
+
+class KioskWorker(threading.Thread):
+    """
+    Runs detection and 1:N identification off the display thread.
+
+    Frames are offered with submit(); one that arrives while the previous frame is
+    still being processed is dropped. Faces are followed across frames by box
+    overlap, and only new tracks (or unknown ones, every retry_after seconds) are
+    embedded and searched, so each person is identified once per visit.
+    """
+
+    def __init__(self, ml_module: FaceRecognitionModule, iou_threshold: float = 0.3, max_age: float = 1.0, retry_after: float = 1.0):
+        super().__init__(daemon=True)
+        self.ml_module = ml_module
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.tracks: List[Track] = []
+        self._next_track = 1
+        self._pending = None
+        self._wake = threading.Event()
+        self.lock = threading.Lock()
+        self.running = True
+        self.busy = False
+        # Capture-to-result latency of the last processed frame and processing rate
+        self.latency_ms = 0.0
+        self.processed_fps = 0.0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+
+    def submit(self, frame, frame_time: float) -> bool:
+        if self.busy:
+            self.frames_skipped += 1
+            return False
+        self.busy = True
+        self._pending = (frame, frame_time)
+        self._wake.set()
+        return True
+
+    def snapshot(self) -> List[Dict]:
+        with self.lock:
+            return [
+                {"box": track.box, "student_id": track.student_id, "confidence": track.confidence, "identifying": track.attempted_at is None}
+                for track in self.tracks
+            ]
+
+    def run(self):
+        while self.running:
+            if not self._wake.wait(0.1):
+                continue
+            self._wake.clear()
+            frame, frame_time = self._pending
+            started = time.perf_counter()
+            try:
+                self._process(frame)
+            except Exception as e:
+                print(f"{RED}Exception: {e}{RESET}")
+            finished = time.perf_counter()
+            self.latency_ms = (finished - frame_time) * 1000
+            self.processed_fps = 0.9 * self.processed_fps + 0.1 * (1.0 / max(finished - started, 1e-6))
+            self.frames_processed += 1
+            self.busy = False
+
+    def _process(self, frame):
+        now = time.perf_counter()
+        try:
+            # Frames stay in memory; the module downscales them for detection
+            faces = self.ml_module.find_faces(self.ml_module.prepare(frame))
+        except ValueError:
+            # No face in view
+            faces = []
+
+        with self.lock:
+            tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+        to_identify = []
+        used = set()
+        for face in faces:
+            area = face["facial_area"]
+            box = (area["x"], area["y"], area["w"], area["h"])
+            best, best_iou = None, self.iou_threshold
+            for track in tracks:
+                overlap = iou(track.box, box)
+                if track.track_id not in used and overlap >= best_iou:
+                    best, best_iou = track, overlap
+            if best is None:
+                best = Track(self._next_track, box, now)
+                self._next_track += 1
+                tracks.append(best)
+            used.add(best.track_id)
+            best.box = box
+            best.last_seen = now
+            if best.student_id is None and (best.attempted_at is None or now - best.attempted_at >= self.retry_after):
+                to_identify.append((best, face["face"]))
+
+        if to_identify:
+            # New faces in the same frame share one forward pass
+            embeddings = self.ml_module.embed_faces([crop for _, crop in to_identify])
+            for (track, _), embedding in zip(to_identify, embeddings):
+                result = self.ml_module.identify_embedding(embedding)
+                track.attempted_at = now
+                if result.get("matched"):
+                    track.student_id = result["student_id"]
+                    track.confidence = result.get("confidence", 0.0)
+                    print(f"{GREEN}[IDENTIFIED] {track.student_id} ({track.confidence}%) | Dist: {result.get('distance', 0.0):.4f}{RESET}")
+
+        with self.lock:
+            self.tracks = tracks
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+def run_kiosk(ml_module: FaceRecognitionModule, cap, args):
+    """
+    Continuous 1:N identification of everyone in front of the camera.
+    """
+    grabber = FrameGrabber(cap)
+    worker = KioskWorker(ml_module, iou_threshold=args.iou, max_age=args.max_age, retry_after=args.retry_after)
+    grabber.start()
+    worker.start()
+
+    print(f"{GREEN}Kiosk mode started.{RESET} Press {YELLOW}'q'{RESET} to Quit")
+    last_index = 0
+    display_fps = 0.0
+    last_shown = time.perf_counter()
+    while grabber.running:
+        frame, frame_time, frame_index = grabber.latest()
+        if frame is None or frame_index == last_index:
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            continue
+        last_index = frame_index
+        # The worker gets its own copy; the preview draws on this one
+        worker.submit(frame.copy(), frame_time)
+
+        for track in worker.snapshot():
+            x, y, w, h = track["box"]
+            if track["student_id"]:
+                color, label = (0, 255, 0), f"{track['student_id']} ({track['confidence']}%)"
+            elif track["identifying"]:
+                color, label = (0, 255, 255), "Identifying..."
+            else:
+                color, label = (0, 0, 255), "Unknown"
+            cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+            draw_text(frame, label, (x, max(20, y - 10)), color)
+
+        now = time.perf_counter()
+        display_fps = 0.9 * display_fps + 0.1 * (1.0 / max(now - last_shown, 1e-6))
+        last_shown = now
+        draw_text(frame, f"FPS: {display_fps:.1f} | Inference: {worker.processed_fps:.1f}/s", (30, 30), (255, 255, 255))
+        draw_text(frame, f"Latency: {worker.latency_ms:.0f} ms | Skipped: {worker.frames_skipped}", (30, 60), (200, 200, 200))
+
+        cv2.imshow('Kiosk Face Identification', frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+
+    worker.stop()
+    grabber.stop()
+    grabber.join(timeout=1.0)
+
+def run_manual(ml_module: FaceRecognitionModule, cap, student_id: str):
+    """
+    1:1 verification of one student, one capture per 's' key press.
+    """
     print("Instructions:")
     print(f" - Press {YELLOW}'s'{RESET} to Capture and Verify")
     print(f" - Press {YELLOW}'q'{RESET} to Quit")
@@ -50,12 +244,6 @@ def main():
     last_result_time = 0
     display_duration = 3 # Seconds to show result on screen
 
-    # Create temp dir if not exists
-    if not os.path.exists("data/temp"):
-        os.makedirs("data/temp")
-        
-    temp_path = "data/temp/live_capture.jpg"
-
     while True:
         ret, frame = cap.read()
         if not ret:
@@ -73,23 +261,21 @@ def main():
             break
         elif key == ord('s'):
             print(f"\n{YELLOW}Capturing frame...{RESET}")
-            # Save frame
-            cv2.imwrite(temp_path, frame)
-            
-            # Verify
+
+            # Verify the frame in memory
             try:
                 start_time = time.time()
-                result = ml_module.verify_student(student_id, temp_path)
+                result = ml_module.verify_student(student_id, frame.copy())
                 end_time = time.time()
-                
+
                 # Check result
                 is_match = result.get("match", False)
                 confidence = result.get("confidence_score", 0)
                 distance = result.get("distance", 0.0)
                 reason = result.get("reason", "Unknown")
-                
+
                 print(f"Time taken: {end_time - start_time:.2f}s")
-                
+
                 if result.get("status") == "error":
                      print(f"{RED}[ERROR] {result.get('message')}{RESET}")
                      last_result = f"ERROR: {result.get('message')}"
@@ -102,9 +288,9 @@ def main():
                      print(f"{RED}[NO MATCH] Confidence: {confidence}% | Dist: {distance:.4f} | {reason}{RESET}")
                      last_result = f"NO MATCH ({reason})"
                      last_result_color = (0, 0, 255) # Red
-                
+
                 last_result_time = time.time()
-                
+
             except Exception as e:
                 print(f"{RED}Exception: {e}{RESET}")
 
@@ -114,12 +300,51 @@ def main():
 
         cv2.imshow('Live Face Verification', frame)
 
-    cap.release()
-    cv2.destroyAllWindows()
-    
-    # Cleanup
-    if os.path.exists(temp_path):
-        os.remove(temp_path)
+def main():
+    parser = argparse.ArgumentParser(description="Live Face Verification Testing Tool")
+    parser.add_argument("--id", help="Student ID to verify against (manual 1:1 mode)")
+    parser.add_argument("--kiosk", action="store_true", help="Identify everyone in view continuously (1:N) instead")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index")
+    parser.add_argument("--max-edge", type=int, default=640, help="Kiosk: detect faces on frames downscaled to this size (0 = full size)")
+    parser.add_argument("--iou", type=float, default=0.3, help="Kiosk: box overlap needed to follow a face to the next frame")
+    parser.add_argument("--max-age", type=float, default=1.0, help="Kiosk: seconds a face may be out of view before it counts as a new person")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Kiosk: seconds between identification attempts for an unknown face")
+    args = parser.parse_args()
+
+    if not args.kiosk and not args.id:
+        parser.error("--id is required unless --kiosk is given")
+
+    student_id = args.id
+
+    # Initialize ML Module
+    print(f"{YELLOW}Initializing Face Recognition Module...{RESET}")
+    ml_module = FaceRecognitionModule(max_image_edge=(args.max_edge or None) if args.kiosk else None)
+
+    # Verify the student exists in DB
+    if not args.kiosk and student_id not in ml_module.embeddings:
+        print(f"{RED}Error: Student ID '{student_id}' not found in database!{RESET}")
+        print("Please register the student first using register_student.py")
+        return
+
+    if args.kiosk:
+        # Load the model before the camera opens so the first faces are not delayed
+        print(f"Model warm-up: {json.dumps(ml_module.warm_up())}")
+
+    # Open Webcam
+    cap = cv2.VideoCapture(args.camera)
+    if not cap.isOpened():
+        print(f"{RED}Error: Could not open webcam.{RESET}")
+        return
+
+    print(f"{GREEN}Webcam started.{RESET}")
+    try:
+        if args.kiosk:
+            run_kiosk(ml_module, cap, args)
+        else:
+            run_manual(ml_module, cap, student_id)
+    finally:
+        cap.release()
+        cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
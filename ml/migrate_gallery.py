@@ -0,0 +1,284 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ensure we can import the module if running from ml/ or elsewhere
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from embedding_store import EmbeddingStore, FaceCropStore
+from face_recognition_module import FaceRecognitionModule, deepface_version
+from preprocessing import decode_face_crop
+
+# Rounds of catching up with registrations made while the migration runs
+MAX_PASSES = 3
+
+# The module used inside each worker process, loaded once by _init_worker
+_worker_module: Optional[FaceRecognitionModule] = None
+
+
+def _init_worker(module_kwargs: Dict, scratch_dir: str):
+    global _worker_module
+    # Workers only embed; they get an empty scratch gallery of their own
+    _worker_module = FaceRecognitionModule(
+        gallery_dir=tempfile.mkdtemp(dir=scratch_dir), legacy_embeddings_file=None,
+        ann_min_size=None, **module_kwargs
+    )
+    _worker_module.warm_up()
+
+
+def _reembed_chunk(chunk: List[Tuple[str, Optional[str], Optional[str]]]) -> List[Tuple[str, Optional[list], Optional[bytes], Optional[str]]]:
+    """
+    Re-embeds (student_id, face crop path, registered image path) entries and
+    returns (student_id, embedding, new face crop, error) per student. Stored
+    crops are embedded directly, without detection; students without one fall
+    back to detecting the face in their registered photo, which also yields the
+    crop to store.
+    """
+    results = {}
+    crops, crop_ids = [], []
+    photos, photo_ids = [], []
+    for student_id, face_crop, registered_image in chunk:
+        try:
+            with open(face_crop, 'rb') as f:
+                crops.append(decode_face_crop(f.read()))
+            crop_ids.append(student_id)
+            continue
+        except (TypeError, OSError, ValueError):
+            pass
+        if registered_image and os.path.isfile(registered_image):
+            photos.append(registered_image)
+            photo_ids.append(student_id)
+        else:
+            results[student_id] = (student_id, None, None, "No face crop or registered photo to re-embed from.")
+
+    for student_id, embedding in zip(crop_ids, _worker_module.embed_faces(crops)):
+        results[student_id] = (student_id, embedding, None, None)
+    for student_id, result in zip(photo_ids, _worker_module.embed_images(photos, crops=True)):
+        if isinstance(result, Exception):
+            results[student_id] = (student_id, None, None, str(result))
+        else:
+            results[student_id] = (student_id, result[0], result[2], None)
+    return [results[student_id] for student_id, _, _ in chunk]
+
+
+def _chunks(entries: list, size: int) -> Iterator[list]:
+    for start in range(0, len(entries), size):
+        yield entries[start:start + size]
+
+
+def fingerprint(gallery, student_id: str) -> int:
+    """
+    Identifies the live registration a shadow row was made from, so a student
+    re-registered during the migration is picked up again.
+    """
+    return zlib.crc32(np.asarray(gallery.get(student_id), dtype=np.float32).tobytes())
+
+
+def migrate(gallery_dir: str, shadow_dir: str, face_crop_dir: str, module_kwargs: Dict,
+            workers: int, chunk_size: int, commit_every: int,
+            publish: bool = False, allow_missing: bool = False) -> Tuple[EmbeddingStore, Dict[str, str], bool]:
+    """
+    Re-embeds every student of the live gallery into the shadow store with the
+    target model. The shadow store is its own checkpoint: students it already
+    holds for their current registration are skipped, so an interrupted run
+    resumes where it stopped. With publish=True the shadow gallery then replaces
+    the live one (see switch()), unless students failed and allow_missing is not
+    set. Returns (shadow store, {student_id: error}, whether it was switched).
+    """
+    model = module_kwargs["model_name"]
+    # Shared, like the ML API's store, so the switch can lock out its writers
+    live = EmbeddingStore(gallery_dir, shared=True)
+    shadow = EmbeddingStore(shadow_dir)
+    shadow_gallery, shadow_meta = shadow.load()
+    other = {meta.get("model") for meta in shadow_meta.values()} - {model}
+    if other:
+        raise ValueError(f"Shadow gallery {shadow_dir} holds {', '.join(sorted(map(str, other)))} embeddings; remove it or pick another --shadow.")
+
+    face_crops = FaceCropStore(face_crop_dir)
+    version = deepface_version()
+    failures: Dict[str, Tuple[int, str]] = {}
+
+    def catch_up(pool) -> bool:
+        """
+        One pass over the live gallery: drops students removed from it and
+        re-embeds those registered or re-registered since the shadow row was made.
+        Returns whether anything had to be re-embedded.
+        """
+        with live.lock():
+            gallery, metadata = live.load(writable=False)
+        removed = [student_id for student_id in shadow_gallery.ids if student_id not in gallery]
+        for student_id in removed:
+            shadow.append_unregister(student_id)
+            shadow_gallery.remove(student_id)
+            shadow_meta.pop(student_id, None)
+        for student_id in [student_id for student_id in failures if student_id not in gallery]:
+            failures.pop(student_id)
+
+        todo = []
+        sources = {}
+        for student_id in gallery.ids:
+            source = fingerprint(gallery, student_id)
+            if shadow_meta.get(student_id, {}).get("source_crc") == source or failures.get(student_id, (None,))[0] == source:
+                continue
+            meta = metadata.get(student_id, {})
+            todo.append((student_id, meta.get("face_crop"), meta.get("registered_image")))
+            sources[student_id] = source
+        if not todo:
+            return False
+
+        pending = []
+
+        def commit():
+            records = []
+            for student_id, embedding, new_crop in pending:
+                meta = dict(metadata.get(student_id, {}), model=model, model_version=version, source_crc=sources[student_id])
+                if new_crop is not None:
+                    meta["face_crop"] = face_crops.write(student_id, new_crop)
+                records.append((student_id, embedding, meta))
+            shadow.append_registers(records)
+            for student_id, embedding, meta in records:
+                shadow_gallery.add(student_id, embedding)
+                shadow_meta[student_id] = meta
+                failures.pop(student_id, None)
+            pending.clear()
+
+        started = time.perf_counter()
+        processed = 0
+        for chunk_results in pool.imap_unordered(_reembed_chunk, _chunks(todo, chunk_size)):
+            for student_id, embedding, new_crop, error in chunk_results:
+                if error is None:
+                    pending.append((student_id, embedding, new_crop))
+                else:
+                    failures[student_id] = (sources[student_id], error)
+            if len(pending) >= commit_every:
+                commit()
+            processed += len(chunk_results)
+            rate = processed / max(time.perf_counter() - started, 1e-9)
+            print(f"{processed}/{len(todo)} students ({rate:.1f}/s)", file=sys.stderr)
+        if pending:
+            commit()
+        return True
+
+    switched = False
+    scratch_dir = tempfile.mkdtemp(prefix="migrate_gallery-")
+    context = multiprocessing.get_context("spawn")
+    try:
+        with context.Pool(workers, initializer=_init_worker, initargs=(module_kwargs, scratch_dir)) as pool:
+            for _ in range(MAX_PASSES):
+                # Re-read the live gallery each pass: it may still be taking registrations
+                if not catch_up(pool):
+                    break
+            if publish and (allow_missing or not failures):
+                # Wait out a compaction and keep new ones off until the switch
+                with live.compaction_lock:
+                    for _ in range(MAX_PASSES):
+                        # Re-embedding runs without the store lock, which every API
+                        # worker takes to refresh and register
+                        if catch_up(pool):
+                            continue
+                        with live.lock():
+                            # The last pass saw every registration only if the journal
+                            # has not grown since it read the gallery; otherwise go again
+                            if live.follow() == []:
+                                if allow_missing or not failures:
+                                    switch(live, shadow)
+                                    switched = True
+                                break
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        if live.journal is not None:
+            live.journal.close()
+
+    return shadow, {student_id: error for student_id, (_, error) in failures.items()}, switched
+
+
+def switch(live: EmbeddingStore, shadow: EmbeddingStore):
+    """
+    Publishes the shadow gallery as the live one: it is written as the next
+    snapshot of the live store, which becomes current with a single atomic rename
+    of CURRENT, and the old model's snapshot and journals are dropped. Call it
+    holding live.lock(), once live.follow() under the same lock found nothing
+    written since the last catch-up pass, or registrations made in between would
+    be lost with the old journals.
+    """
+    gallery, metadata = shadow.load(writable=False)
+    metadata = {
+        student_id: {key: value for key, value in meta.items() if key != "source_crc"}
+        for student_id, meta in metadata.items()
+    }
+    live.write_snapshot(gallery, metadata, live.rotate())
+    shadow.journal.close()
+    shutil.rmtree(shadow.directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed the gallery with another recognition model from the stored face crops.")
+    parser.add_argument("--model", required=True, help="DeepFace recognition model to migrate to, e.g. ArcFace")
+    parser.add_argument("--gallery", default="embeddings/gallery", help="Embedding store directory to migrate")
+    parser.add_argument("--face-crops", default=None, help="Face crop directory (default: face_crops next to the gallery)")
+    parser.add_argument("--shadow", default=None, help="Where the new gallery is built (default: <gallery>.shadow-<model>)")
+    parser.add_argument("--detector", default="opencv", help="Detector for students without a stored face crop")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Worker processes, each loading the model once")
+    parser.add_argument("--chunk-size", type=int, default=32, help="Faces embedded per worker task (one batched forward pass)")
+    parser.add_argument("--commit-every", type=int, default=256, help="Embeddings written to the shadow gallery per journal write")
+    parser.add_argument("--allow-missing", action="store_true", help="Switch even if some students could not be re-embedded (they are dropped)")
+    parser.add_argument("--no-switch", action="store_true", help="Only build the shadow gallery")
+
+    args = parser.parse_args()
+
+    if not EmbeddingStore(args.gallery).exists():
+        print(json.dumps({"status": "error", "message": f"Embedding store not found: {args.gallery}"}))
+        return
+
+    gallery_dir = os.path.normpath(args.gallery)
+    shadow_dir = args.shadow or f"{gallery_dir}.shadow-{args.model}"
+    face_crop_dir = args.face_crops or os.path.join(os.path.dirname(gallery_dir), "face_crops")
+    module_kwargs = {
+        "model_name": args.model,
+        "detector_backend": args.detector,
+        "batch_size": args.chunk_size
+    }
+    try:
+        shadow, failures, switched = migrate(
+            gallery_dir, shadow_dir, face_crop_dir, module_kwargs,
+            workers=max(1, args.workers), chunk_size=max(1, args.chunk_size), commit_every=max(1, args.commit_every),
+            publish=not args.no_switch, allow_missing=args.allow_missing
+        )
+    except ValueError as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        return
+
+    # A switched shadow gallery has become the live one
+    migrated = len(EmbeddingStore(gallery_dir if switched else shadow_dir).load(writable=False)[0])
+    report = {
+        "status": "success",
+        "model": args.model,
+        "migrated": migrated,
+        "failed": len(failures),
+        "shadow": shadow_dir,
+        "switched": switched,
+        "failures": [{"student_id": student_id, "message": error} for student_id, error in sorted(failures.items())]
+    }
+    if switched:
+        report["message"] = f"Gallery re-embedded with {args.model} ({migrated} students). Restart the ML service with ML_MODEL={args.model}."
+    elif failures and not args.allow_missing:
+        report["status"] = "error"
+        report["message"] = f"{len(failures)} students could not be re-embedded; the live gallery is unchanged. Fix them and rerun, or pass --allow-missing."
+    elif not args.no_switch:
+        report["status"] = "error"
+        report["message"] = f"The live gallery kept changing during the last {MAX_PASSES} passes and is unchanged; rerun to catch up and switch."
+    else:
+        report["message"] = f"Shadow gallery with {migrated} students is ready in {shadow_dir}."
+
+    # Output JSON
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import struct
+import time
+import cv2
+import numpy as np
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC)
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Preprocessing and inference stages, in pipeline order
+STAGES = ("decode", "orient", "resize", "detect", "crop", "quality", "embed")
+
+
+class PreparedImage(NamedTuple):
+    # Upright image at decode resolution; faces are cropped from here
+    image: Optional[np.ndarray]
+    # The image downscaled to the max edge; the detector runs on this
+    detection: object
+    # Image pixels per detection pixel
+    scale: float
+    # Original upload pixels per image pixel (> 1 after a reduced decode)
+    original_scale: float
+    # Milliseconds spent per stage; detect, crop, quality and embed are filled in later
+    timings: Dict[str, float]
+
+
+def jpeg_header(data: bytes) -> Optional[Tuple[int, int, int]]:
+    """
+    Reads (width, height, exif_orientation) from the JPEG markers without decoding
+    any pixels. Returns None if the data is not a JPEG.
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    orientation = 1
+    i = 2
+    try:
+        while i + 4 <= len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:
+                # Fill byte
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                i += 2
+                continue
+            length = struct.unpack(">H", data[i + 2:i + 4])[0]
+            if marker == 0xE1 and data[i + 4:i + 10] == b"Exif\x00\x00":
+                orientation = _exif_orientation(data[i + 10:i + 2 + length])
+            elif marker in _SOF_MARKERS:
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height, orientation
+            elif marker == 0xDA:
+                # Start of scan without a frame header
+                return None
+            i += 2 + length
+    except struct.error:
+        pass
+    return None
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    try:
+        order = {b"II": "<", b"MM": ">"}[tiff[:2]]
+        ifd = struct.unpack(order + "I", tiff[4:8])[0]
+        count = struct.unpack(order + "H", tiff[ifd:ifd + 2])[0]
+        for entry in range(ifd + 2, ifd + 2 + 12 * count, 12):
+            tag, kind = struct.unpack(order + "HH", tiff[entry:entry + 4])
+            if tag == 0x0112 and kind == 3:
+                value = struct.unpack(order + "H", tiff[entry + 8:entry + 10])[0]
+                return value if 1 <= value <= 8 else 1
+    except (KeyError, struct.error):
+        pass
+    return 1
+
+
+def apply_orientation(img: np.ndarray, orientation: int) -> np.ndarray:
+    """
+    Turns an image stored with the given EXIF orientation upright.
+    """
+    if orientation == 2:
+        return cv2.flip(img, 1)
+    if orientation == 3:
+        return cv2.rotate(img, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(img, 0)
+    if orientation == 5:
+        return cv2.transpose(img)
+    if orientation == 6:
+        return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(img), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return img
+
+
+def downscale(img: np.ndarray, max_edge: Optional[int]) -> Tuple[np.ndarray, float]:
+    """
+    Shrinks img so its longest side is at most max_edge pixels. Returns the image
+    and the factor it was shrunk by (1.0 if it was small enough).
+    """
+    height, width = img.shape[:2]
+    longest = max(height, width)
+    if not max_edge or longest <= max_edge:
+        return img, 1.0
+    scale = max_edge / longest
+    small = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return small, longest / max(small.shape[:2])
+
+
+def prepare_image(data: bytes, max_edge: Optional[int] = None, decode_edge: Optional[int] = None) -> PreparedImage:
+    """
+    Decodes encoded image bytes (JPEG/PNG/...) into an upright BGR image and a copy
+    downscaled to max_edge for detection.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the codec itself when the result
+    still has a longest side of at least decode_edge pixels, which is much cheaper
+    than decoding every pixel of a phone photo and resizing afterwards. Their EXIF
+    orientation is applied explicitly; other formats are left to the codec.
+    """
+    timings = {}
+    start = time.perf_counter()
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    header = jpeg_header(data)
+    factor = 1
+    orientation = 1
+    flags = cv2.IMREAD_COLOR
+    if header is not None:
+        width, height, orientation = header
+        longest = max(width, height)
+        if decode_edge:
+            factor = max([1] + [f for f in _REDUCED_FLAGS if longest / f >= decode_edge])
+        flags = _REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+    img = cv2.imdecode(buffer, flags) if buffer.size else None
+    if img is None:
+        raise ValueError("Could not decode image. Please upload a valid image file.")
+    original_scale = max(header[:2]) / max(img.shape[:2]) if header is not None else 1.0
+    timings["decode_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    img = apply_orientation(img, orientation)
+    timings["orient_ms"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    detection, scale = downscale(img, max_edge)
+    timings["resize_ms"] = (time.perf_counter() - start) * 1000
+    return PreparedImage(img, detection, scale, original_scale, timings)
+
+
+def prepare_array(img: np.ndarray, max_edge: Optional[int] = None) -> PreparedImage:
+    """
+    Like prepare_image, for an already decoded upright BGR image.
+    """
+    start = time.perf_counter()
+    detection, scale = downscale(img, max_edge)
+    return PreparedImage(img, detection, scale, 1.0, {"resize_ms": (time.perf_counter() - start) * 1000})
+
+
+def scale_area(facial_area: Dict, scale: float) -> Dict:
+    """
+    Maps a detector facial_area (x, y, w, h and optional eye points) to an image
+    scale times larger.
+    """
+    if scale == 1.0:
+        return dict(facial_area)
+    scaled = dict(facial_area)
+    for key in ("x", "y", "w", "h"):
+        if facial_area.get(key) is not None:
+            scaled[key] = int(round(facial_area[key] * scale))
+    for key in ("left_eye", "right_eye"):
+        if facial_area.get(key) is not None:
+            scaled[key] = tuple(int(round(v * scale)) for v in facial_area[key])
+    return scaled
+
+
+def crop_face(image: np.ndarray, facial_area: Dict, align: bool = True) -> np.ndarray:
+    """
+    Cuts the face described by facial_area (in image coordinates) out of image as
+    an RGB float crop in [0, 1], rotated upright on the eye line like the DeepFace
+    detectors do. Only the crop is resampled, never the whole image.
+    """
+    x, y, w, h = (facial_area[key] for key in ("x", "y", "w", "h"))
+    w = max(1, int(w))
+    h = max(1, int(h))
+    left_eye = facial_area.get("left_eye")
+    right_eye = facial_area.get("right_eye")
+    if align and left_eye is not None and right_eye is not None:
+        angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+    else:
+        angle = 0.0
+
+    if angle == 0.0:
+        height, width = image.shape[:2]
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        crop = image[y0:min(height, y0 + h), x0:min(width, x0 + w)]
+    else:
+        # Rotate about the face centre and sample just the w x h box around it;
+        # pixels from outside the image come out black
+        center = (x + w / 2, y + h / 2)
+        matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+        matrix[:, 2] -= (center[0] - w / 2, center[1] - h / 2)
+        crop = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+    return crop[:, :, ::-1] / 255
+
+
+def encode_face_crop(face: np.ndarray) -> bytes:
+    """
+    Encodes an aligned RGB face crop (floats in [0, 1]) as a lossless PNG.
+    """
+    pixels = np.clip(np.round(np.asarray(face) * 255), 0, 255).astype(np.uint8)
+    ok, buffer = cv2.imencode(".png", np.ascontiguousarray(pixels[:, :, ::-1]))
+    if not ok:
+        raise ValueError("Could not encode face crop.")
+    return buffer.tobytes()
+
+
+def decode_face_crop(data: bytes) -> np.ndarray:
+    """
+    Inverse of encode_face_crop: the RGB crop as floats in [0, 1], ready for embedding.
+    """
+    pixels = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if pixels is None:
+        raise ValueError("Could not decode face crop.")
+    return pixels[:, :, ::-1] / 255
@@ -14,10 +14,12 @@ def run_tests():
             print(f"[FAIL] Directory missing: {d}")
 
     # 2. Check Database File
-    if os.path.exists("embeddings/students.json"):
-        print("[OK] Database file exists: embeddings/students.json")
+    if os.path.exists("embeddings/gallery/CURRENT"):
+        print("[OK] Embedding store exists: embeddings/gallery")
+    elif os.path.exists("embeddings/students.json"):
+        print("[OK] Legacy database file exists: embeddings/students.json (converted on first load)")
     else:
-        print("[FAIL] Database file missing: embeddings/students.json")
+        print("[FAIL] Database missing: embeddings/gallery or embeddings/students.json")
 
     # 3. Check Library Imports
     try:
@@ -0,0 +1,92 @@
+import os
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+ML_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The ml modules import each other by bare name, as when run from ml/ or ml/api/
+sys.path[:0] = [ML_DIR, os.path.join(ML_DIR, "api")]
+
+from face_recognition_module import FaceRecognitionModule, SyntheticBackend
+
+DIM = 64
+
+
+class Faces:
+    """
+    Synthetic students: a random photo per student, embedded with the
+    SyntheticBackend, and retakes of it with a little pixel noise that embed close
+    to the original.
+    """
+
+    def __init__(self, seed: int = 0):
+        self.backend = SyntheticBackend(dim=DIM)
+        self.rng = np.random.default_rng(seed)
+
+    def photo(self, student_id: str) -> np.ndarray:
+        # The same for every Faces, so processes and fixtures agree on who is who
+        rng = np.random.default_rng(zlib.crc32(student_id.encode("utf-8")))
+        return rng.integers(0, 256, (48, 48, 3)).astype(np.uint8)
+
+    def retake(self, student_id: str, noise: float = 12.0) -> np.ndarray:
+        photo = self.photo(student_id).astype(np.float32) + self.rng.normal(0, noise, (48, 48, 3))
+        return np.clip(photo, 0, 255).astype(np.uint8)
+
+    def embed(self, img: np.ndarray) -> np.ndarray:
+        face = self.backend.detect(img)[0]["face"]
+        return np.asarray(self.backend.embed([face], 1)[0], dtype=np.float32)
+
+    def embedding(self, student_id: str) -> np.ndarray:
+        return self.embed(self.photo(student_id))
+
+    def probe(self, student_id: str) -> np.ndarray:
+        return self.embed(self.retake(student_id))
+
+
+@pytest.fixture(scope="session")
+def faces():
+    return Faces()
+
+
+@pytest.fixture(scope="session")
+def ml_api(tmp_path_factory):
+    """
+    The ML API module, imported on the synthetic backend with a gallery of its own.
+    """
+    directory = tmp_path_factory.mktemp("ml_api")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("ML_GALLERY_DIR", str(directory / "gallery"))
+        patch.setenv("ML_EMBEDDING_BACKEND", "synthetic")
+        patch.setenv("ML_SHARED_GALLERY", "0")
+        patch.setenv("ML_QUALITY_GATE", "0")
+        import ml_api
+    return ml_api
+
+
+@pytest.fixture
+def make_module(tmp_path):
+    """
+    Builds FaceRecognitionModules on the synthetic backend, by default all on the
+    same gallery in tmp_path.
+    """
+    modules = []
+
+    def make(gallery_dir=None, **kwargs):
+        options = dict(
+            gallery_dir=str(gallery_dir or tmp_path / "gallery"), legacy_embeddings_file=None,
+            ann_min_size=None, quality_gate=None, backend="synthetic", backend_options={"dim": DIM}
+        )
+        options.update(kwargs)
+        module = FaceRecognitionModule(**options)
+        modules.append(module)
+        return module
+
+    yield make
+    for module in modules:
+        thread = module._compaction_thread
+        if thread is not None:
+            thread.join()
+        if module.store.journal is not None:
+            module.store.journal.close()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex
+from gallery import EmbeddingGallery
+
+STUDENTS = [f"s{i}" for i in range(2000)]
+DIM = 64
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    """
+    Embeddings of STUDENTS and a noisy probe of each. Faces share directions
+    (age, lighting, ...), so the rows are drawn around a few centres rather
+    than uniformly.
+    """
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((40, DIM))
+    rows = centres[rng.integers(0, len(centres), len(STUDENTS))] + 0.6 * rng.standard_normal((len(STUDENTS), DIM))
+    probes = rows + 0.15 * rng.standard_normal(rows.shape)
+    return rows.astype(np.float32), probes.astype(np.float32)
+
+
+def top1(gallery: EmbeddingGallery, query, rows=None):
+    nearest = gallery.search(query, rows=rows)
+    return nearest[0][0] if nearest else None
+
+
+def test_recall_against_exact_search(vectors):
+    rows, probes = vectors
+    gallery = EmbeddingGallery()
+    for student_id, row in zip(STUDENTS, rows):
+        gallery.add(student_id, row)
+    index = IVFIndex(n_probe=8)
+    gallery.attach_index(index, gallery.build_index(index))
+
+    queries = probes[:400]
+    exact = [top1(gallery, query) for query in queries]
+    approximate = [top1(gallery, query, gallery.index_candidates(query)) for query in queries]
+    assert np.mean([a == e for a, e in zip(approximate, exact)]) >= 0.95
+    # ...while scoring a fraction of the gallery
+    assert np.mean([gallery.index_candidates(query).size for query in queries]) < len(STUDENTS) / 4
+
+    # Probing every list is an exact search
+    everything = len(index.centroids)
+    assert [top1(gallery, query, gallery.index_candidates(query, everything)) for query in queries] == exact
+
+
+def test_index_follows_registrations_and_compaction(make_module, vectors):
+    rows, probes = vectors
+    # Compaction only when asked for
+    module = make_module(ann_min_size=1000, compact_after=10**6)
+    module.register_embeddings([(student_id, row, None, None) for student_id, row in zip(STUDENTS[:1500], rows[:1500])])
+    module.build_index(background=False)
+    index = module.gallery.index
+    assert index is not None and index.trained_size == 1500
+
+    # Later registrations are filed into the trained index, removals leave it
+    module.register_embeddings([(student_id, row, None, None) for student_id, row in zip(STUDENTS[1500:], rows[1500:])])
+    module.unregister_student(STUDENTS[0])
+    assert module.gallery.index is index
+    late = range(1500, 1600)
+    assert np.mean([module.identify_embedding(probes[i])["student_id"] == STUDENTS[i] for i in late]) >= 0.95
+    assert module.identify_embedding(probes[0])["student_id"] != STUDENTS[0]
+
+    # Compaction renumbers the rows, so a new index is trained on the compacted gallery
+    module.compact(background=False)
+    module._index_thread.join()
+    assert module.gallery.index is not index
+    assert module.gallery.index.trained_size == len(STUDENTS) - 1
+    assert np.mean([module.identify_embedding(probes[i])["student_id"] == STUDENTS[i] for i in range(1, 400)]) >= 0.95
@@ -0,0 +1,40 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from assignment import linear_assignment
+
+
+def brute_force(cost: np.ndarray) -> float:
+    rows, cols = cost.shape
+    if rows <= cols:
+        return min(sum(cost[r, c] for r, c in zip(range(rows), perm)) for perm in itertools.permutations(range(cols), rows))
+    return brute_force(cost.T)
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (4, 6), (6, 4), (5, 5), (2, 7), (6, 6)])
+def test_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        cost = rng.random(shape)
+        pairs = linear_assignment(cost)
+        assert len(pairs) == min(shape)
+        assert len({r for r, _ in pairs}) == len(pairs)
+        assert len({c for _, c in pairs}) == len(pairs)
+        assert sum(cost[r, c] for r, c in pairs) == pytest.approx(brute_force(cost))
+
+
+def test_ties_and_forbidden_pairs():
+    # match_group prices pairs above the threshold at 1e6
+    cost = np.array([
+        [0.2, 1e6, 1e6],
+        [0.2, 0.2, 1e6],
+        [1e6, 0.3, 0.1]
+    ])
+    assert sorted(linear_assignment(cost)) == [(0, 0), (1, 1), (2, 2)]
+    assert len(linear_assignment(np.ones((3, 3)))) == 3
+
+
+def test_empty():
+    assert linear_assignment(np.zeros((0, 4))) == []
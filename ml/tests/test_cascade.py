@@ -0,0 +1,134 @@
+import importlib.util
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import ML_DIR
+from preprocessing import encode_face_crop
+
+
+def png(img) -> bytes:
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def borderline(faces, a: str, b: str, threshold: float = 0.30) -> np.ndarray:
+    """
+    A blend of students a and b whose cosine distance to a is as close to the
+    synthetic model's threshold as the blends get.
+    """
+    def distance(img):
+        x, y = faces.embed(img), faces.embedding(a)
+        return 1 - float(x @ y / np.linalg.norm(x) / np.linalg.norm(y))
+
+    blends = [(alpha * faces.photo(a) + (1 - alpha) * faces.photo(b)).astype(np.uint8) for alpha in np.linspace(0, 1, 41)]
+    return min(blends, key=lambda img: abs(distance(img) - threshold))
+
+
+def register(module, faces, student_ids):
+    for student_id in student_ids:
+        face = faces.backend.detect(faces.photo(student_id))[0]["face"]
+        module.register_embedding(student_id, faces.embed(faces.photo(student_id)), face_crop=encode_face_crop(face))
+
+
+def test_only_unsure_claims_reach_the_main_model(make_module, faces):
+    module = make_module(cascade_model="Light", cascade_margin=0.25)
+    register(module, faces, ["a", "b"])
+    module.unregister_student("b")
+    module.register_embedding("b", faces.embedding("b"))
+
+    results = module.verify_batch([
+        ("a", faces.retake("a")),
+        ("a", faces.retake("c")),
+        ("a", borderline(faces, "a", "c")),
+        ("b", faces.retake("b")),
+        ("a", np.zeros((48, 48, 3), dtype=np.uint8))
+    ])
+    assert [result.get("cascade_stage") for result in results] == ["fast", "fast", "full", "full", None]
+    assert results[0]["match"] and results[3]["match"]
+    assert not results[1]["match"]
+    assert results[4]["status"] == "error"
+    # Within the band the light model's answer is not trusted
+    band = module.cascade_margin * module.cascade.threshold
+    assert abs(results[2]["distance"] - module.cascade.threshold) <= band
+
+
+def test_light_gallery_follows_other_processes(make_module, faces):
+    writer = make_module(cascade_model="Light", shared_gallery=True)
+    reader = make_module(cascade_model="Light", shared_gallery=True)
+    register(writer, faces, ["a"])
+    assert "a" not in reader.cascade.gallery
+    assert reader.refresh()
+    assert "a" in reader.gallery and "a" in reader.cascade.gallery
+    assert reader.verify_light("a", faces.embed(faces.retake("a")))["cascade_stage"] == "fast"
+
+    writer.unregister_student("a")
+    reader.refresh()
+    assert "a" not in reader.cascade.gallery
+
+
+def test_registration_takes_the_light_embedding_from_the_pool(make_module, faces, monkeypatch):
+    import inference_pool
+
+    module = make_module(cascade_model="Light")
+    monkeypatch.setattr(inference_pool, "_worker_module", module)
+    embedding, _, _, face_crop, light_embedding = inference_pool.embed_registration(png(faces.photo("a")))
+
+    def light_model(faces):
+        raise AssertionError("the light model ran during register_embedding")
+
+    # The API registers on the event loop, so the light model must not run there
+    monkeypatch.setattr(module.cascade, "embed_faces", light_model)
+    module.register_embedding("a", embedding, face_crop=face_crop, light_embedding=light_embedding)
+    assert module.verify_light("a", faces.embed(faces.retake("a")))["cascade_stage"] == "fast"
+
+
+@pytest.fixture(scope="module")
+def cascade_api(tmp_path_factory):
+    """
+    A second instance of the ML API module, imported with ML_CASCADE_MODEL.
+    """
+    directory = tmp_path_factory.mktemp("cascade_api")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("ML_GALLERY_DIR", str(directory / "gallery"))
+        patch.setenv("ML_EMBEDDING_BACKEND", "synthetic")
+        patch.setenv("ML_QUALITY_GATE", "0")
+        patch.setenv("ML_CASCADE_MODEL", "Light")
+        spec = importlib.util.spec_from_file_location("ml_api_cascade", os.path.join(ML_DIR, "api", "ml_api.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+def test_api_verifies_through_the_cascade(cascade_api, faces):
+    from fastapi.testclient import TestClient
+
+    with TestClient(cascade_api.app) as client:
+        deadline = time.monotonic() + 60
+        while client.get("/health/ready").status_code != 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        for student_id in ["a", "b"]:
+            response = client.post("/register", data={"student_id": student_id}, files={"file": ("x.png", png(faces.photo(student_id)), "image/png")})
+            assert response.status_code == 200
+        assert sorted(cascade_api.ml_module.cascade.gallery.ids) == ["a", "b"]
+
+        result = client.post("/verify", data={"student_id": "a"}, files={"file": ("x.png", png(faces.retake("a")), "image/png")}).json()
+        assert (result["matched"], result["cascade_stage"]) == (True, "fast")
+        assert result["facial_area"]["w"] == 48
+        result = client.post("/verify", data={"student_id": "a"}, files={"file": ("x.png", png(borderline(faces, "a", "b")), "image/png")}).json()
+        assert result["cascade_stage"] == "full"
+
+        files = [("files", (f"{i}.png", png(img), "image/png")) for i, img in enumerate([
+            faces.retake("a"), faces.retake("a"), borderline(faces, "b", "a"), np.zeros((48, 48, 3), dtype=np.uint8)
+        ])]
+        results = client.post("/verify/batch", data={"student_ids": ["a", "b", "b", "a"]}, files=files).json()
+        assert [result.get("cascade_stage") for result in results] == ["fast", "fast", "full", None]
+        assert [result["matched"] for result in results[:2]] == [True, False]
+        assert [result["index"] for result in results] == [0, 1, 2, 3]
+
+        # 1:N identification still uses the main model alone
+        result = client.post("/verify", files={"file": ("x.png", png(faces.retake("b")), "image/png")}).json()
+        assert result["student_id"] == "b" and "cascade_stage" not in result
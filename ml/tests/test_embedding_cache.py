@@ -0,0 +1,101 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import embedding_cache
+from embedding_cache import EmbeddingCache
+
+EMBEDDING = np.arange(64, dtype=np.float32)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = EmbeddingCache("model", ttl=60)
+    key = cache.key(b"photo")
+    cache.put(key, EMBEDDING, {"x": 1})
+    clock[0] += 59
+    np.testing.assert_array_equal(cache.get(key).embedding, EMBEDDING)
+    clock[0] += 2
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses, cache.expirations) == (1, 1, 1)
+    assert cache.stats()["bytes"] == 0
+
+
+def test_least_recently_used_is_evicted(clock):
+    entry_bytes = embedding_cache._ENTRY_OVERHEAD + EMBEDDING.nbytes
+    cache = EmbeddingCache("model", max_bytes=2 * entry_bytes)
+    a, b, c = (cache.key(data) for data in (b"a", b"b", b"c"))
+    cache.put(a, EMBEDDING)
+    cache.put(b, EMBEDDING)
+    assert cache.get(a) is not None
+    cache.put(c, EMBEDDING)
+    assert cache.get(b) is None
+    assert cache.get(a) is not None and cache.get(c) is not None
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 2 * entry_bytes
+
+
+def test_rejections_are_cached(clock):
+    cache = EmbeddingCache("model")
+    key = cache.key(b"blurry")
+    cache.put_error(key, "Face is too blurry.", "blurry")
+    entry = cache.get(key)
+    assert entry.embedding is None
+    assert (entry.error, entry.reason) == ("Face is too blurry.", "blurry")
+
+
+def test_keys_depend_on_namespace():
+    assert EmbeddingCache("VGG-Face").key(b"photo") != EmbeddingCache("ArcFace").key(b"photo")
+    assert EmbeddingCache("VGG-Face").key(b"photo") == EmbeddingCache("VGG-Face").key(b"photo")
+
+
+@pytest.fixture
+def pipeline(ml_api, monkeypatch):
+    """
+    Replaces the micro-batcher behind embed_upload_cached with a slow stand-in
+    that counts the uploads it embeds.
+    """
+    calls = []
+
+    async def submit(data):
+        calls.append(data)
+        await asyncio.sleep(0.05)
+        if data == b"blank":
+            raise ValueError("Face could not be detected.")
+        return [float(len(data))], {"x": 0}, {}
+
+    monkeypatch.setattr(ml_api.batcher, "submit", submit)
+    ml_api.embedding_cache.clear()
+    yield calls
+    ml_api.embedding_cache.clear()
+
+
+def test_concurrent_duplicates_are_embedded_once(ml_api, pipeline):
+    async def scenario():
+        return await asyncio.gather(*(ml_api.embed_upload_cached(b"photo") for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert pipeline == [b"photo"]
+    assert [cached for _, cached in results] == [False, True, True, True, True]
+    assert all(entry.embedding.tolist() == [5.0] for entry, _ in results)
+    assert not ml_api._inflight
+
+    # A later retry is answered from the cache
+    entry, cached = asyncio.run(ml_api.embed_upload_cached(b"photo"))
+    assert cached and pipeline == [b"photo"]
+
+
+def test_concurrent_duplicate_rejections_are_embedded_once(ml_api, pipeline):
+    async def scenario():
+        return await asyncio.gather(*(ml_api.embed_upload_cached(b"blank") for _ in range(3)))
+
+    results = asyncio.run(scenario())
+    assert pipeline == [b"blank"]
+    assert all(entry.error == "Face could not be detected." for entry, _ in results)
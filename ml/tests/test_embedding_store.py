@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, RegistrationLog
+
+
+def journal_path(store: EmbeddingStore) -> str:
+    return store.journal.path
+
+
+def register(store: EmbeddingStore, faces, student_ids):
+    for student_id in student_ids:
+        store.append_register(student_id, faces.embedding(student_id), {"registered_image": f"{student_id}.jpg"})
+
+
+def test_journal_replay(tmp_path, faces):
+    store = EmbeddingStore(str(tmp_path / "gallery"))
+    store.load()
+    register(store, faces, ["a", "b", "c"])
+    store.append_register("b", faces.embedding("d"), {"registered_image": "b2.jpg"})
+    store.append_unregister("c")
+    store.journal.close()
+
+    gallery, metadata = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    assert sorted(gallery.ids) == ["a", "b"]
+    np.testing.assert_allclose(gallery.get("a"), faces.embedding("a"), rtol=1e-5, atol=1e-5)
+    # The re-registration replaces the first one
+    np.testing.assert_allclose(gallery.get("b"), faces.embedding("d"), rtol=1e-5, atol=1e-5)
+    assert metadata == {"a": {"registered_image": "a.jpg"}, "b": {"registered_image": "b2.jpg"}}
+
+
+def test_corrupt_record_is_not_replayed(tmp_path, faces):
+    store = EmbeddingStore(str(tmp_path / "gallery"))
+    store.load()
+    register(store, faces, ["a", "b"])
+    path = journal_path(store)
+    store.journal.close()
+
+    # Flip a byte of the last record's embedding: its CRC no longer matches
+    with open(path, "r+b") as f:
+        f.seek(-10, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-10, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    gallery, _ = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    assert gallery.ids == ["a"]
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path, faces):
+    store = EmbeddingStore(str(tmp_path / "gallery"))
+    store.load()
+    register(store, faces, ["a", "b"])
+    path = journal_path(store)
+    intact = os.path.getsize(path)
+    register(store, faces, ["c"])
+    store.journal.close()
+
+    # A crash part way through writing "c"
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 7)
+
+    reopened = EmbeddingStore(str(tmp_path / "gallery"))
+    gallery, _ = reopened.load()
+    assert sorted(gallery.ids) == ["a", "b"]
+    assert os.path.getsize(path) == intact
+    assert reopened.journal.records == 2
+
+    # Appends go after the last intact record and replay normally
+    register(reopened, faces, ["d"])
+    reopened.journal.close()
+    records = [(op, student_id) for _, op, student_id, _, _ in RegistrationLog(path).read()]
+    assert records == [(RegistrationLog.REGISTER, "a"), (RegistrationLog.REGISTER, "b"), (RegistrationLog.REGISTER, "d")]
+
+
+def test_save_folds_the_journal_into_a_snapshot(tmp_path, faces):
+    directory = str(tmp_path / "gallery")
+    store = EmbeddingStore(directory)
+    gallery, metadata = store.load()
+    register(store, faces, ["a", "b", "c"])
+    store.append_unregister("b")
+    store.journal.close()
+
+    gallery, metadata = EmbeddingStore(directory).load(writable=False)
+    store = EmbeddingStore(directory)
+    store.save(gallery, metadata)
+    store.journal.close()
+
+    snapshots = [entry for entry in os.listdir(directory) if entry.startswith("snapshot-")]
+    assert snapshots == [store.current_snapshot()]
+    reloaded, reloaded_meta = EmbeddingStore(directory).load(writable=False)
+    assert sorted(reloaded.ids) == ["a", "c"]
+    assert reloaded.dead_rows == 0
+    assert reloaded_meta == metadata
+    np.testing.assert_allclose(reloaded.get("c"), faces.embedding("c"), rtol=1e-5, atol=1e-5)
+
+
+def test_module_compaction_and_reload(make_module, faces):
+    module = make_module()
+    for student_id in ["s1", "s2", "s3", "s4"]:
+        module.register_embedding(student_id, faces.embedding(student_id))
+    module.unregister_student("s2")
+    module.register_embedding("s3", faces.embedding("s5"))
+
+    module.compact(background=False)
+    assert module.store.pending_records == 0
+    assert module.gallery.dead_rows == 0
+
+    # Registrations after the compaction land in the new journal
+    module.register_embedding("s6", faces.embedding("s6"))
+    module.store.journal.close()
+
+    reloaded = make_module()
+    assert sorted(reloaded.gallery.ids) == ["s1", "s3", "s4", "s6"]
+    assert reloaded.embeddings["s1"]["model"] == "Synthetic"
+    assert reloaded.verify_embedding("s1", faces.probe("s1"))["match"]
+    assert reloaded.verify_embedding("s3", faces.probe("s5"))["match"]
+    assert not reloaded.verify_embedding("s4", faces.probe("s1"))["match"]
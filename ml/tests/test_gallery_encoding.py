@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from embedding_store import EmbeddingStore
+from gallery import EmbeddingGallery, PCAProjection
+
+STUDENTS = [f"s{i}" for i in range(200)]
+
+
+@pytest.fixture
+def registered(faces):
+    gallery = EmbeddingGallery()
+    for student_id in STUDENTS:
+        gallery.add(student_id, faces.embedding(student_id))
+    probes = np.stack([faces.probe(student_id) for student_id in STUDENTS[:50]])
+    return gallery, probes
+
+
+def top1(gallery: EmbeddingGallery, probes: np.ndarray):
+    return [gallery.search(probe)[0][0] for probe in probes]
+
+
+@pytest.mark.parametrize("precision, tolerance", [("float16", 1e-3), ("int8", 1e-2)])
+def test_compact_precision_keeps_distances(registered, precision, tolerance):
+    gallery, probes = registered
+    compact = gallery.converted(precision)
+    assert compact.precision == precision
+    assert compact.nbytes < gallery.nbytes
+
+    exact, ids = gallery.distance_matrix(probes)
+    approximate, compact_ids = compact.distance_matrix(probes)
+    assert compact_ids == ids
+    assert np.abs(approximate - exact).max() < tolerance
+    assert top1(compact, probes) == STUDENTS[:50]
+
+    # get() decodes an approximation of the original embedding
+    original = gallery.get("s7")
+    decoded = compact.get("s7")
+    assert np.linalg.norm(decoded - original) / np.linalg.norm(original) < tolerance * 5
+
+
+def test_pca_projection(registered):
+    gallery, probes = registered
+    projected = gallery.converted("float32", 32)
+    assert projected.projection.input_dim == gallery.dim
+    assert projected.dim == 32
+    components = projected.projection.components
+    np.testing.assert_allclose(components @ components.T, np.eye(32), atol=1e-4)
+
+    # Queries are projected like the rows, so full-size probes still identify
+    assert top1(projected, probes) == STUDENTS[:50]
+    assert projected.get("s3").shape == (gallery.dim,)
+
+
+def test_pca_fit_recovers_a_low_rank_subspace():
+    rng = np.random.default_rng(1)
+    basis = np.linalg.qr(rng.standard_normal((64, 8)))[0].T
+    vectors = rng.standard_normal((500, 8)) @ basis
+    units = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    projection = PCAProjection.fit(units, 8)
+    np.testing.assert_allclose(projection.reconstruct(projection.project(units)), units, atol=1e-4)
+
+
+@pytest.mark.parametrize("precision, components", [("float16", None), ("int8", None), ("int8", 32)])
+def test_store_round_trip(tmp_path, registered, precision, components):
+    gallery, probes = registered
+    compact = gallery.converted(precision, components)
+    store = EmbeddingStore(str(tmp_path / "gallery"))
+    store.save(compact, {student_id: {} for student_id in compact.ids})
+    store.journal.close()
+
+    loaded, _ = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    assert loaded.precision == precision
+    assert (loaded.projection is None) == (components is None)
+    np.testing.assert_array_equal(loaded.distance_matrix(probes)[0], compact.distance_matrix(probes)[0])
+
+    # Registrations on top of a compact snapshot are encoded the same way
+    loaded.add("new", probes[0])
+    assert loaded.search(probes[0])[0][0] == "new"
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from micro_batcher import MicroBatcher, Overloaded
+
+
+class FakePool:
+    """
+    Stands in for the InferencePool: records each batch and holds it until
+    released.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+        self.batches = []
+        self.release = asyncio.Event()
+
+    async def run(self, fn, uploads):
+        self.batches.append(list(uploads))
+        await self.release.wait()
+        return [ValueError("no face") if data == b"blank" else ([len(data)], {"x": 0}, {}) for data in uploads]
+
+
+def test_concurrent_requests_share_a_batch():
+    async def scenario():
+        pool = FakePool()
+        pool.release.set()
+        batcher = MicroBatcher(pool, max_batch=8, max_wait_ms=50)
+        results = await asyncio.gather(*(batcher.submit(b"x" * n) for n in range(1, 6)))
+        await batcher.stop()
+        return pool, results
+
+    pool, results = asyncio.run(scenario())
+    assert len(pool.batches) == 1
+    assert [embedding for embedding, _, _ in results] == [[1], [2], [3], [4], [5]]
+
+
+def test_rejections_fail_only_their_request():
+    async def scenario():
+        pool = FakePool()
+        pool.release.set()
+        batcher = MicroBatcher(pool, max_batch=8, max_wait_ms=20)
+        results = await asyncio.gather(batcher.submit(b"face"), batcher.submit(b"blank"), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    ok, rejected = asyncio.run(scenario())
+    assert ok[0] == [4]
+    assert isinstance(rejected, ValueError)
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def scenario():
+        pool = FakePool()
+        batcher = MicroBatcher(pool, max_batch=1, max_wait_ms=0, max_queue=2)
+        running = asyncio.ensure_future(batcher.submit(b"a"))
+        # Let the collector dispatch the first upload; it holds the only slot
+        while not pool.batches:
+            await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(batcher.submit(data)) for data in (b"bb", b"ccc")]
+        await asyncio.sleep(0)
+        assert batcher.depth == 2
+        with pytest.raises(Overloaded) as shed:
+            await batcher.submit(b"dddd")
+        retry_after = batcher.retry_after()
+        pool.release.set()
+        results = await asyncio.gather(running, *queued)
+        await batcher.stop()
+        return batcher, shed.value, retry_after, results
+
+    batcher, error, retry_after, results = asyncio.run(scenario())
+    assert batcher.shed == 1
+    assert error.retry_after == retry_after >= 1
+    assert [embedding for embedding, _, _ in results] == [[1], [2], [3]]
+
+
+def test_overloaded_response_carries_retry_after(ml_api):
+    response = ml_api.overloaded_response(Overloaded(7), matched=False)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
@@ -0,0 +1,121 @@
+import multiprocessing.dummy
+import os
+
+import pytest
+
+from conftest import DIM
+import migrate_gallery
+from embedding_store import EmbeddingStore
+from preprocessing import encode_face_crop
+
+
+def register(module, faces, student_ids):
+    for student_id in student_ids:
+        face = faces.backend.detect(faces.photo(student_id))[0]["face"]
+        module.register_embedding(student_id, faces.embed(faces.photo(student_id)), face_crop=encode_face_crop(face))
+
+
+def run_migration(tmp_path, model: str = "ArcFace", **kwargs):
+    """
+    migrate_gallery.migrate() on the synthetic backend, recording its embeddings
+    as model's.
+    """
+    gallery_dir = str(tmp_path / "gallery")
+    options = dict(workers=1, chunk_size=4, commit_every=4, publish=True)
+    options.update(kwargs)
+    return migrate_gallery.migrate(
+        gallery_dir, f"{gallery_dir}.shadow-{model}", str(tmp_path / "face_crops"),
+        {"model_name": model, "backend": "synthetic", "backend_options": {"dim": DIM}}, **options
+    )
+
+
+def models(tmp_path) -> set:
+    _, metadata = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    return {meta.get("model") for meta in metadata.values()}
+
+
+def test_a_switched_model_is_refused_until_restart(make_module, faces, tmp_path):
+    module = make_module(shared_gallery=True)
+    register(module, faces, ["a"])
+
+    _, failures, switched = run_migration(tmp_path)
+    assert switched and not failures
+    assert not os.path.exists(tmp_path / "gallery.shadow-ArcFace")
+
+    # Every look at the store fails the same way, not just the first
+    for _ in range(2):
+        with pytest.raises(ValueError, match="ArcFace"):
+            module.refresh()
+    with pytest.raises(ValueError, match="ArcFace"):
+        module.register_embedding("b", faces.embedding("b"))
+    with pytest.raises(ValueError, match="ArcFace"):
+        module.unregister_student("a")
+    # Nothing of the old model was written into the migrated store
+    assert models(tmp_path) == {"ArcFace"}
+
+
+
+def test_registrations_made_while_re_embedding_are_switched_in(make_module, faces, tmp_path, monkeypatch):
+    module = make_module(shared_gallery=True)
+    register(module, faces, [f"s{i}" for i in range(6)])
+    probe = EmbeddingStore(str(tmp_path / "gallery"), shared=True)
+    locked, late = [], []
+    reembed = migrate_gallery._reembed_chunk
+
+    def reembed_during_registrations(chunk):
+        # Note whether the store lock was held while the model ran, and keep
+        # registering and removing students meanwhile
+        free = probe.lock().acquire(blocking=False)
+        locked.append(not free)
+        if free:
+            probe.lock().release()
+            if len(late) < 4:
+                late.append(f"late{len(late)}")
+                register(module, faces, late[-1:])
+            if len(late) == 1:
+                module.unregister_student("s0")
+        return reembed(chunk)
+
+    # Worker threads instead of processes, so the chunks run the function above
+    monkeypatch.setattr(migrate_gallery, "_reembed_chunk", reembed_during_registrations)
+    monkeypatch.setattr(migrate_gallery.multiprocessing, "get_context", lambda method: multiprocessing.dummy)
+    # Passes keep finding registrations until the publishing loop
+    monkeypatch.setattr(migrate_gallery, "MAX_PASSES", 2)
+
+    _, failures, switched = run_migration(tmp_path, chunk_size=2)
+    assert switched and not failures
+    assert locked and not any(locked)
+    gallery, metadata = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    assert sorted(gallery.ids) == sorted([f"s{i}" for i in range(1, 6)] + late)
+    assert {meta["model"] for meta in metadata.values()} == {"ArcFace"}
+
+
+def test_an_interrupted_migration_resumes_and_reports_missing_students(make_module, faces, tmp_path, monkeypatch):
+    module = make_module(shared_gallery=True)
+    register(module, faces, ["a", "b", "c"])
+    # Neither a face crop nor a registered photo to re-embed from
+    module.register_embedding("d", faces.embedding("d"))
+    reembedded = []
+    reembed = migrate_gallery._reembed_chunk
+
+    def counting(chunk):
+        reembedded.extend(student_id for student_id, _, _ in chunk)
+        return reembed(chunk)
+
+    monkeypatch.setattr(migrate_gallery, "_reembed_chunk", counting)
+    monkeypatch.setattr(migrate_gallery.multiprocessing, "get_context", lambda method: multiprocessing.dummy)
+
+    _, failures, switched = run_migration(tmp_path)
+    assert not switched and list(failures) == ["d"]
+    assert sorted(reembedded) == ["a", "b", "c", "d"]
+    # The live gallery is untouched; the shadow keeps what was done
+    assert models(tmp_path) == {"Synthetic"}
+    assert sorted(EmbeddingStore(str(tmp_path / "gallery.shadow-ArcFace")).load(writable=False)[0].ids) == ["a", "b", "c"]
+
+    # A rerun only retries the failure, and may switch without it
+    reembedded.clear()
+    _, failures, switched = run_migration(tmp_path, allow_missing=True)
+    assert switched and list(failures) == ["d"]
+    assert reembedded == ["d"]
+    gallery, _ = EmbeddingStore(str(tmp_path / "gallery")).load(writable=False)
+    assert sorted(gallery.ids) == ["a", "b", "c"]
@@ -0,0 +1,88 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+from preprocessing import jpeg_header, prepare_image
+
+# Where each EXIF orientation stores an upright image: the transform a camera
+# applied, which prepare_image has to undo
+STORED = {
+    1: lambda img: img,
+    2: lambda img: img[:, ::-1],
+    3: lambda img: img[::-1, ::-1],
+    4: lambda img: img[::-1, :],
+    5: lambda img: img.transpose(1, 0, 2),
+    6: lambda img: np.rot90(img, 1),
+    7: lambda img: img[::-1, ::-1].transpose(1, 0, 2),
+    8: lambda img: np.rot90(img, -1)
+}
+
+
+def upright(height: int = 48, width: int = 64) -> np.ndarray:
+    """
+    An asymmetric picture of flat 16-pixel blocks, so JPEG artefacts stay small
+    and every flip or rotation of it is different.
+    """
+    rng = np.random.default_rng(height * width)
+    blocks = rng.integers(0, 256, (height // 16, width // 16, 3)).astype(np.uint8)
+    return np.kron(blocks, np.ones((16, 16, 1), dtype=np.uint8))
+
+
+def jpeg(img: np.ndarray, orientation: int = 1) -> bytes:
+    """
+    img as a JPEG with an EXIF APP1 segment carrying the orientation tag.
+    """
+    data = cv2.imencode(".jpg", np.ascontiguousarray(img), [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+    # Little-endian TIFF header, then one IFD with a single SHORT entry (0x0112)
+    tiff = b"II*\x00" + struct.pack("<I", 8) + struct.pack("<H", 1) + struct.pack("<HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack("<I", 0)
+    app1 = b"Exif\x00\x00" + tiff
+    return data[:2] + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + data[2:]
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_exif_orientation_is_applied(orientation):
+    picture = upright()
+    data = jpeg(STORED[orientation](picture), orientation)
+    assert jpeg_header(data)[2] == orientation
+
+    prepared = prepare_image(data)
+    assert prepared.image.shape == picture.shape
+    assert np.abs(prepared.image.astype(int) - picture).mean() < 4
+
+
+def test_reduced_decode_keeps_decode_edge():
+    picture = cv2.resize(upright(), (1600, 1200), interpolation=cv2.INTER_NEAREST)
+    data = jpeg(STORED[6](picture), 6)
+    assert jpeg_header(data) == (1200, 1600, 6)
+
+    # The largest codec reduction that keeps the longest side at 400 pixels or more
+    prepared = prepare_image(data, max_edge=200, decode_edge=400)
+    assert prepared.image.shape[:2] == (300, 400)
+    assert prepared.original_scale == 4.0
+    assert prepared.detection.shape[:2] == (150, 200) and prepared.scale == 2.0
+    assert np.abs(prepared.image.astype(int) - cv2.resize(picture, (400, 300), interpolation=cv2.INTER_AREA)).mean() < 8
+
+    # Without decode_edge every pixel is decoded
+    full = prepare_image(data)
+    assert full.image.shape[:2] == (1200, 1600) and full.original_scale == 1.0
+
+
+def test_other_formats_decode_at_full_size():
+    png = cv2.imencode(".png", upright())[1].tobytes()
+    assert jpeg_header(png) is None
+    prepared = prepare_image(png, decode_edge=16)
+    assert prepared.image.shape == upright().shape and prepared.original_scale == 1.0
+
+    with pytest.raises(ValueError):
+        prepare_image(b"not an image")
+
+
+def test_faces_are_reported_in_upload_pixels(make_module):
+    # The synthetic detector finds the whole image, so the face is the full upload
+    module = make_module(max_image_edge=200, decode_edge=400)
+    picture = cv2.resize(upright(), (1600, 1200), interpolation=cv2.INTER_NEAREST)
+    faces = module.find_faces(module.prepare(jpeg(STORED[6](picture), 6)))
+    assert len(faces) == 1
+    assert faces[0]["facial_area"]["w"] == 1600 and faces[0]["facial_area"]["h"] == 1200
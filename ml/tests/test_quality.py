@@ -0,0 +1,77 @@
+import pickle
+
+import cv2
+import numpy as np
+import pytest
+
+from quality import FaceQualityError, QualityGate
+
+AREA = {"x": 0, "y": 0, "w": 96, "h": 96}
+
+
+def textured(brightness: float = 0.5, contrast: float = 0.3, size: int = 96) -> np.ndarray:
+    """
+    An aligned RGB face crop in [0, 1]: sharp blocky detail around a mean level.
+    """
+    rng = np.random.default_rng(size)
+    blocks = rng.uniform(-1, 1, (size // 8, size // 8, 1))
+    detail = np.kron(blocks, np.ones((8, 8, 3)))
+    return np.clip(brightness + contrast * detail, 0, 1).astype(np.float32)
+
+
+def blurred(face: np.ndarray) -> np.ndarray:
+    return cv2.GaussianBlur(face, (0, 0), 8)
+
+
+def rejection(face, area=AREA) -> str:
+    with pytest.raises(FaceQualityError) as error:
+        QualityGate().check(face, area)
+    return error.value.reason
+
+
+def test_a_good_face_passes():
+    QualityGate().check(textured(), dict(AREA, left_eye=(33, 40), right_eye=(63, 40)))
+
+
+@pytest.mark.parametrize("face, area, reason", [
+    (textured(), dict(AREA, w=30, h=40), "face_too_small"),
+    (textured(brightness=0.08, contrast=0.05), AREA, "too_dark"),
+    (textured(brightness=0.95, contrast=0.04), AREA, "overexposed"),
+    (blurred(textured()), AREA, "blurry"),
+    # Eyes bunched towards one side of the box: the head is turned
+    (textured(), dict(AREA, left_eye=(62, 40), right_eye=(80, 40)), "pose")
+])
+def test_rejections(face, area, reason):
+    assert rejection(face, area) == reason
+
+
+def test_rejections_survive_the_trip_back_from_a_worker():
+    with pytest.raises(FaceQualityError) as error:
+        QualityGate().check(blurred(textured()), AREA)
+    copy = pickle.loads(pickle.dumps(error.value))
+    assert (copy.reason, str(copy), copy.measurements) == ("blurry", str(error.value), error.value.measurements)
+    assert copy.measurements["sharpness"] < QualityGate().min_sharpness
+
+
+def test_rejected_faces_are_not_embedded(make_module, monkeypatch):
+    module = make_module(quality_gate=QualityGate())
+    sharp = (textured() * 255).astype(np.uint8)
+    soft = (blurred(textured()) * 255).astype(np.uint8)
+    embedded = []
+    embed = module.backend.embed
+
+    def counting(faces, batch_size):
+        embedded.extend(faces)
+        return embed(faces, batch_size)
+
+    monkeypatch.setattr(module.backend, "embed", counting)
+
+    # Rejections are returned in place; the rest of the batch is embedded
+    results = module.embed_images([sharp, soft, sharp])
+    assert isinstance(results[1], FaceQualityError) and results[1].reason == "blurry"
+    assert not isinstance(results[0], Exception) and not isinstance(results[2], Exception)
+    assert len(embedded) == 2
+
+    result = module.register_student("s1", soft)
+    assert (result["status"], result["quality_issue"]) == ("error", "blurry")
+    assert "s1" not in module.gallery and len(embedded) == 2
@@ -0,0 +1,185 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import cv2
+import httpx
+import pytest
+
+from sharding import HashRing, merge_identifications
+
+API_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api")
+SHARDS = ["east", "west", "north"]
+STUDENT_IDS = [f"s{i}" for i in range(24)]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def png(img) -> bytes:
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def wait_ready(url: str, processes, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for process in processes:
+            assert process.poll() is None, f"{process.args} exited with {process.returncode}"
+        try:
+            if httpx.get(url + "/health/ready", trust_env=False).status_code == 200:
+                return
+        except httpx.RequestError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+@pytest.fixture(scope="module")
+def cluster(tmp_path_factory):
+    """
+    Three ML API shards on the synthetic backend, each with its own gallery,
+    behind shard_router.py, all on free local ports.
+    """
+    root = tmp_path_factory.mktemp("shards")
+    processes = []
+    shards = {}
+    try:
+        for name in SHARDS:
+            port = free_port()
+            env = dict(
+                os.environ, ML_EMBEDDING_BACKEND="synthetic", ML_QUALITY_GATE="0",
+                ML_GALLERY_DIR=str(root / name / "gallery"), ML_PORT=str(port)
+            )
+            log = open(root / f"{name}.log", "w")
+            processes.append(subprocess.Popen([sys.executable, "ml_api.py"], cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT))
+            shards[name] = (f"http://127.0.0.1:{port}", processes[-1])
+
+        router_port = free_port()
+        env = dict(
+            os.environ, ML_ROUTER_PORT=str(router_port),
+            ML_SHARDS=",".join(f"{name}={url}" for name, (url, _) in shards.items())
+        )
+        log = open(root / "router.log", "w")
+        processes.append(subprocess.Popen([sys.executable, "shard_router.py"], cwd=API_DIR, env=env, stdout=log, stderr=subprocess.STDOUT))
+        router = f"http://127.0.0.1:{router_port}"
+        for url, process in shards.values():
+            wait_ready(url, processes)
+        wait_ready(router, processes)
+        with httpx.Client(base_url=router, timeout=30, trust_env=False) as client:
+            yield client, {name: url for name, (url, _) in shards.items()}, {name: process for name, (_, process) in shards.items()}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+@pytest.fixture(scope="module")
+def registered(cluster, faces):
+    client, _, _ = cluster
+    for student_id in STUDENT_IDS:
+        response = client.post("/register", data={"student_id": student_id}, files={"file": ("face.png", png(faces.photo(student_id)), "image/png")})
+        assert response.status_code == 200, response.text
+    return cluster
+
+
+def test_registrations_land_on_the_owning_shard(registered):
+    client, urls, _ = registered
+    owners = HashRing(SHARDS).partition(STUDENT_IDS)
+    for name, url in urls.items():
+        assert httpx.get(url + "/health/ready", trust_env=False).json()["gallery_size"] == len(owners.get(name, []))
+    assert client.get("/health/ready").json()["gallery_size"] == len(STUDENT_IDS)
+
+    # Only the owner knows the student
+    student_id = STUDENT_IDS[0]
+    owner = HashRing(SHARDS).shard_for(student_id)
+    for name, url in urls.items():
+        response = httpx.post(url + "/verify", data={"student_id": student_id}, files={"file": ("x.png", b"x")}, trust_env=False)
+        assert (response.status_code != 404) == (name == owner)
+
+
+def test_verification_through_the_router(registered, faces):
+    client, _, _ = registered
+    retake = png(faces.retake("s5"))
+    response = client.post("/verify", data={"student_id": "s5"}, files={"file": ("x.png", retake, "image/png")})
+    assert response.json()["matched"]
+    response = client.post("/verify", data={"student_id": "s6"}, files={"file": ("x.png", retake, "image/png")})
+    assert not response.json()["matched"]
+
+
+def test_scatter_gather_returns_the_merged_top_k(registered, faces):
+    client, urls, _ = registered
+    retake = png(faces.retake("s7"))
+    result = client.post("/verify", data={"top_k": 5}, files={"file": ("x.png", retake, "image/png")}).json()
+    assert result["matched"] and result["student_id"] == "s7"
+    distances = [candidate["distance"] for candidate in result["candidates"]]
+    assert len(distances) == 5 and distances == sorted(distances)
+
+    # Same as asking every shard for its top 5 of the base64 embedding and merging
+    embedded = httpx.post(urls["east"] + "/embed", files=[("files", ("x.png", retake, "image/png"))], trust_env=False).json()[0]
+    per_shard = [
+        httpx.post(url + "/identify/embeddings", json={"embeddings": [embedded["embedding"]], "top_k": 5}, trust_env=False).json()[0]
+        for url in urls.values()
+    ]
+    expected = merge_identifications(per_shard, 5)
+    assert result["candidates"] == expected["candidates"]
+    assert len({HashRing(SHARDS).shard_for(candidate["student_id"]) for candidate in result["candidates"]}) > 1
+
+    # A roster limits the search to its students
+    roster = ["s1", "s2", "s3"]
+    result = client.post("/verify", data={"top_k": 5, "candidate_ids": roster}, files={"file": ("x.png", retake, "image/png")}).json()
+    assert not result["matched"]
+    assert sorted(candidate["student_id"] for candidate in result["candidates"]) == roster
+
+
+def test_batch_through_the_router(registered, faces):
+    client, _, _ = registered
+    student_ids = ["s1", "s2", "s3", "s4"]
+    files = [("files", (f"{i}.png", png(faces.retake(student_id)), "image/png")) for i, student_id in enumerate(student_ids)]
+
+    results = client.post("/verify/batch", data={"student_ids": student_ids}, files=files).json()
+    assert [result["matched"] for result in results] == [True] * 4
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+
+    results = client.post("/verify/batch", files=files).json()
+    assert [result["student_id"] for result in results] == student_ids
+
+
+def test_group_roll_call_merges_shards(registered, faces):
+    client, _, _ = registered
+    present = ["s8", "s9", "s10", "s11", "s12"]
+    files = [("files", (f"{i}.png", png(faces.retake(student_id)), "image/png")) for i, student_id in enumerate(present)]
+    files.append(("files", ("visitor.png", png(faces.photo("visitor")), "image/png")))
+    roster = STUDENT_IDS[:16]
+    assert len(HashRing(SHARDS).partition(roster)) > 1
+
+    result = client.post("/identify/group", data={"candidate_ids": roster}, files=files).json()
+    assert {(match["student_id"], match["image_index"]) for match in result["matches"]} == {(student_id, i) for i, student_id in enumerate(present)}
+    assert [face["image_index"] for face in result["unmatched_faces"]] == [len(present)]
+    assert result["roster_size"] == len(roster)
+
+
+def test_a_dead_shard_fails_searches_with_503(registered, faces):
+    client, _, processes = registered
+    ring = HashRing(SHARDS)
+    processes["north"].terminate()
+    processes["north"].wait(timeout=30)
+
+    retake = png(faces.retake("s7"))
+    response = client.post("/verify", files={"file": ("x.png", retake, "image/png")})
+    assert response.status_code == 503
+    assert response.json()["matched"] is False
+    assert client.get("/health/ready").status_code == 503
+
+    # Requests that only need live shards still work
+    alive = next(student_id for student_id in STUDENT_IDS if ring.shard_for(student_id) != "north")
+    response = client.post("/verify", data={"student_id": alive}, files={"file": ("x.png", png(faces.retake(alive)), "image/png")})
+    assert response.json()["matched"]
+    dead = next(student_id for student_id in STUDENT_IDS if ring.shard_for(student_id) == "north")
+    response = client.post("/register", data={"student_id": dead}, files={"file": ("x.png", retake, "image/png")})
+    assert response.status_code == 503
@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from sharding import HashRing, decode_embedding, encode_embedding, merge_groups, merge_identifications, parse_shards
+
+STUDENT_IDS = [f"student-{i}" for i in range(3000)]
+
+
+def test_placement_is_stable_and_balanced():
+    ring = HashRing(["a", "b", "c"])
+    placement = {student_id: ring.shard_for(student_id) for student_id in STUDENT_IDS}
+    assert placement == {student_id: HashRing(["c", "b", "a"]).shard_for(student_id) for student_id in STUDENT_IDS}
+    counts = [list(placement.values()).count(shard) for shard in "abc"]
+    assert min(counts) > len(STUDENT_IDS) / 3 * 0.7
+
+    groups = ring.partition(STUDENT_IDS[:100])
+    assert sorted(sum(groups.values(), [])) == sorted(STUDENT_IDS[:100])
+    assert all(ring.shard_for(student_id) == shard for shard, ids in groups.items() for student_id in ids)
+
+
+def test_adding_a_shard_only_moves_students_onto_it():
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [student_id for student_id in STUDENT_IDS if before.shard_for(student_id) != after.shard_for(student_id)]
+    assert all(after.shard_for(student_id) == "d" for student_id in moved)
+    assert 0.15 < len(moved) / len(STUDENT_IDS) < 0.35
+
+
+def test_parse_shards():
+    # An unnamed shard keeps its place on the ring whether or not its URL ends in "/"
+    assert parse_shards("http://h1:8001/, east=http://h2:8001/,,") == [
+        ("http://h1:8001", "http://h1:8001"),
+        ("east", "http://h2:8001")
+    ]
+
+
+def test_embedding_encoding_round_trip():
+    embedding = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+    np.testing.assert_array_equal(decode_embedding(encode_embedding(embedding)), embedding)
+    np.testing.assert_array_equal(decode_embedding(encode_embedding(embedding.tolist())), embedding)
+
+
+def sharded(make_module, tmp_path, faces, student_ids, shards=("a", "b", "c")):
+    """
+    The students registered on one module per shard by owner, and on one
+    module holding them all, for comparing sharded answers with unsharded ones.
+    """
+    ring = HashRing(list(shards))
+    modules = {shard: make_module(tmp_path / shard / "gallery") for shard in shards}
+    whole = make_module(tmp_path / "whole" / "gallery")
+    for student_id in student_ids:
+        embedding = faces.embedding(student_id)
+        modules[ring.shard_for(student_id)].register_embedding(student_id, embedding)
+        whole.register_embedding(student_id, embedding)
+    assert all(len(module.gallery) for module in modules.values())
+    return ring, modules, whole
+
+
+def test_merged_identification_equals_one_gallery(make_module, tmp_path, faces):
+    student_ids = [f"s{i}" for i in range(30)]
+    _, modules, whole = sharded(make_module, tmp_path, faces, student_ids)
+    for student_id in student_ids[:10]:
+        probe = faces.probe(student_id)
+        merged = merge_identifications([module.identify_embedding(probe, top_k=5) for module in modules.values()], top_k=5)
+        expected = whole.identify_embedding(probe, top_k=5)
+        assert (merged["student_id"], merged["matched"]) == (expected["student_id"], expected["matched"]) == (student_id, True)
+        # Distances agree up to float32 rounding, which depends on the matrix sizes
+        assert [c["student_id"] for c in merged["candidates"]] == [c["student_id"] for c in expected["candidates"]]
+        assert [c["distance"] for c in merged["candidates"]] == pytest.approx([c["distance"] for c in expected["candidates"]], abs=1e-5)
+
+    # Nobody close on any shard: the answer is still a no-match
+    stranger = faces.probe("stranger")
+    merged = merge_identifications([module.identify_embedding(stranger, top_k=3) for module in modules.values()], top_k=3)
+    assert not merged["matched"] and len(merged["candidates"]) == 3
+
+
+def test_merged_groups_equal_one_gallery(make_module, tmp_path, faces):
+    student_ids = [f"s{i}" for i in range(30)]
+    ring, modules, whole = sharded(make_module, tmp_path, faces, student_ids)
+    present = student_ids[:8]
+    photos = [faces.retake(student_id) for student_id in present] + [faces.photo("visitor")]
+    group_faces, embeddings = whole.embed_group(photos)
+
+    roster = student_ids[:20]
+    merged = merge_groups([
+        module.match_group(group_faces, embeddings, ring.partition(roster).get(shard, []))
+        for shard, module in modules.items()
+    ])
+    expected = whole.match_group(group_faces, embeddings, roster)
+    assert [(m["student_id"], m["image_index"]) for m in merged["matches"]] == [(m["student_id"], m["image_index"]) for m in expected["matches"]]
+    assert merged["unmatched_faces"] == expected["unmatched_faces"]
+    assert {(match["student_id"], match["image_index"]) for match in merged["matches"]} == {(student_id, i) for i, student_id in enumerate(present)}
+    assert merged["unmatched_faces"] == [{"image_index": len(present), "facial_area": group_faces[-1]["facial_area"]}]
+    assert merged["roster_size"] == len(roster)
+
+
+def test_merge_groups_keeps_the_closest_match_per_face():
+    face = {"image_index": 0, "facial_area": {"x": 1, "y": 2, "w": 3, "h": 4}}
+    other = {"image_index": 1, "facial_area": {"x": 5, "y": 6, "w": 7, "h": 8}}
+    merged = merge_groups([
+        {"faces_detected": 2, "roster_size": 2, "matches": [dict(face, student_id="a", distance=0.2)], "unmatched_faces": [other]},
+        {"faces_detected": 2, "roster_size": 3, "matches": [dict(face, student_id="b", distance=0.1)], "unmatched_faces": [other]},
+        {"faces_detected": 2, "roster_size": 1, "matches": [dict(other, student_id="c", distance=0.25)], "unmatched_faces": [face]}
+    ])
+    assert [(match["student_id"], match["image_index"]) for match in merged["matches"]] == [("b", 0), ("c", 1)]
+    assert merged["unmatched_faces"] == []
+    assert (merged["faces_detected"], merged["roster_size"], merged["matched_count"]) == (2, 6, 2)
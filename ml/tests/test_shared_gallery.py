@@ -0,0 +1,110 @@
+import multiprocessing
+import zlib
+
+import numpy as np
+
+from conftest import DIM, ML_DIR
+from embedding_store import RegistrationLog
+
+
+def test_registrations_and_removals_reach_other_modules(make_module, faces):
+    writer = make_module(shared_gallery=True)
+    reader = make_module(shared_gallery=True)
+    assert not reader.refresh()
+
+    writer.register_embedding("a", faces.embedding("a"))
+    writer.register_embedding("b", faces.embedding("b"))
+    snapshot = reader.store._snapshot
+    assert reader.refresh()
+    # Only the new journal records were applied; the snapshot was not re-read
+    assert reader.store._snapshot == snapshot
+    assert sorted(reader.gallery.ids) == ["a", "b"]
+    assert reader.embeddings["a"] == writer.embeddings["a"]
+    assert not reader.refresh()
+
+    writer.unregister_student("a")
+    # Searches refresh first, so they never answer from a stale gallery
+    assert not reader.identify_embedding(faces.probe("a"))["student_id"] == "a"
+    assert reader.gallery.ids == ["b"]
+
+
+def test_writes_from_every_module_interleave(make_module, faces):
+    modules = [make_module(shared_gallery=True) for _ in range(3)]
+    for i in range(9):
+        modules[i % 3].register_embedding(f"s{i}", faces.embedding(f"s{i}"))
+    modules[1].unregister_student("s0")
+    for module in modules:
+        module.refresh()
+        assert sorted(module.gallery.ids) == sorted(f"s{i}" for i in range(1, 9))
+    assert sorted(make_module().gallery.ids) == sorted(f"s{i}" for i in range(1, 9))
+
+
+def test_another_module_compacting_is_followed(make_module, faces):
+    writer = make_module(shared_gallery=True)
+    reader = make_module(shared_gallery=True)
+    for student_id in ["a", "b", "c"]:
+        writer.register_embedding(student_id, faces.embedding(student_id))
+    reader.refresh()
+
+    writer.compact(background=False)
+    writer.register_embedding("d", faces.embedding("d"))
+    # The reader maps the new snapshot, then appends to the journal the writer rotated to
+    assert reader.refresh()
+    assert reader.store._snapshot == writer.store.current_snapshot()
+    reader.register_embedding("e", faces.embedding("e"))
+    assert reader.store.journal.path == writer.store.journal.path
+
+    writer.refresh()
+    assert sorted(writer.gallery.ids) == ["a", "b", "c", "d", "e"]
+    assert writer.verify_embedding("e", faces.probe("e"))["match"]
+
+
+def test_a_torn_record_is_dropped_before_appending(make_module, faces, tmp_path):
+    writer = make_module(shared_gallery=True)
+    other = make_module(shared_gallery=True)
+    writer.register_embedding("a", faces.embedding("a"))
+    other.refresh()
+
+    # A process died half way through appending a record
+    scratch = RegistrationLog(str(tmp_path / "scratch.log"))
+    scratch.open()
+    scratch.append(RegistrationLog.REGISTER, "torn", faces.embedding("torn"), {})
+    scratch.close()
+    with open(scratch.path, "rb") as f:
+        record = f.read()
+    with open(writer.store.journal.path, "ab") as f:
+        f.write(record[:len(record) // 2])
+    writer.store.counter.bump()
+
+    other.register_embedding("b", faces.embedding("b"))
+    writer.refresh()
+    assert sorted(writer.gallery.ids) == sorted(make_module().gallery.ids) == ["a", "b"]
+
+
+def _register_in_process(gallery_dir: str, prefix: str, count: int):
+    import sys
+    sys.path[:0] = [ML_DIR]
+    from face_recognition_module import FaceRecognitionModule
+
+    module = FaceRecognitionModule(
+        gallery_dir=gallery_dir, legacy_embeddings_file=None, ann_min_size=None, quality_gate=None,
+        backend="synthetic", backend_options={"dim": DIM}, shared_gallery=True, compact_after=7
+    )
+    for i in range(count):
+        student_id = f"{prefix}{i}"
+        rng = np.random.default_rng(zlib.crc32(student_id.encode("utf-8")))
+        module.register_embedding(student_id, rng.standard_normal(DIM).astype(np.float32))
+    module.compact(background=False)
+
+
+def test_concurrent_worker_processes_lose_nothing(make_module, tmp_path):
+    # Small compact_after: the workers also rotate and compact under each other
+    gallery_dir = str(tmp_path / "gallery")
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_register_in_process, args=(gallery_dir, prefix, 25)) for prefix in ("p", "q", "r")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=120)
+        assert worker.exitcode == 0
+    assert sorted(make_module().gallery.ids) == sorted(f"{prefix}{i}" for prefix in "pqr" for i in range(25))